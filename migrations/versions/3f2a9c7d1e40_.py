@@ -0,0 +1,45 @@
+"""full text search index for oferta
+
+Revision ID: 3f2a9c7d1e40
+Revises: b1638f41600e
+Create Date: 2026-10-16 22:41:05.512390
+
+The index tables are backend specific and are maintained by api/search.py.
+Existing offers are indexed afterwards with `flask reindex-busqueda`.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c7d1e40'
+down_revision = 'b1638f41600e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE oferta_fts USING fts5("
+            "titulo, descripcion, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    elif dialect == 'postgresql':
+        op.create_table('oferta_busqueda',
+        sa.Column('id_oferta', sa.Integer(), nullable=False),
+        sa.Column('documento', sa.dialects.postgresql.TSVECTOR(), nullable=False),
+        sa.ForeignKeyConstraint(['id_oferta'], ['oferta.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id_oferta')
+        )
+        op.create_index('ix_oferta_busqueda_documento', 'oferta_busqueda', ['documento'],
+                        unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TABLE oferta_fts")
+    elif dialect == 'postgresql':
+        op.drop_index('ix_oferta_busqueda_documento', table_name='oferta_busqueda')
+        op.drop_table('oferta_busqueda')
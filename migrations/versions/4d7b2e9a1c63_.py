@@ -0,0 +1,33 @@
+"""precio_ud flotante en postgres
+
+Revision ID: 4d7b2e9a1c63
+Revises: 890445d700b5
+Create Date: 2026-10-17 00:20:41.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d7b2e9a1c63'
+down_revision = '890445d700b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # El modelo declara Float desde el principio pero la tabla se creó con
+    # Integer: Postgres redondeaba los precios y, comparado con los límites
+    # decimales de precio_min/precio_max, convertía la columna a numeric sin
+    # poder usar ix_oferta_precio_ud. SQLite ya guarda los decimales tal cual.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column('oferta', 'precio_ud', type_=sa.Float(),
+                        existing_type=sa.Integer(), existing_nullable=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column('oferta', 'precio_ud', type_=sa.Integer(),
+                        existing_type=sa.Float(), existing_nullable=True,
+                        postgresql_using='round(precio_ud)::integer')
@@ -12,3 +12,6 @@ pip install pipenv
 pipenv install
 
 pipenv run upgrade
+
+# .br/.gz variants of dist/ for the static asset layer
+pipenv run flask comprimir-estaticos
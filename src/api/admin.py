@@ -1,8 +1,93 @@
   
 import os
+import logging
+from flask import flash
 from flask_admin import Admin
 from .models import db, User, Oferta
 from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import inspect
+from .cache import bump_catalogue_version
+from .identity import user_cache
+from .search import index_oferta, unindex_oferta
+from .stats import record_ofertas
+from .events import publish_event
+from .sync import tombstone_oferta
+
+log = logging.getLogger(__name__)
+
+CAMPOS_ESTADISTICAS = ("id_vendedor", "id_comprador", "esta_realizada", "ud", "precio_ud")
+
+
+def _valores_previos(model):
+    """The model's stats fields as they were loaded, before the form set them"""
+    estado = inspect(model)
+    previos = {}
+    for campo in CAMPOS_ESTADISTICAS:
+        historial = estado.attrs[campo].history
+        if historial.added:
+            previos[campo] = historial.deleted[0] if historial.deleted else None
+        else:
+            previos[campo] = getattr(model, campo)
+    return previos
+
+
+class UserView(ModelView):
+    def after_model_change(self, form, model, is_created):
+        user_cache.invalidate(model.id)
+
+    def after_model_delete(self, model):
+        user_cache.invalidate(model.id)
+
+
+class OfertaView(ModelView):
+    # Las escriben las propias escrituras, ver api/sync.py
+    form_excluded_columns = ("cambio", "borrada_en")
+
+    # Las ofertas borradas son lápidas para la sincronización: no se listan ni se editan
+    def get_query(self):
+        return super().get_query().filter(Oferta.borrada_en.is_(None))
+
+    def get_count_query(self):
+        return super().get_count_query().filter(Oferta.borrada_en.is_(None))
+
+    def get_one(self, id):
+        oferta = super().get_one(id)
+        return oferta if oferta is not None and oferta.borrada_en is None else None
+
+    # En la misma transacción que el cambio, como en routes.py: el índice de
+    # búsqueda solo tiene ofertas abiertas, las estadísticas cambian y la
+    # oferta se sella con la nueva versión del catálogo
+    def on_model_change(self, form, model, is_created):
+        # Antes del flush, que borra el historial de los atributos
+        previos = None if is_created else _valores_previos(model)
+        db.session.flush()
+        if model.esta_realizada:
+            unindex_oferta(model.id)
+        else:
+            index_oferta(model)
+        record_ofertas(nuevas=[model], retiradas=[previos] if previos else [])
+        model.cambio = bump_catalogue_version()
+        if is_created:
+            publish_event("creada", [model.serialize()])
+        elif model.esta_realizada and not previos["esta_realizada"]:
+            publish_event("comprada", [model.serialize()])
+
+    # Borrado lógico, el mismo que BorrarOfertas
+    def delete_model(self, model):
+        try:
+            self.on_model_delete(model)
+            tombstone_oferta(model)
+            db.session.commit()
+        except Exception as ex:
+            if not self.handle_view_exception(ex):
+                flash("No se ha podido borrar la oferta. %s" % ex, "error")
+                log.exception("Failed to delete record.")
+            db.session.rollback()
+            return False
+        else:
+            self.after_model_delete(model)
+        return True
+
 
 def setup_admin(app):
     app.secret_key = os.getenv('FLASK_APP_KEY', 'sample key')
@@ -11,5 +96,5 @@ def setup_admin(app):
 
 
     # Add your models here
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Oferta, db.session))
\ No newline at end of file
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(OfertaView(Oferta, db.session))
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""
+Catalogue versioning, conditional GET and an in-process response cache
+
+Every write to the offers catalogue bumps CatalogoVersion in the same
+transaction. Read endpoints decorated with @catalogo_cacheado use that
+version as their ETag and as the key of a small LRU of encoded responses,
+so a repeat read costs one primary-key lookup and no JSON encoding.
+"""
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, current_app
+from sqlalchemy import select, update
+from api.models import db, CatalogoVersion
+
+DEFAULT_CACHE_SIZE = 256
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_entries_version = None
+
+
+def get_catalogue_version():
+    version = db.session.execute(
+        select(CatalogoVersion.version).where(CatalogoVersion.id == 1)
+    ).scalar()
+    return version or 0
+
+
+def bump_catalogue_version():
+    """Bump the version inside the caller's transaction and return it,
+    commit is up to the caller. The row stays locked until then, so
+    versions commit in order."""
+    stmt = (
+        update(CatalogoVersion)
+        .where(CatalogoVersion.id == 1)
+        .values(version=CatalogoVersion.version + 1)
+    )
+    if db.session.get_bind().dialect.update_returning:
+        version = db.session.execute(stmt.returning(CatalogoVersion.version)).scalar()
+    else:
+        result = db.session.execute(stmt)
+        version = get_catalogue_version() if result.rowcount else None
+    if version is None:
+        db.session.add(CatalogoVersion(id=1, version=1))
+        version = 1
+    return version
+
+
+def _cache_get(version, key):
+    global _entries_version
+    with _lock:
+        if _entries_version != version:
+            # Entries from older versions can never be served again
+            _entries.clear()
+            _entries_version = version
+            return None
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+        return entry
+
+
+def _cache_put(version, key, entry):
+    max_size = current_app.config.get("CATALOGO_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+    with _lock:
+        if _entries_version != version:
+            return
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > max_size:
+            _entries.popitem(last=False)
+
+
+def catalogo_cacheado(view):
+    """Serve a GET view with a catalogue-version ETag and cache its 200 responses"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = get_catalogue_version()
+        etag = "v" + str(version)
+
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            key = request.full_path
+            entry = _cache_get(version, key)
+            if entry is not None:
+                body, mimetype = entry
+                response = current_app.response_class(body, status=200, mimetype=mimetype)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    _cache_put(version, key, (response.get_data(), response.mimetype))
+
+        if response.status_code in (200, 304):
+            response.set_etag(etag)
+            # Clients may keep the response but must revalidate it every time
+            response.cache_control.no_cache = True
+        return response
+    return wrapper
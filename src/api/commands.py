@@ -1,12 +1,34 @@
 
 import click
-from api.models import db, User
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from api.models import db, User, Oferta
+from api.geo import parse_coordenates, encode_geohash
+from api.search import index_ofertas, clear_index
+from api.importer import parse_csv, validate_ofertas, insert_ofertas
+from api.cache import bump_catalogue_version
+from api.hashing import PasswordHasher, hasher
+from api.serialization import select_ofertas, fetch_ofertas, orjson
+from api.export import export_chunks, FORMATOS
+from api.dataset import generate, TEST_PASSWORD
+from api.static import precompress, brotli
+from api.plans import analyze, route_queries, sequential_scans, explain
+from api.recommendations import compute_recommendations, DEFAULT_K, DEFAULT_CHUNK_SIZE
+from api.stats import find_drift, rebuild_stats
+from api.sync import compact_tombstones, tombstone_days
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
 
 """
 In this file, you can add as many commands as you want using the @app.cli.command decorator
 Flask commands are usefull to run cronjobs or tasks outside of the API but sill in integration 
 with youy database, for example: Import the price of bitcoin every night as 12am
 """
+MAX_USUARIOS_PRUEBA = 100000
+MAX_OFERTAS_PRUEBA = 1000000
+
 def setup_commands(app):
     
     """ 
@@ -15,20 +37,325 @@ def setup_commands(app):
     Note: 5 is the number of users to add
     """
     @app.cli.command("insert-test-users") # name of our command
-    @click.argument("count") # argument of out command
-    def insert_test_users(count):
+    @click.argument("count", type=click.IntRange(1, MAX_USUARIOS_PRUEBA)) # argument of out command
+    @click.option("--semilla", default=42, help="Semilla del generador")
+    def insert_test_users(count, semilla):
+        """Create COUNT test users (test_userN@test.com / 123456) spread
+        around Spain."""
         print("Creating test users")
-        for x in range(1, int(count) + 1):
-            user = User()
-            user.email = "test_user" + str(x) + "@test.com"
-            user.password = "123456"
-            user.is_active = True
-            db.session.add(user)
-            db.session.commit()
-            print("User: ", user.email, " created.")
-
+        generate(count, 0, semilla=semilla, password_hash=hasher.hash_password(TEST_PASSWORD))
         print("All test users created")
 
     @app.cli.command("insert-test-data")
-    def insert_test_data():
-        pass
\ No newline at end of file
+    @click.option("--usuarios", default=1000, type=click.IntRange(0, MAX_USUARIOS_PRUEBA),
+                  help="Usuarios a crear (0 reutiliza los existentes)")
+    @click.option("--ofertas", default=10000, type=click.IntRange(0, MAX_OFERTAS_PRUEBA),
+                  help="Ofertas a crear")
+    @click.option("--compradas", default=0.2, type=click.FloatRange(0, 1),
+                  help="Fracción de ofertas ya compradas")
+    @click.option("--semilla", default=42, help="Semilla del generador")
+    @click.option("--batch-size", default=10000, help="Filas por INSERT y transacción")
+    def insert_test_data(usuarios, ofertas, compradas, semilla, batch_size):
+        """Deterministic synthetic dataset: users across Spanish towns and
+        offers with varied units and prices, a share of them already bought.
+        Every user gets the password 123456, hashed only once."""
+        start = time.perf_counter()
+        password_hash = hasher.hash_password(TEST_PASSWORD) if usuarios else None
+        try:
+            generate(usuarios, ofertas, compradas=compradas, semilla=semilla,
+                     batch_size=batch_size, password_hash=password_hash)
+        except ValueError as err:
+            raise click.ClickException(str(err))
+        print(f"Datos de prueba creados en {time.perf_counter() - start:.1f}s")
+
+    @app.cli.command("backfill-coordenadas")
+    @click.option("--batch-size", default=1000, help="Filas por lote")
+    def backfill_coordenadas(batch_size):
+        """Parse the free-form coordenates strings into the typed lat/lng
+        columns (and the seller geohash) in batches, one commit per batch.
+        Rows whose coordinates can't be parsed are reported at the end."""
+        def backfill(model, fill_row):
+            invalid = []
+            updated = 0
+            last_id = 0
+            while True:
+                rows = (model.query
+                        .filter(model.id > last_id)
+                        .order_by(model.id)
+                        .limit(batch_size)
+                        .all())
+                if not rows:
+                    break
+                for row in rows:
+                    if fill_row(row):
+                        updated += 1
+                    else:
+                        invalid.append(row.id)
+                last_id = rows[-1].id
+                db.session.commit()
+                db.session.expunge_all()
+            return updated, invalid
+
+        def fill_user(user):
+            coords = parse_coordenates(user.coordenates)
+            if coords is None:
+                return False
+            user.lat, user.lng = coords
+            return True
+
+        def fill_oferta(oferta):
+            coords = parse_coordenates(oferta.coordenates_vendedor)
+            if coords is None:
+                return False
+            oferta.lat_vendedor, oferta.lng_vendedor = coords
+            oferta.geohash_vendedor = encode_geohash(*coords)
+            if oferta.coordenates_comprador:
+                comprador = parse_coordenates(oferta.coordenates_comprador)
+                if comprador is None:
+                    return False
+                oferta.lat_comprador, oferta.lng_comprador = comprador
+            return True
+
+        for name, model, fill_row in (("user", User, fill_user),
+                                      ("oferta", Oferta, fill_oferta)):
+            updated, invalid = backfill(model, fill_row)
+            if model is Oferta:
+                bump_catalogue_version()
+                db.session.commit()
+            print(name + ": ", updated, " filas actualizadas")
+            if invalid:
+                print(name + ": ", len(invalid), " filas sin coordenadas válidas, ids:",
+                      ", ".join(str(row_id) for row_id in invalid))
+
+    @app.cli.command("reindex-busqueda")
+    @click.option("--batch-size", default=1000, help="Ofertas por lote")
+    def reindex_busqueda(batch_size):
+        """Rebuild the full-text search index from the open offers"""
+        clear_index()
+        indexed = 0
+        last_id = 0
+        while True:
+            ofertas = (Oferta.query
+                       .filter(Oferta.id > last_id, Oferta.esta_realizada.is_(False),
+                               Oferta.borrada_en.is_(None))
+                       .order_by(Oferta.id)
+                       .limit(batch_size)
+                       .all())
+            if not ofertas:
+                break
+            index_ofertas([{"id": o.id, "titulo": o.titulo, "descripcion": o.descripcion}
+                           for o in ofertas])
+            indexed += len(ofertas)
+            last_id = ofertas[-1].id
+            db.session.commit()
+            db.session.expunge_all()
+
+        bump_catalogue_version()
+        db.session.commit()
+        print("Ofertas indexadas: ", indexed)
+
+    @app.cli.command("benchmark-hashing")
+    @click.option("--pool-sizes", default="1,2,4", help="Tamaños de pool separados por comas")
+    @click.option("--logins", default=200, help="Verificaciones por tamaño de pool")
+    def benchmark_hashing(pool_sizes, logins):
+        """Report password checks (logins) per second for several pool sizes"""
+        results = []
+        for size in [int(s) for s in pool_sizes.split(",")]:
+            bench = PasswordHasher(pool_size=size, queue_size=max(size, 1) * 4,
+                                   rounds=hasher.rounds)
+            hashed = bench.hash_password("benchmark-password")
+            concurrency = max(size, 1) * 2
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as clients:
+                list(clients.map(lambda _: bench.check_password("benchmark-password", hashed),
+                                 range(logins)))
+            elapsed = time.perf_counter() - start
+            bench.shutdown()
+            results.append({
+                "pool_size": size,
+                "rounds": bench.rounds,
+                "logins": logins,
+                "seconds": round(elapsed, 3),
+                "logins_per_second": round(logins / elapsed, 1),
+            })
+        print(json.dumps(results, indent=2))
+
+    @app.cli.command("benchmark-serializacion")
+    @click.option("--filas", default="10000,100000", help="Tamaños de tabla separados por comas")
+    @click.option("--repeticiones", default=3, help="Se reporta la mejor de N repeticiones")
+    def benchmark_serializacion(filas, repeticiones):
+        """Compare ORM entities + serialize() + stdlib json with projected
+        tuples + the fast encoder, on a scratch in-memory SQLite database"""
+        def best_of(fn):
+            timings = []
+            for _ in range(repeticiones):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        results = []
+        for n in [int(f) for f in filas.split(",")]:
+            engine = create_engine("sqlite://")
+            db.metadata.create_all(engine, tables=[User.__table__, Oferta.__table__])
+            with Session(engine) as session:
+                session.execute(insert(User), [{
+                    "id": 1, "email": "bench@test.com", "password": "-", "vehicle": False,
+                    "coordenates": "40.4,-3.7", "name": "bench"}])
+                session.execute(insert(Oferta), [{
+                    "id_vendedor": 1, "esta_realizada": i % 5 == 0,
+                    "descripcion": "Cosecha de temporada número %d" % i,
+                    "titulo": "Oferta %d" % i, "coordenates_vendedor": "40.4,-3.7",
+                    "lat_vendedor": 40.4, "lng_vendedor": -3.7,
+                    "precio_ud": 1.5 + i % 100, "ud": "kg"} for i in range(n)])
+                session.commit()
+
+                def orm_path():
+                    session.expunge_all()
+                    ofertas = session.query(Oferta).all()
+                    return json.dumps({"ofertas": [o.serialize() for o in ofertas]})
+
+                def projected_path():
+                    payload = {"ofertas": fetch_ofertas(select_ofertas(), session=session)}
+                    if orjson is not None:
+                        return orjson.dumps(payload)
+                    return json.dumps(payload)
+
+                orm_seconds = best_of(orm_path)
+                fast_seconds = best_of(projected_path)
+            engine.dispose()
+            results.append({
+                "filas": n,
+                "encoder": "orjson" if orjson is not None else "json",
+                "orm_serialize_ms": round(orm_seconds * 1000, 1),
+                "proyectado_ms": round(fast_seconds * 1000, 1),
+                "aceleracion": round(orm_seconds / fast_seconds, 2),
+            })
+        print(json.dumps(results, indent=2))
+
+    @app.cli.command("export-ofertas")
+    @click.option("--formato", type=click.Choice(list(FORMATOS)), default="ndjson")
+    @click.option("--gzip", "usar_gzip", is_flag=True, help="Comprimir la salida con gzip")
+    @click.option("--batch-size", default=1000, help="Filas leídas por lote")
+    @click.option("--salida", type=click.File("wb"), default="-", help="Fichero de salida (por defecto stdout)")
+    def export_ofertas(formato, usar_gzip, batch_size, salida):
+        """Stream every offer as NDJSON or CSV with constant memory"""
+        for chunk in export_chunks(formato, gzip=usar_gzip, batch_size=batch_size):
+            salida.write(chunk)
+
+    @app.cli.command("import-ofertas")
+    @click.argument("fichero", type=click.File("r", encoding="utf-8"))
+    @click.option("--vendedor", required=True, help="Id o email del vendedor")
+    @click.option("--formato", type=click.Choice(["json", "csv"]), default=None,
+                  help="Por defecto se deduce de la extensión del fichero")
+    @click.option("--batch-size", default=5000, help="Ofertas por INSERT y transacción")
+    @click.option("--parcial", is_flag=True, help="Importar las filas válidas aunque haya errores")
+    def import_ofertas(fichero, vendedor, formato, batch_size, parcial):
+        """Bulk import offers for one seller from a JSON list or a CSV file"""
+        user = (db.session.get(User, int(vendedor)) if vendedor.isdigit()
+                else User.query.filter_by(email=vendedor).first())
+        if user is None:
+            raise click.ClickException("Vendedor no encontrado: " + vendedor)
+
+        formato = formato or ("csv" if fichero.name.endswith(".csv") else "json")
+        content = fichero.read()
+        rows = parse_csv(content) if formato == "csv" else json.loads(content)
+        if isinstance(rows, dict):
+            rows = rows.get("ofertas", [])
+
+        start = time.perf_counter()
+        valid, errors = validate_ofertas(rows)
+        for index, messages in sorted(errors.items()):
+            print("Fila", index + 1, ":", json.dumps(messages, ensure_ascii=False))
+        if errors and not parcial:
+            raise click.ClickException(f"{len(errors)} filas con errores, no se ha importado nada")
+
+        inserted = insert_ofertas(user, valid, batch_size=batch_size)
+        print("Ofertas importadas: ", inserted, " en ", round(time.perf_counter() - start, 2), "s")
+
+    @app.cli.command("comprimir-estaticos")
+    @click.option("--dir", "directorio", default=None, help="Directorio del build (por defecto dist/)")
+    def comprimir_estaticos(directorio):
+        """Precompress the built front-end (.br and .gz next to each file),
+        run after `npm run build`. The server picks them up at startup."""
+        directorio = directorio or os.path.join(app.root_path, "../dist")
+        if brotli is None:
+            print("brotli no está instalado: solo se generan ficheros .gz")
+        escritos = precompress(directorio)
+        print(f"{escritos} ficheros comprimidos en {directorio}")
+
+    @app.cli.command("verificar-planes")
+    @click.option("--ofertas", default=0, help="Generar antes N ofertas de prueba (solo en bases de datos de pruebas)")
+    @click.option("--semilla", default=42, help="Semilla de los datos generados")
+    @click.option("--detalle", is_flag=True, help="Mostrar el plan completo de cada consulta")
+    def verificar_planes(ofertas, semilla, detalle):
+        """EXPLAIN the query behind each route and fail if any of them reads
+        a table with a sequential scan. Works on SQLite and Postgres; the
+        planner needs a realistic amount of data, hence --ofertas."""
+        if ofertas:
+            generate(max(ofertas // 20, 10), ofertas, semilla=semilla,
+                     password_hash=hasher.hash_password(TEST_PASSWORD))
+        analyze()
+
+        try:
+            consultas = route_queries()
+        except ValueError as err:
+            raise click.ClickException(str(err))
+
+        fallos = 0
+        for nombre, stmt in consultas:
+            tablas = sequential_scans(stmt)
+            if tablas:
+                fallos += 1
+                print(f"SEQ  {nombre}: recorrido secuencial de {', '.join(tablas)}")
+            else:
+                print(f"OK   {nombre}")
+            if detalle or tablas:
+                for linea in explain(stmt):
+                    print(f"       {linea}")
+        db.session.rollback()
+
+        if fallos:
+            raise click.ClickException(f"{fallos} de {len(consultas)} consultas con recorrido secuencial")
+        print(f"Las {len(consultas)} consultas usan índices")
+
+    @app.cli.command("generar-recomendaciones")
+    @click.option("--k", default=DEFAULT_K, type=click.IntRange(1, 200), help="Ofertas recomendadas por usuario")
+    @click.option("--chunk", default=DEFAULT_CHUNK_SIZE, type=click.IntRange(1), help="Usuarios por lote")
+    @click.option("--procesos", default=0, help="Procesos de cálculo (0 = uno por CPU)")
+    def generar_recomendaciones(k, chunk, procesos):
+        """Precompute the k nearest open offers of every user into the
+        recomendacion table served by GET /api/user/recomendaciones"""
+        start = time.perf_counter()
+        usuarios, filas = compute_recommendations(k=k, chunk_size=chunk, procesos=procesos or None)
+        print(f"{filas} recomendaciones para {usuarios} usuarios en "
+              f"{time.perf_counter() - start:.1f}s")
+
+    @app.cli.command("reconstruir-estadisticas")
+    @click.option("--solo-verificar", is_flag=True, help="Informar de las diferencias sin reconstruir")
+    @click.option("--mostrar", default=20, help="Diferencias a mostrar")
+    def reconstruir_estadisticas(solo_verificar, mostrar):
+        """Compare estadisticas_usuario with the counters computed from
+        oferta and, unless --solo-verificar, rebuild it from scratch"""
+        drift = find_drift()
+        db.session.rollback()
+        for id_usuario, ud, esperado, actual in drift[:mostrar]:
+            print(f"usuario {id_usuario} ud {ud!r}: esperado {esperado}, tabla {actual}")
+        print(f"{len(drift)} filas con diferencias")
+        if solo_verificar:
+            if drift:
+                raise click.ClickException("Las estadísticas no coinciden con las ofertas")
+            return
+        filas = rebuild_stats()
+        print(f"Estadísticas reconstruidas: {filas} filas")
+
+    @app.cli.command("compactar-ofertas")
+    @click.option("--dias", type=float, default=None,
+                  help="Antigüedad mínima de las ofertas borradas (por defecto OFERTAS_TOMBSTONE_DAYS)")
+    def compactar_ofertas(dias):
+        """Delete the tombstones of offers deleted more than --dias ago.
+        Meant to run on a schedule (see the cron job in render.yaml); sync
+        cursors older than the deleted tombstones get a 410 afterwards."""
+        dias = tombstone_days() if dias is None else dias
+        borradas = compact_tombstones(dias)
+        print(f"{borradas} ofertas borradas hace más de {dias:g} días eliminadas")
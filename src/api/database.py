@@ -0,0 +1,97 @@
+"""
+Database engine configuration and read-replica routing
+
+configure_database(app) reads the primary URL (DATABASE_URL), an optional
+replica (DATABASE_REPLICA_URL) and the pool settings from the environment:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT   queue pool limits
+    DB_POOL_RECYCLE                                  seconds before a connection is replaced
+    DB_POOL_PRE_PING                                 test connections on checkout (default on)
+    DB_RANDOM_PAGE_COST                              Postgres random_page_cost (default 1.1, empty to keep the server's)
+
+Handlers decorated with @solo_lectura run their queries on the replica
+when one is configured; everything else goes to the primary. So does a
+read-only handler once it writes (a flush or an INSERT/UPDATE/DELETE):
+from then on its reads stay on the primary and see their own writes. The
+replica may lag the primary by a little, so only GET handlers that
+tolerate that should use it.
+"""
+import os
+from functools import wraps
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = "replica"
+# Session.info key set once the session has written to the primary
+ESCRITO = "escrito"
+DEFAULT_SQLITE_URL = "sqlite:////tmp/test.db"
+DEFAULT_POOL_RECYCLE = 300
+# The server default of 4 assumes spinning disks: on SSD it makes the planner
+# walk the primary key instead of filter indexes like (ud, id)
+DEFAULT_RANDOM_PAGE_COST = "1.1"
+
+
+class RoutingSession(Session):
+    """db.session that sends the reads of @solo_lectura handlers to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if getattr(clause, "is_dml", False):
+            self.info[ESCRITO] = True
+        if (bind is None and not self._flushing and not self.info.get(ESCRITO)
+                and has_app_context() and g.get("solo_lectura")
+                and REPLICA_BIND in self._db.engines):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            self.info[ESCRITO] = True
+        super().flush(objects)
+
+
+def solo_lectura(fn):
+    """Run the handler's queries on the read replica, if there is one"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        g.solo_lectura = True
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _normalize_url(url):
+    return url.replace("postgres://", "postgresql://", 1)
+
+
+def engine_options(url):
+    """Pool settings from the environment for the engine of url"""
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+    backend = make_url(url).get_backend_name()
+    is_sqlite = backend == "sqlite"
+    # SQLite gets the pool sizes only when asked for: an in-memory database
+    # uses a single shared connection that doesn't accept them
+    defaults = {} if is_sqlite else {"DB_POOL_RECYCLE": DEFAULT_POOL_RECYCLE}
+    for env, option in (("DB_POOL_SIZE", "pool_size"), ("DB_MAX_OVERFLOW", "max_overflow"),
+                        ("DB_POOL_TIMEOUT", "pool_timeout"), ("DB_POOL_RECYCLE", "pool_recycle")):
+        value = os.getenv(env, defaults.get(env))
+        if value is not None and value != "":
+            options[option] = int(value)
+    random_page_cost = os.getenv("DB_RANDOM_PAGE_COST", DEFAULT_RANDOM_PAGE_COST)
+    if backend == "postgresql" and random_page_cost:
+        options["connect_args"] = {"options": f"-c random_page_cost={float(random_page_cost)}"}
+    return options
+
+
+def configure_database(app):
+    url = _normalize_url(os.getenv("DATABASE_URL") or DEFAULT_SQLITE_URL)
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+
+    replica_url = os.getenv("DATABASE_REPLICA_URL")
+    if replica_url:
+        replica_url = _normalize_url(replica_url)
+        app.config["SQLALCHEMY_BINDS"] = {
+            REPLICA_BIND: {"url": replica_url, **engine_options(replica_url)},
+        }
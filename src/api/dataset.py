@@ -0,0 +1,186 @@
+"""
+Deterministic synthetic dataset for development and load testing
+
+Users are spread around Spanish towns weighted by population, offers use
+realistic products, units and prices, and a share of them is already
+bought. Everything comes from one seeded random.Random, so the same seed
+always builds the same database. Rows are written with batched executemany
+inserts and every user shares a single precomputed bcrypt hash.
+
+Inserts go through the Core tables rather than the ORM bulk path: the ORM
+splits an executemany into a separate statement every time the set of NULL
+columns changes between rows, which bought/open offers do constantly.
+"""
+import random
+from sqlalchemy import func, select
+from api.models import db, User, Oferta
+from api.geo import encode_geohash
+from api.search import index_ofertas
+from api.cache import bump_catalogue_version
+from api.stats import record_ofertas
+
+TEST_PASSWORD = "123456"
+
+# (ciudad, lat, lng, peso aproximado por población)
+CIUDADES = (
+    ("Madrid", 40.4168, -3.7038, 33), ("Barcelona", 41.3874, 2.1686, 16),
+    ("Valencia", 39.4699, -0.3763, 8), ("Sevilla", 37.3891, -5.9845, 7),
+    ("Zaragoza", 41.6488, -0.8891, 7), ("Málaga", 36.7213, -4.4214, 6),
+    ("Murcia", 37.9922, -1.1307, 5), ("Palma", 39.5696, 2.6502, 4),
+    ("Bilbao", 43.2630, -2.9350, 4), ("Alicante", 38.3452, -0.4810, 3),
+    ("Córdoba", 37.8882, -4.7794, 3), ("Valladolid", 41.6523, -4.7245, 3),
+    ("Vigo", 42.2406, -8.7207, 3), ("Gijón", 43.5322, -5.6611, 3),
+    ("Granada", 37.1773, -3.5986, 2), ("A Coruña", 43.3623, -8.4115, 2),
+    ("Vitoria", 42.8467, -2.6716, 2), ("Almería", 36.8340, -2.4637, 2),
+    ("Badajoz", 38.8794, -6.9707, 2), ("Pamplona", 42.8125, -1.6458, 2),
+    ("Logroño", 42.4627, -2.4450, 2), ("Salamanca", 40.9701, -5.6635, 2),
+    ("Huelva", 37.2614, -6.9447, 2), ("Lleida", 41.6176, 0.6200, 2),
+    ("Jaén", 37.7796, -3.7849, 2), ("Cáceres", 39.4753, -6.3724, 1),
+    ("Albacete", 38.9943, -1.8585, 2), ("Ourense", 42.3358, -7.8639, 1),
+    ("Teruel", 40.3456, -1.1065, 1), ("Soria", 41.7636, -2.4649, 1),
+)
+
+# (producto, [(unidad, precio mínimo, precio máximo)])
+PRODUCTOS = (
+    ("Tomates", [("kg", 0.8, 3.5), ("caja", 8, 25)]),
+    ("Naranjas", [("kg", 0.5, 1.8), ("caja", 6, 18)]),
+    ("Limones", [("kg", 0.7, 2.2)]),
+    ("Patatas", [("kg", 0.4, 1.2), ("saco", 8, 20)]),
+    ("Cebollas", [("kg", 0.5, 1.5)]),
+    ("Lechugas", [("unidad", 0.5, 1.5)]),
+    ("Pimientos", [("kg", 1.2, 3.8)]),
+    ("Aceite de oliva virgen extra", [("litro", 6, 14)]),
+    ("Aceitunas", [("kg", 2, 6)]),
+    ("Almendras", [("kg", 5, 12)]),
+    ("Huevos camperos", [("docena", 2.5, 5)]),
+    ("Miel", [("kg", 8, 18)]),
+    ("Queso curado", [("kg", 12, 28)]),
+    ("Vino tinto", [("botella", 4, 25)]),
+    ("Trigo", [("tonelada", 180, 320)]),
+    ("Cebada", [("tonelada", 160, 280)]),
+    ("Fresas", [("kg", 2, 6)]),
+    ("Melocotones", [("kg", 1.2, 3.5)]),
+    ("Uvas", [("kg", 1, 3)]),
+    ("Calabacines", [("kg", 0.8, 2.5)]),
+)
+
+COLETILLAS = ("de temporada", "de la huerta", "de secano", "de regadío",
+              "de proximidad", "de primera calidad", "de cultivo ecológico", "km 0")
+
+NOMBRES = ("María", "José", "Carmen", "Antonio", "Ana", "Manuel", "Laura",
+           "Francisco", "Lucía", "David", "Isabel", "Javier", "Pilar", "Pablo",
+           "Elena", "Miguel", "Rosa", "Alejandro", "Marta", "Sergio")
+
+APELLIDOS = ("García", "Fernández", "González", "Rodríguez", "López", "Martínez",
+             "Sánchez", "Pérez", "Gómez", "Martín", "Jiménez", "Ruiz", "Hernández",
+             "Díaz", "Moreno", "Álvarez", "Romero", "Navarro", "Torres", "Domínguez")
+
+
+def _users(rng, count, first_n, password_hash, seen):
+    """User rows with unique emails and unique coordinates (a DB constraint)"""
+    weights = [c[3] for c in CIUDADES]
+    rows = []
+    n = first_n
+    while len(rows) < count:
+        _, lat0, lng0, _ = rng.choices(CIUDADES, weights)[0]
+        lat = round(rng.gauss(lat0, 0.12), 6)
+        lng = round(rng.gauss(lng0, 0.15), 6)
+        coordenates = f"{lat},{lng}"
+        if coordenates in seen:
+            continue
+        seen.add(coordenates)
+        vehicle = rng.random() < 0.6
+        rows.append({
+            "email": f"test_user{n}@test.com",
+            "password": password_hash,
+            "name": f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}",
+            "vehicle": vehicle,
+            "vehicle_consume_km": round(rng.uniform(4, 11), 1) if vehicle else None,
+            "coordenates": coordenates,
+            "lat": lat,
+            "lng": lng,
+        })
+        n += 1
+    return rows
+
+
+def _oferta(rng, vendedor, comprador):
+    producto, unidades = rng.choice(PRODUCTOS)
+    ud, minimo, maximo = rng.choice(unidades)
+    titulo = f"{producto} {rng.choice(COLETILLAS)}"
+    row = {
+        "id_vendedor": vendedor["id"],
+        "esta_realizada": comprador is not None,
+        "titulo": titulo,
+        "descripcion": f"{titulo}, venta por {ud}. Recogida en finca o entrega a convenir.",
+        "precio_ud": round(rng.uniform(minimo, maximo), 2),
+        "ud": ud,
+        "img_cosecha": None,
+        "coordenates_vendedor": vendedor["coordenates"],
+        "lat_vendedor": vendedor["lat"],
+        "lng_vendedor": vendedor["lng"],
+        "geohash_vendedor": encode_geohash(vendedor["lat"], vendedor["lng"]),
+        "id_comprador": None,
+        "coordenates_comprador": None,
+        "lat_comprador": None,
+        "lng_comprador": None,
+    }
+    if comprador is not None:
+        row.update({
+            "id_comprador": comprador["id"],
+            "coordenates_comprador": comprador["coordenates"],
+            "lat_comprador": comprador["lat"],
+            "lng_comprador": comprador["lng"],
+        })
+    return row
+
+
+def generate(usuarios, ofertas, compradas=0.2, semilla=42, batch_size=10000,
+             password_hash=None, log=print):
+    """Insert `usuarios` users and `ofertas` offers, `compradas` of them bought"""
+    rng = random.Random(semilla)
+    users_table = User.__table__
+    ofertas_table = Oferta.__table__
+    first_n = (db.session.execute(select(func.max(User.id))).scalar() or 0) + 1
+
+    seen = set(db.session.execute(select(User.coordenates)).scalars()) if usuarios else set()
+    users = _users(rng, usuarios, first_n, password_hash, seen)
+    for start in range(0, len(users), batch_size):
+        batch = users[start:start + batch_size]
+        stmt = users_table.insert().returning(users_table.c.id, sort_by_parameter_order=True)
+        for row, user_id in zip(batch, db.session.connection().execute(stmt, batch).scalars()):
+            row["id"] = user_id
+        db.session.commit()
+        log(f"Usuarios: {min(start + batch_size, len(users))}/{len(users)}")
+
+    if not ofertas:
+        return
+    if not users:
+        users = [{"id": u.id, "coordenates": u.coordenates, "lat": u.lat, "lng": u.lng}
+                 for u in User.query.filter(User.lat.isnot(None))]
+    if not users:
+        raise ValueError("No hay usuarios con coordenadas para crear ofertas")
+
+    for start in range(0, ofertas, batch_size):
+        batch = []
+        for _ in range(min(batch_size, ofertas - start)):
+            vendedor = rng.choice(users)
+            comprador = None
+            if rng.random() < compradas:
+                comprador = rng.choice(users)
+                if comprador is vendedor and len(users) > 1:
+                    comprador = users[(users.index(vendedor) + 1) % len(users)]
+            batch.append(_oferta(rng, vendedor, comprador))
+
+        # Stats first, then the version: the lock order of the routes
+        record_ofertas(nuevas=batch)
+        cambio = bump_catalogue_version()
+        for row in batch:
+            row["cambio"] = cambio
+        stmt = ofertas_table.insert().returning(ofertas_table.c.id, sort_by_parameter_order=True)
+        ids = db.session.connection().execute(stmt, batch).scalars().all()
+        index_ofertas([{"id": oferta_id, "titulo": row["titulo"],
+                        "descripcion": row["descripcion"]}
+                       for oferta_id, row in zip(ids, batch) if not row["esta_realizada"]])
+        db.session.commit()
+        log(f"Ofertas: {start + len(batch)}/{ofertas}")
@@ -0,0 +1,115 @@
+"""
+Delivery cost ranking of open offers
+
+The open offers with coordinates and price are kept in memory as NumPy
+arrays (ids, seller ids, seller position in radians and precio_ud), tagged
+with the catalogue version they were read at. A request compares that tag
+with CatalogoVersion and only reloads the arrays after a write; while one
+thread reloads, the others keep answering from the previous arrays.
+
+The cost of an offer for a buyer is
+
+    precio_ud * cantidad + distancia_km * viajes * consumo / 100 * precio del combustible
+
+with consumo in litres per 100 km, the unit of User.vehicle_consume_km,
+the great-circle distance to the seller computed for every offer at once,
+and the top K picked with argpartition instead of a full sort.
+"""
+import os
+import threading
+import numpy as np
+from sqlalchemy import select
+from api.models import db, Oferta
+from api.cache import get_catalogue_version
+from api.geo import EARTH_RADIUS_KM
+
+DEFAULT_FUEL_PRICE = 1.6
+
+
+class OfferArrays:
+    __slots__ = ("version", "ids", "vendedores", "lat", "lng", "cos_lat", "precios")
+
+    def __init__(self, version, rows):
+        self.version = version
+        columns = list(zip(*rows)) or [(), (), (), (), ()]
+        self.ids = np.asarray(columns[0], dtype=np.int64)
+        self.vendedores = np.asarray(columns[1], dtype=np.int64)
+        self.lat = np.radians(np.asarray(columns[2], dtype=np.float64))
+        self.lng = np.radians(np.asarray(columns[3], dtype=np.float64))
+        self.cos_lat = np.cos(self.lat)
+        self.precios = np.asarray(columns[4], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _load(version):
+    # Plain Core rows: the ORM result processing would double the load time
+    rows = db.session.connection().execute(
+        select(Oferta.id, Oferta.id_vendedor, Oferta.lat_vendedor,
+               Oferta.lng_vendedor, Oferta.precio_ud)
+        .where(Oferta.esta_realizada.is_(False),
+               Oferta.borrada_en.is_(None),
+               Oferta.lat_vendedor.isnot(None),
+               Oferta.lng_vendedor.isnot(None),
+               Oferta.precio_ud.isnot(None))
+        .order_by(Oferta.id)
+    ).all()
+    return OfferArrays(version, rows)
+
+
+class OfferArraysCache:
+    def __init__(self):
+        self._arrays = None
+        self._reload_lock = threading.Lock()
+
+    def get(self):
+        """Arrays for the current catalogue version, or the previous ones
+        while another thread is reloading them"""
+        version = get_catalogue_version()
+        arrays = self._arrays
+        if arrays is not None and arrays.version == version:
+            return arrays
+        if not self._reload_lock.acquire(blocking=arrays is None):
+            return arrays
+        try:
+            arrays = self._arrays
+            if arrays is None or arrays.version != version:
+                arrays = self._arrays = _load(version)
+            return arrays
+        finally:
+            self._reload_lock.release()
+
+    def clear(self):
+        self._arrays = None
+
+
+def fuel_price():
+    return float(os.getenv("FUEL_PRICE_EUR_L", DEFAULT_FUEL_PRICE))
+
+
+def rank_by_cost(arrays, lat, lng, consumo_100km, precio_combustible, cantidad=1.0,
+                 viajes=2, limite=20, excluir_vendedor=None):
+    """[(id, distancia_km, coste_viaje, coste_total)] of the limite cheapest offers"""
+    if len(arrays) == 0:
+        return []
+    phi = np.radians(lat)
+    dphi = arrays.lat - phi
+    dlmb = arrays.lng - np.radians(lng)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi) * arrays.cos_lat * np.sin(dlmb / 2) ** 2
+    distancias = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    costes_viaje = distancias * (viajes * consumo_100km / 100 * precio_combustible)
+    totales = arrays.precios * cantidad + costes_viaje
+    if excluir_vendedor is not None:
+        totales[arrays.vendedores == excluir_vendedor] = np.inf
+
+    k = min(limite, len(totales))
+    candidatos = np.argpartition(totales, k - 1)[:k] if k < len(totales) else np.arange(k)
+    # Empates por id, como el resto de listados
+    orden = candidatos[np.lexsort((arrays.ids[candidatos], totales[candidatos]))]
+    orden = orden[np.isfinite(totales[orden])]
+    return [(int(arrays.ids[i]), float(distancias[i]), float(costes_viaje[i]), float(totales[i]))
+            for i in orden]
+
+
+offer_arrays = OfferArraysCache()
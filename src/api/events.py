@@ -0,0 +1,268 @@
+"""
+Change feed of the offers catalogue over Server-Sent Events
+
+Handlers that create, buy or delete offers call publish_event() in the same
+transaction as their write, which appends a row to evento_oferta; the row
+id is the SSE event id. Events are published after bump_catalogue_version():
+the version row stays locked until commit, so event ids commit in order and
+a reader that has seen id N never finds a smaller id committed later.
+
+Each worker process runs one poller thread that reads the new rows and fans
+them out to the worker's subscribers (one bounded queue per open stream).
+That table is the bridge between gunicorn workers: on SQLite the poller
+checks it every SSE_POLL_INTERVAL seconds, on Postgres it also LISTENs to
+a NOTIFY sent by publish_event() and wakes up as soon as a write commits.
+The poller only runs while the worker has subscribers.
+
+A reconnecting EventSource sends Last-Event-ID and gets the events it
+missed from the table. If they were already purged (older than
+SSE_RETENTION_HOURS), or the client fell too far behind, it receives a
+`reinicio` event and should reload the list.
+
+An open stream doesn't hold a database connection and, with gunicorn's
+gevent worker (see Procfile), costs a greenlet instead of a worker.
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import Response, stream_with_context, current_app
+from sqlalchemy import select as sql_select, insert, delete, func, text
+from api.models import db, EventoOferta
+
+CANAL_NOTIFY = "ofertas_eventos"
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_HEARTBEAT = 15
+DEFAULT_RETENTION_HOURS = 24
+DEFAULT_QUEUE_SIZE = 1000
+BACKLOG_LIMIT = 1000
+POLL_BATCH = 500
+PURGE_EVERY_S = 300
+RETRY_MS = 3000
+
+TIPOS = ("creada", "comprada", "borrada")
+
+
+def publish_event(tipo, ofertas):
+    """Append an event with the serialized offers (or {"id": ...} for
+    deletions) inside the caller's transaction, after bump_catalogue_version()"""
+    conn = db.session.connection()
+    conn.execute(insert(EventoOferta).values(
+        tipo=tipo, datos=json.dumps({"ofertas": ofertas}, separators=(",", ":"), default=str),
+        creado_en=datetime.utcnow()))
+    if conn.dialect.name == "postgresql":
+        # Delivered to the listeners when the transaction commits
+        conn.execute(text("SELECT pg_notify(:canal, '')"), {"canal": CANAL_NOTIFY})
+
+
+def _format(event_id, tipo, datos):
+    return f"id: {event_id}\nevent: {tipo}\ndata: {datos}\n\n"
+
+
+class Subscriber:
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.overflow = False
+
+
+class OfferEvents:
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._last_id = None
+        self._wake = threading.Event()
+        self._poller = None
+        self._poller_pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = float(os.getenv("SSE_POLL_INTERVAL", DEFAULT_POLL_INTERVAL))
+        self.heartbeat = float(os.getenv("SSE_HEARTBEAT", DEFAULT_HEARTBEAT))
+        self.retention = timedelta(hours=float(os.getenv("SSE_RETENTION_HOURS", DEFAULT_RETENTION_HOURS)))
+        self.queue_size = int(os.getenv("SSE_QUEUE_SIZE", DEFAULT_QUEUE_SIZE))
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, after_id):
+        """Queue receiving every event with id > after_id from now on"""
+        subscriber = Subscriber(self.queue_size)
+        with self._lock:
+            # With other subscribers the poller is already past after_id:
+            # the stream reads the events in between from the table itself
+            if not self._subscribers:
+                self._last_id = after_id
+            self._subscribers.add(subscriber)
+            self._ensure_poller()
+        self._wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers:
+                self._last_id = None
+
+    def _ensure_poller(self):
+        # One poller per process: a thread doesn't survive gunicorn's fork
+        pid = os.getpid()
+        if self._poller is None or self._poller_pid != pid or not self._poller.is_alive():
+            self._poller = threading.Thread(target=self._run, name="ofertas-eventos", daemon=True)
+            self._poller_pid = pid
+            self._poller.start()
+
+    def _dispatch(self, rows):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            if rows and subscribers:
+                self._last_id = max(self._last_id or 0, rows[-1][0])
+        for subscriber in subscribers:
+            for row in rows:
+                try:
+                    subscriber.queue.put_nowait(row)
+                except queue.Full:
+                    subscriber.overflow = True
+                    break
+
+    def _run(self):
+        with self.app.app_context():
+            listener = self._listen()
+            last_purge = 0.0
+            while True:
+                with self._lock:
+                    after_id = self._last_id
+                if after_id is None:
+                    # Sin suscriptores: esperar a que llegue alguno
+                    self._wake.wait()
+                    self._wake.clear()
+                    continue
+                try:
+                    rows = db.session.execute(
+                        sql_select(EventoOferta.id, EventoOferta.tipo, EventoOferta.datos)
+                        .where(EventoOferta.id > after_id)
+                        .order_by(EventoOferta.id)
+                        .limit(POLL_BATCH)
+                    ).all()
+                    if time.monotonic() - last_purge > PURGE_EVERY_S:
+                        self.purge()
+                        last_purge = time.monotonic()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    current_app.logger.exception("Error leyendo eventos de ofertas")
+                    rows = []
+                finally:
+                    db.session.remove()
+                self._dispatch([tuple(row) for row in rows])
+                if len(rows) < POLL_BATCH:
+                    try:
+                        self._wait(listener)
+                    except Exception:
+                        # Connection lost: keep going by polling only
+                        current_app.logger.exception("LISTEN de eventos de ofertas interrumpido")
+                        listener = None
+
+    def _listen(self):
+        """Raw Postgres connection LISTENing to publish_event()'s NOTIFY, None elsewhere"""
+        if db.engine.dialect.name != "postgresql":
+            return None
+        raw = db.engine.raw_connection()
+        conn = raw.driver_connection
+        conn.autocommit = True
+        conn.cursor().execute(f"LISTEN {CANAL_NOTIFY}")
+        return conn
+
+    def _wait(self, listener):
+        if listener is None:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            return
+        if select.select([listener], [], [], self.poll_interval)[0]:
+            listener.poll()
+            listener.notifies.clear()
+
+    def purge(self):
+        """Delete the events older than the retention period"""
+        return db.session.execute(
+            delete(EventoOferta).where(EventoOferta.creado_en < datetime.utcnow() - self.retention)
+        ).rowcount
+
+    def stream(self, last_event_id=None):
+        """text/event-stream response starting after last_event_id, or with
+        the next event when there's none"""
+        ultimo_actual = db.session.execute(sql_select(func.max(EventoOferta.id))).scalar() or 0
+        reinicio = False
+        after_id = ultimo_actual
+        if last_event_id is not None and last_event_id < ultimo_actual:
+            primero = db.session.execute(sql_select(func.min(EventoOferta.id))).scalar()
+            # Si lo que faltaba ya se ha purgado, el cliente tiene que recargar
+            if primero <= last_event_id + 1:
+                after_id = last_event_id
+            else:
+                reinicio = True
+        elif last_event_id is not None and last_event_id > ultimo_actual:
+            # Id de otra base de datos (o de antes de recrearla)
+            reinicio = True
+
+        subscriber = self.subscribe(after_id)
+        try:
+            backlog = db.session.execute(
+                sql_select(EventoOferta.id, EventoOferta.tipo, EventoOferta.datos)
+                .where(EventoOferta.id > after_id)
+                .order_by(EventoOferta.id)
+                .limit(BACKLOG_LIMIT)
+            ).all()
+        except BaseException:
+            self.unsubscribe(subscriber)
+            raise
+        finally:
+            # Un stream abierto no retiene una conexión del pool
+            db.session.close()
+        if len(backlog) == BACKLOG_LIMIT:
+            # Demasiado atrasado: mejor recargar la lista que reenviarlo todo
+            reinicio, backlog = True, [row for row in backlog if row[0] > ultimo_actual]
+            after_id = ultimo_actual
+
+        heartbeat = self.heartbeat
+
+        def generate():
+            ultimo = after_id
+            try:
+                yield f"retry: {RETRY_MS}\n\n"
+                if reinicio:
+                    yield _format(ultimo, "reinicio", "{}")
+                for event_id, tipo, datos in backlog:
+                    ultimo = event_id
+                    yield _format(event_id, tipo, datos)
+                while True:
+                    if subscriber.overflow:
+                        # The client fell behind: drop what's queued and reload
+                        while not subscriber.queue.empty():
+                            ultimo = max(ultimo, subscriber.queue.get_nowait()[0])
+                        subscriber.overflow = False
+                        yield _format(ultimo, "reinicio", "{}")
+                        continue
+                    try:
+                        event_id, tipo, datos = subscriber.queue.get(timeout=heartbeat)
+                    except queue.Empty:
+                        yield ": ping\n\n"
+                        continue
+                    if event_id > ultimo:
+                        ultimo = event_id
+                        yield _format(event_id, tipo, datos)
+            finally:
+                self.unsubscribe(subscriber)
+
+        response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        # Sin buffering en nginx / proxies
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+
+offer_events = OfferEvents()
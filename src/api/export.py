@@ -0,0 +1,84 @@
+"""
+Streaming export of the offers table as NDJSON or CSV
+
+Rows are read with yield_per (a server-side cursor on Postgres) and encoded
+into chunks as they arrive, so memory stays flat however many offers are
+exported. Used by GET /api/ofertas/export and `flask export-ofertas`.
+"""
+import csv
+import io
+import json
+import zlib
+from api.models import db, Oferta
+from api.serialization import select_ofertas, orjson
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+DEFAULT_BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_ofertas(batch_size=DEFAULT_BATCH_SIZE, esta_realizada=None):
+    stmt = select_ofertas().order_by(Oferta.id).execution_options(yield_per=batch_size)
+    if esta_realizada is not None:
+        stmt = stmt.filter(Oferta.esta_realizada.is_(esta_realizada))
+    campos = Oferta.CAMPOS_SERIALIZADOS
+    for row in db.session.execute(stmt):
+        yield dict(zip(campos, row))
+
+
+def _buffered(pieces):
+    """Group small encoded pieces into chunks of roughly CHUNK_SIZE bytes"""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _ndjson_lines(rows):
+    if orjson is not None:
+        for row in rows:
+            yield orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+    else:
+        for row in rows:
+            yield (json.dumps(row, ensure_ascii=False) + "\n").encode()
+
+
+def _csv_lines(rows):
+    campos = Oferta.CAMPOS_SERIALIZADOS
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(campos)
+    for row in rows:
+        writer.writerow([row[campo] for campo in campos])
+        yield out.getvalue().encode()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(formato, gzip=False, batch_size=DEFAULT_BATCH_SIZE, esta_realizada=None):
+    """Encoded (and optionally gzipped) chunks of the whole offers table"""
+    rows = iter_ofertas(batch_size, esta_realizada)
+    lines = _csv_lines(rows) if formato == "csv" else _ndjson_lines(rows)
+    chunks = _buffered(lines)
+    return gzip_chunks(chunks) if gzip else chunks
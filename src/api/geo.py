@@ -0,0 +1,184 @@
+"""
+Geographic helpers: coordinate parsing, geohash encoding and distances
+"""
+import json
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+# Precision stored in Oferta.geohash_vendedor (cells of roughly 5m x 5m)
+GEOHASH_PRECISION = 9
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Cells read by a nearby search at most, see covering_prefixes()
+MAX_COVERING_CELLS = 16
+
+
+def parse_coordenates(value):
+    """Parse the free-form coordinates we store as text into (lat, lng).
+
+    Accepts "lat,lng", "{lat,lng}", "[lat, lng]" and JSON objects with
+    lat/lng (or latitude/longitude/lon) keys. Returns None when the value
+    can't be parsed or falls outside valid ranges.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith("{") and ":" in text:
+            try:
+                value = json.loads(text)
+            except ValueError:
+                return None
+        else:
+            parts = text.strip("{}[]() ").split(",")
+            if len(parts) < 2:
+                return None
+            value = parts[:2]
+
+    if isinstance(value, dict):
+        lat = value.get("lat", value.get("latitude"))
+        lng = value.get("lng", value.get("longitude", value.get("lon")))
+    elif isinstance(value, (list, tuple)) and len(value) >= 2:
+        lat, lng = value[0], value[1]
+    else:
+        return None
+
+    try:
+        lat = float(str(lat).strip())
+        lng = float(str(lng).strip())
+    except (TypeError, ValueError):
+        return None
+
+    if math.isnan(lat) or math.isnan(lng):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    """Encode a point as a geohash string of the given precision"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        rng, val = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch = (ch << 1) | 1
+            rng[0] = mid
+        else:
+            ch = ch << 1
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[ch])
+            bit = 0
+            ch = 0
+    return "".join(chars)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell_degrees(precision):
+    """(height, width) in degrees of a geohash cell"""
+    bits = 5 * precision
+    lat_bits = bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** (bits - lat_bits)
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) of the circle. The longitudes
+    aren't wrapped, they fall outside [-180, 180] across the antimeridian."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlng = math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat))
+    # A circle around a pole takes every longitude
+    if dlng >= 180.0 or abs(min_lat) == 90.0 or abs(max_lat) == 90.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lng - dlng, lng + dlng
+
+
+def _wrap_lng(lng):
+    return ((lng + 180.0) % 360.0) - 180.0
+
+
+def _steps(low, high, step):
+    """Points from low to high at most step apart, both ends included"""
+    points = []
+    while low < high:
+        points.append(low)
+        low += step
+    points.append(high)
+    return points
+
+
+def covering_prefixes(lat, lng, radius_km, max_cells=MAX_COVERING_CELLS):
+    """Geohash prefixes whose cells together cover the circle (lat, lng, radius).
+
+    Uses the finest precision at which the circle's bounding box touches at
+    most max_cells cells, so the cells are about the size of the radius and
+    what they hold tracks the offers in the circle, not the catalogue. Returns
+    an empty list when the radius is so large that the whole table must be
+    scanned.
+    """
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = _cell_degrees(precision)
+        # Upper bound of the cells the box touches, to skip sampling
+        # precisions far too fine
+        bound = ((math.ceil((max_lat - min_lat) / height) + 1)
+                 * (math.ceil((max_lng - min_lng) / width) + 1))
+        if bound > 4 * max_cells:
+            continue
+        # Sampling the box at steps no larger than a cell hits every cell it touches
+        prefixes = {encode_geohash(c_lat, _wrap_lng(c_lng), precision)
+                    for c_lat in _steps(min_lat, max_lat, height)
+                    for c_lng in _steps(min_lng, max_lng, width)}
+        if len(prefixes) <= max_cells:
+            return sorted(prefixes)
+    return []
+
+
+def prefix_range(prefix):
+    """Half-open [low, high) string range matching every geohash with prefix.
+
+    Uses only geohash characters for the upper bound so the comparison can
+    be answered from a plain b-tree index regardless of the collation. The
+    upper bound is None when the prefix is made only of 'z' characters.
+    """
+    chars = list(prefix)
+    while chars:
+        pos = _BASE32.index(chars[-1])
+        if pos + 1 < len(_BASE32):
+            chars[-1] = _BASE32[pos + 1]
+            return prefix, "".join(chars)
+        chars.pop()
+    return prefix, None
+
+
+def prefix_ranges(prefixes):
+    """prefix_range() of each prefix, contiguous ranges merged"""
+    ranges = []
+    for prefix in sorted(prefixes):
+        low, high = prefix_range(prefix)
+        if ranges and ranges[-1][1] == low:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((low, high))
+    return ranges
@@ -0,0 +1,115 @@
+"""
+Password hashing on a bounded process pool
+
+bcrypt is CPU bound (~250ms per hash at cost 12), so running it in the
+request thread lets a burst of logins starve every worker. Here hashes are
+computed in a small pool of processes and the number of in-flight hashes is
+capped: once HASH_QUEUE_SIZE are pending, new requests are shed with a 429
+instead of queuing behind them.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from api.utils import APIException
+from api.metrics import timed
+
+DEFAULT_ROUNDS = 12
+
+
+class HashingBusy(APIException):
+    status_code = 429
+
+    def __init__(self):
+        APIException.__init__(self, "Servidor ocupado, inténtalo de nuevo en unos segundos")
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed):
+    """Cost factor of a "$2b$12$..." bcrypt hash, None if it can't be read"""
+    parts = hashed.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+
+class PasswordHasher:
+    def __init__(self, app=None, pool_size=None, queue_size=None, rounds=None):
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.rounds = rounds
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.rounds is None:
+            self.rounds = int(os.getenv("BCRYPT_ROUNDS", DEFAULT_ROUNDS))
+        if self.pool_size is None:
+            self.pool_size = int(os.getenv("HASH_POOL_SIZE", os.cpu_count() or 1))
+        if self.queue_size is None:
+            self.queue_size = int(os.getenv("HASH_QUEUE_SIZE", self.pool_size * 4))
+
+    @property
+    def queue_depth(self):
+        return self._in_flight
+
+    def hash_password(self, password):
+        with timed("bcrypt"):
+            return self._run(_hashpw, password.encode(), self.rounds).decode()
+
+    def check_password(self, password, hashed):
+        with timed("bcrypt"):
+            return self._run(_checkpw, password.encode(), hashed.encode())
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _run(self, fn, *args):
+        # pool_size 0 hashes inline, handy for CLI commands and benchmarks
+        if not self.pool_size:
+            return fn(*args)
+
+        with self._lock:
+            if self._in_flight >= self.queue_size:
+                self.rejected += 1
+                raise HashingBusy()
+            self._in_flight += 1
+        try:
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _get_executor(self):
+        # One pool per process: a pool inherited through gunicorn's fork is unusable
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._executor_pid = pid
+            return self._executor
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,93 @@
+"""
+Shared current_user loader for @jwt_required routes
+
+flask_jwt_extended resolves the JWT identity through the loader registered
+here, which keeps recently seen users in a bounded LRU with a short TTL.
+An authenticated request therefore doesn't query the user table unless the
+entry is missing, expired or was invalidated by a write to that user.
+Cached users are detached from the session and must be treated as
+read-only: load the user again before modifying it.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import jsonify
+from api.models import db, User
+
+DEFAULT_TTL = 30
+DEFAULT_SIZE = 1024
+
+
+class UserCache:
+    def __init__(self, max_size=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                del self._entries[user_id]
+        return None
+
+    def put(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(int(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+user_cache = UserCache()
+
+
+def load_user(user_id):
+    """User for a JWT identity, from the cache when possible"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    db.session.expunge(user)
+    user_cache.put(user_id, user)
+    return user
+
+
+def setup_identity(app, jwt):
+    user_cache.ttl = app.config.get("USER_CACHE_TTL", DEFAULT_TTL)
+    user_cache.max_size = app.config.get("USER_CACHE_SIZE", DEFAULT_SIZE)
+
+    @jwt.user_lookup_loader
+    def user_lookup_callback(_jwt_header, jwt_data):
+        return load_user(jwt_data["sub"])
+
+    @jwt.user_lookup_error_loader
+    def user_lookup_error_callback(_jwt_header, _jwt_data):
+        return jsonify("Usuario no valido"), 400
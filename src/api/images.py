@@ -0,0 +1,361 @@
+"""
+Uploaded harvest photos and their resized derivatives
+
+An upload is stored once under the first 32 hex digits of its SHA-256
+with the extension of its format (originales/ab/<clave>.jpg), and
+Oferta.img_cosecha points at it as /api/imagenes/<clave>. Originals are
+kept for good, so they need a persistent IMAGES_DIR (required in
+production) and are bounded to IMAGE_ORIGINALS_MAX_BYTES: past it, uploads
+are rejected with 507. Every width in VARIANTES is rendered to WebP and
+JPEG with Pillow on a small process pool, right after the upload and again
+on demand if a derivative is requested before it's ready or after it was
+evicted. Derivatives live in derivadas/, a cache bounded to
+IMAGE_CACHE_MAX_BYTES: a hit refreshes the file's mtime, and when the cache
+grows past the limit the least recently used files are deleted down to
+90% of it. The mtimes are shared by every gunicorn worker, so they evict
+in the same order.
+
+Both originals and derivatives never change for a given URL, so they are
+served with a one year immutable Cache-Control.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from flask import current_app, send_file
+from PIL import Image, ImageOps, UnidentifiedImageError
+from api.utils import APIException
+from api.static import IMMUTABLE_MAX_AGE
+
+IMAGE_URL_PREFIX = "/api/imagenes/"
+IMAGE_URL = re.compile(r"^/api/imagenes/([0-9a-f]{32})$")
+CLAVE = re.compile(r"^[0-9a-f]{32}$")
+
+VARIANTES = {"miniatura": 320, "media": 960}
+# extensión: (formato de Pillow, mimetype, calidad)
+FORMATOS = {"webp": ("WEBP", "image/webp", 80), "jpg": ("JPEG", "image/jpeg", 82)}
+# formato de Pillow: extensión del original
+FORMATOS_ORIGINAL = {"JPEG": "jpg", "MPO": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+MIMETYPES_ORIGINAL = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+DEFAULT_IMAGES_DIR = os.path.join(tempfile.gettempdir(), "mercadoespanol-imagenes")
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_ORIGINALS_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Other workers store originals too: the total is read again from disk this often
+ORIGINALS_RESCAN_SECONDS = 60
+DEFAULT_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_PIXELS = 40_000_000
+EVICT_TO = 0.9
+
+
+class ImagesBusy(APIException):
+    status_code = 429
+
+    def __init__(self):
+        APIException.__init__(self, "Servidor ocupado, inténtalo de nuevo en unos segundos")
+
+
+class ImagesFull(APIException):
+    status_code = 507
+
+    def __init__(self):
+        APIException.__init__(self, "No queda espacio para más imágenes")
+
+
+def derivative_urls(img_cosecha):
+    """{variante: {extensión: url}} for an uploaded image, None for any other value"""
+    if not img_cosecha or not img_cosecha.startswith(IMAGE_URL_PREFIX):
+        return None
+    match = IMAGE_URL.match(img_cosecha)
+    if match is None:
+        return None
+    return {variante: {ext: f"{img_cosecha}/{ancho}.{ext}" for ext in FORMATOS}
+            for variante, ancho in VARIANTES.items()}
+
+
+def _render(origen, destino, ancho, formato, calidad):
+    """Write origen scaled down to ancho pixels wide into destino, returns its size"""
+    with Image.open(origen) as img:
+        # JPEG decodes directly at 1/2, 1/4 or 1/8 scale when that's enough
+        img.draft("RGB", (ancho, ancho))
+        img = ImageOps.exif_transpose(img)
+        if img.width > ancho:
+            img.thumbnail((ancho, img.height * ancho // img.width + 1), Image.Resampling.LANCZOS)
+        transparente = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        if formato == "JPEG" and transparente:
+            fondo = Image.new("RGB", img.size, (255, 255, 255))
+            fondo.paste(img.convert("RGBA"), mask=img.convert("RGBA").getchannel("A"))
+            img = fondo
+        elif img.mode not in ("RGB", "L") and not (formato == "WEBP" and img.mode == "RGBA"):
+            img = img.convert("RGBA" if transparente else "RGB")
+        tmp = f"{destino}.{os.getpid()}.tmp"
+        options = {"method": 4} if formato == "WEBP" else {"optimize": True, "progressive": True}
+        img.save(tmp, formato, quality=calidad, **options)
+    os.replace(tmp, destino)
+    return os.path.getsize(destino)
+
+
+class ImageStore:
+    def __init__(self, root=None, max_bytes=None, originals_max_bytes=None,
+                 pool_size=None, queue_size=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.originals_max_bytes = originals_max_bytes
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.max_upload_bytes = DEFAULT_MAX_UPLOAD_BYTES
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._cache_bytes = None
+        self._originals_bytes = None
+        self._originals_scanned = 0.0
+
+    def init_app(self, app):
+        if self.root is None:
+            self.root = os.getenv("IMAGES_DIR")
+        if self.root is None:
+            # The temporary directory doesn't survive a redeploy
+            if not app.debug:
+                raise ValueError("IMAGES_DIR must be set to a persistent directory in production")
+            self.root = DEFAULT_IMAGES_DIR
+        if self.max_bytes is None:
+            self.max_bytes = int(os.getenv("IMAGE_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+        if self.originals_max_bytes is None:
+            self.originals_max_bytes = int(os.getenv("IMAGE_ORIGINALS_MAX_BYTES",
+                                                     DEFAULT_ORIGINALS_MAX_BYTES))
+        if self.pool_size is None:
+            self.pool_size = int(os.getenv("IMAGE_POOL_SIZE", 2))
+        if self.queue_size is None:
+            self.queue_size = int(os.getenv("IMAGE_QUEUE_SIZE", max(self.pool_size, 1) * 8))
+        self.max_upload_bytes = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", DEFAULT_MAX_UPLOAD_BYTES))
+        # The directories are created on the first upload, so commands that
+        # never store images don't need the disk mounted
+
+    def _original_path(self, clave, ext):
+        return os.path.join(self.root, "originales", clave[:2], f"{clave}.{ext}")
+
+    def _find_original(self, clave):
+        """(path, extension) of the stored original, (None, None) if there's none"""
+        for ext in MIMETYPES_ORIGINAL:
+            path = self._original_path(clave, ext)
+            if os.path.exists(path):
+                return path, ext
+        return None, None
+
+    def _derivative_path(self, clave, ancho, ext):
+        return os.path.join(self.root, "derivadas", clave[:2], f"{clave}-{ancho}.{ext}")
+
+    def save(self, data):
+        """Store an uploaded image and start rendering its derivatives,
+        returns its URL. Raises ValueError if data isn't a supported image."""
+        if len(data) > self.max_upload_bytes:
+            raise ValueError(f"La imagen supera el máximo de {self.max_upload_bytes // (1024 * 1024)} MB")
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                formato = img.format
+                if formato not in FORMATOS_ORIGINAL:
+                    raise ValueError("Formato de imagen no soportado, usa JPEG, PNG, WebP o GIF")
+                if img.width * img.height > MAX_PIXELS:
+                    raise ValueError("La imagen tiene demasiados píxeles")
+                img.verify()
+        except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+            raise ValueError("El fichero no es una imagen válida")
+
+        clave = hashlib.sha256(data).hexdigest()[:32]
+        path = self._original_path(clave, FORMATOS_ORIGINAL[formato])
+        if not os.path.exists(path):
+            self._reserve_original(len(data))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        for ancho in VARIANTES.values():
+            for ext in FORMATOS:
+                try:
+                    self._render_async(clave, path, ancho, ext)
+                except ImagesBusy:
+                    # Se generará cuando alguien la pida
+                    pass
+        return IMAGE_URL_PREFIX + clave
+
+    def _reserve_original(self, size):
+        """Count size more bytes of originals, raises ImagesFull if that
+        passes originals_max_bytes. The count starts from disk and is read
+        again near the limit or after ORIGINALS_RESCAN_SECONDS, so uploads
+        in other workers can't push it far past the limit."""
+        with self._lock:
+            ahora = time.monotonic()
+            if (self._originals_bytes is None
+                    or self._originals_bytes + size > self.originals_max_bytes * EVICT_TO
+                    or ahora - self._originals_scanned > ORIGINALS_RESCAN_SECONDS):
+                self._originals_bytes = sum(size for _, size, _ in self._scan("originales"))
+                self._originals_scanned = ahora
+            if self._originals_bytes + size > self.originals_max_bytes:
+                raise ImagesFull()
+            self._originals_bytes += size
+
+    def _render_async(self, clave, origen, ancho, ext):
+        """Future of the derivative's rendering, shared by concurrent requests"""
+        key = (clave, ancho, ext)
+        destino = self._derivative_path(clave, ancho, ext)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            if os.path.exists(destino):
+                return None
+            if len(self._pending) >= self.queue_size:
+                raise ImagesBusy()
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            formato, _, calidad = FORMATOS[ext]
+            args = (origen, destino, ancho, formato, calidad)
+            future = self._get_executor().submit(_render, *args)
+            self._pending[key] = future
+
+        def done(future):
+            with self._lock:
+                self._pending.pop(key, None)
+            if future.exception() is None:
+                self._added(future.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def _get_executor(self):
+        # One pool per process, as in api/hashing.py; pool_size 0 renders inline
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            if self.pool_size:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.pool_size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = _InlineExecutor()
+            self._executor_pid = pid
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _scan(self, directorio="derivadas"):
+        files = []
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, directorio)):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, filename)))
+        return files
+
+    def _added(self, size):
+        with self._lock:
+            if self._cache_bytes is None:
+                self._cache_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._cache_bytes += size
+            if self._cache_bytes > self.max_bytes:
+                self._cache_bytes = self._evict()
+
+    def _evict(self):
+        """Delete the least recently used derivatives down to EVICT_TO of the
+        limit, returns the bytes left. Other workers write to the same
+        directory, so the real total is read from disk."""
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def _wait_rendered(self, clave, original, ancho, ext):
+        """Block until the derivative is on disk, rendering it if needed"""
+        future = self._render_async(clave, original, ancho, ext)
+        if future is None:
+            try:
+                os.utime(self._derivative_path(clave, ancho, ext))
+                return
+            except FileNotFoundError:
+                # Evicted between the check and now
+                future = self._render_async(clave, original, ancho, ext)
+        if future is not None:
+            future.result()
+
+    def send(self, clave, variante=None):
+        """Response with the original (variante None) or a derivative
+        ("320.webp"), rendering it first if needed"""
+        if not CLAVE.match(clave):
+            return "Not found", 404
+        original, ext_original = self._find_original(clave)
+        if original is None:
+            return "Not found", 404
+        if variante is None:
+            path = original
+            mimetype = MIMETYPES_ORIGINAL[ext_original]
+        else:
+            ancho, _, ext = variante.partition(".")
+            if ext not in FORMATOS or not ancho.isdigit() or int(ancho) not in VARIANTES.values():
+                return "Not found", 404
+            ancho = int(ancho)
+            path = self._derivative_path(clave, ancho, ext)
+            try:
+                self._wait_rendered(clave, original, ancho, ext)
+            except APIException:
+                raise
+            except FileNotFoundError:
+                # The original went away after _find_original
+                return "Not found", 404
+            except Exception:
+                current_app.logger.exception("Error generando la imagen %s/%s", clave, variante)
+                return "Internal server error", 500
+            mimetype = FORMATOS[ext][1]
+
+        try:
+            response = send_file(path, mimetype=mimetype, etag=clave + (variante or ""),
+                                 conditional=True, max_age=IMMUTABLE_MAX_AGE)
+        except FileNotFoundError:
+            if variante is None or not os.path.exists(original):
+                return "Not found", 404
+            # Derivative evicted by another worker right after rendering it,
+            # the next request renders it again
+            return "Service unavailable", 503
+        response.cache_control.immutable = True
+        return response
+
+
+class _InlineExecutor:
+    """Executor running the task in the calling thread (IMAGE_POOL_SIZE=0)"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as err:
+            future.set_exception(err)
+        return future
+
+    def shutdown(self):
+        pass
+
+
+image_store = ImageStore()
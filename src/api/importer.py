@@ -0,0 +1,91 @@
+"""
+Bulk import of offers for a single seller
+
+Used by POST /api/user/ofertas/import and `flask import-ofertas`. Rows are
+validated together with OfertaCreationSchema(many=True) and inserted with
+one executemany INSERT ... RETURNING per batch, committing once per batch
+together with the search index, the catalogue version and one `creada`
+event per batch for the SSE change feed.
+"""
+import csv
+import io
+from marshmallow import ValidationError
+from api.models import db, Oferta
+from api.schemas import OfertaCreationSchema
+from api.geo import encode_geohash
+from api.search import index_ofertas
+from api.cache import bump_catalogue_version
+from api.stats import record_ofertas
+from api.events import publish_event
+from api.serialization import rows_to_dicts
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def parse_csv(content):
+    """Rows of a CSV with a header line, empty cells are left out"""
+    reader = csv.DictReader(io.StringIO(content))
+    return [{k.strip(): v for k, v in row.items() if k and v not in (None, "")}
+            for row in reader]
+
+
+def validate_ofertas(rows):
+    """(valid rows, {row index: errors}) for raw input rows"""
+    try:
+        return OfertaCreationSchema(many=True).load(rows), {}
+    except ValidationError as err:
+        errors = err.messages
+        if not isinstance(errors, dict) or not all(isinstance(k, int) for k in errors):
+            # The payload itself isn't a list of objects
+            raise
+        valid = [data for i, data in enumerate(err.valid_data) if i not in errors]
+        return valid, errors
+
+
+def insert_ofertas(vendedor, ofertas, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert validated offers for vendedor, returns the number inserted"""
+    coords = vendedor.get_lat_lng()
+    lat, lng = coords if coords is not None else (None, None)
+    geohash = encode_geohash(lat, lng) if coords is not None else None
+
+    inserted = 0
+    for start in range(0, len(ofertas), batch_size):
+        batch = [{
+            "id_vendedor": vendedor.id,
+            "id_comprador": None,
+            "esta_realizada": False,
+            "titulo": data["titulo"],
+            "descripcion": data.get("descripcion", ""),
+            "precio_ud": data["precio_ud"],
+            "ud": data["ud"],
+            "img_cosecha": data.get("img_cosecha"),
+            "coordenates_vendedor": vendedor.coordenates,
+            "lat_vendedor": lat,
+            "lng_vendedor": lng,
+            "geohash_vendedor": geohash,
+        } for data in ofertas[start:start + batch_size]]
+
+        try:
+            # Stats before the version, the lock order of every other write;
+            # the rows are then inserted already stamped with the version
+            record_ofertas(nuevas=batch)
+            cambio = bump_catalogue_version()
+            for row in batch:
+                row["cambio"] = cambio
+            # Core insert: the ORM bulk path would split the executemany
+            # whenever img_cosecha switches between NULL and a value
+            table = Oferta.__table__
+            stmt = table.insert().returning(table.c.id, sort_by_parameter_order=True)
+            ids = db.session.connection().execute(stmt, batch).scalars().all()
+            index_ofertas([{"id": oferta_id, "titulo": row["titulo"],
+                            "descripcion": row["descripcion"]}
+                           for oferta_id, row in zip(ids, batch)])
+            publish_event("creada", rows_to_dicts(
+                [tuple({**row, "id": oferta_id}.get(campo) for campo in Oferta.CAMPOS_SERIALIZADOS)
+                 for oferta_id, row in zip(ids, batch)]))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        inserted += len(batch)
+    return inserted
@@ -1,8 +1,209 @@
 """
 Rate limiter configuration
+
+The limiter counts with the sliding-window-counter strategy: two counters
+per key (current and previous window) and a weighted sum, so every request
+reads two rows and writes one whatever the traffic. The counters live in a
+storage shared by every gunicorn worker, picked with RATELIMIT_STORAGE_URI:
+
+    sqlite:////var/tmp/ratelimit.db   (default, a file in the temp dir)
+    redis://localhost:6379            (needs the redis package)
+
+Routes with their own budget use @limiter.limit(...) with a config key, see
+LOGIN_RATE_LIMIT and RESET_PASSWORD_RATE_LIMIT.
+
+Limits are per client IP. Behind Render's proxy every request comes from
+the proxy's address, so the client is taken from the X-Forwarded-For
+entry added by the last TRUSTED_PROXIES proxies (default 1, 0 when the
+app is reached directly and the header can't be trusted).
 """
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from math import floor
+from flask import current_app
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits.storage import Storage, SlidingWindowCounterSupport
+from limits.storage.base import TimestampedSlidingWindow
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+DEFAULT_STORAGE_URI = "sqlite:///" + os.path.join(tempfile.gettempdir(), "mercadoespanol-ratelimit.db")
+DEFAULT_LIMITS = ["200 per day", "50 per hour"]
+DEFAULT_LOGIN_LIMIT = "5 per minute; 20 per hour"
+DEFAULT_RESET_PASSWORD_LIMIT = "3 per 10 minutes; 10 per day"
+DEFAULT_TRUSTED_PROXIES = 1
+
+# Expired rows are purged on roughly one write in PURGE_EVERY
+PURGE_EVERY = 1000
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """limits storage on a SQLite file, shared by every process on the host
+
+    Each window counter is a row keyed by "<key>/<window number>". The
+    sliding window check and its increment run inside one BEGIN IMMEDIATE
+    transaction, so concurrent workers can't both take the last slot.
+
+    Connections are borrowed from a per-process list of idle ones rather
+    than kept per thread: under gunicorn's gevent worker threading.local is
+    per greenlet, so every request would open its own connection.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri, wrap_exceptions=False, timeout=5, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        prefix = "sqlite:///"
+        self.path = uri[len(prefix):] if uri.startswith(prefix) and len(uri) > len(prefix) else ":memory:"
+        self.timeout = float(timeout)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+        self._create_table()
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            # None inherited through a fork
+            if self._pid != os.getpid():
+                self._idle, self._pid = [], os.getpid()
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if self._pid == os.getpid():
+                    self._idle.append(conn)
+
+    def _create_table(self):
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limit ("
+                         "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_limit_expires_at ON rate_limit (expires_at)")
+
+    def _get(self, conn, key, now):
+        row = conn.execute("SELECT count, expires_at FROM rate_limit WHERE key = ?",
+                           (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return 0, now
+        return row
+
+    def _incr(self, conn, key, expiry, amount, now):
+        if random.randrange(PURGE_EVERY) == 0:
+            conn.execute("DELETE FROM rate_limit WHERE expires_at <= ?", (now,))
+        return conn.execute(
+            "INSERT INTO rate_limit (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now)).fetchone()[0]
+
+    def incr(self, key, expiry, amount=1):
+        with self._connection() as conn:
+            return self._incr(conn, key, expiry, amount, time.time())
+
+    def get(self, key):
+        with self._connection() as conn:
+            return self._get(conn, key, time.time())[0]
+
+    def get_expiry(self, key):
+        with self._connection() as conn:
+            return self._get(conn, key, time.time())[1]
+
+    def check(self):
+        try:
+            with self._connection() as conn:
+                conn.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM rate_limit").rowcount
+
+    def clear(self, key):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM rate_limit WHERE key = ?", (key,))
+
+    def _window(self, conn, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._get(conn, previous_key, now)[0]
+        current_count = self._get(conn, current_key, now)[0]
+        previous_ttl = 0.0
+        if previous_count:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        with self._connection() as conn:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                previous_count, previous_ttl, current_count, _ = self._window(conn, key, expiry, now)
+                allowed = floor(previous_count * previous_ttl / expiry + current_count) + amount <= limit
+                if allowed:
+                    # The current window is still read as the previous one during the next window
+                    current_key = self.sliding_window_keys(key, expiry, now)[1]
+                    self._incr(conn, current_key, 2 * expiry, amount, now)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return allowed
+
+    def get_sliding_window(self, key, expiry):
+        with self._connection() as conn:
+            return self._window(conn, key, expiry, time.time())
+
+    def clear_sliding_window(self, key, expiry):
+        for window_key in self.sliding_window_keys(key, expiry, time.time()):
+            self.clear(window_key)
+
+
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=DEFAULT_LIMITS,
+)
+
+
+def login_limit():
+    return current_app.config["LOGIN_RATE_LIMIT"]
+
+
+def reset_password_limit():
+    return current_app.config["RESET_PASSWORD_RATE_LIMIT"]
+
 
-# This will be initialized in app.py
-limiter = None
+def setup_limiter(app):
+    app.config.setdefault("RATELIMIT_STORAGE_URI",
+                          os.getenv("RATELIMIT_STORAGE_URI", DEFAULT_STORAGE_URI))
+    app.config.setdefault("RATELIMIT_STRATEGY", "sliding-window-counter")
+    app.config.setdefault("LOGIN_RATE_LIMIT",
+                          os.getenv("LOGIN_RATE_LIMIT", DEFAULT_LOGIN_LIMIT))
+    app.config.setdefault("RESET_PASSWORD_RATE_LIMIT",
+                          os.getenv("RESET_PASSWORD_RATE_LIMIT", DEFAULT_RESET_PASSWORD_LIMIT))
+    # get_remote_address reads remote_addr, which ProxyFix sets to the client
+    proxies = int(os.getenv("TRUSTED_PROXIES", DEFAULT_TRUSTED_PROXIES))
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+    limiter.init_app(app)
+    return limiter
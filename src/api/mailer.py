@@ -0,0 +1,199 @@
+"""
+Background mail dispatcher built around extension.mail
+
+Requests only persist the message in correo_pendiente and hand its id to a
+bounded in-memory queue. A worker thread per process delivers the queue
+over one authenticated SMTP connection that is reused until it has been
+idle for MAIL_IDLE_TIMEOUT seconds. Failed deliveries are retried with
+exponential backoff. The worker also polls the table, so mail left over
+from a restart or a full queue is still delivered. Rows are claimed with a
+conditional UPDATE, so several gunicorn workers never send the same row.
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from flask_mail import Message
+from sqlalchemy import select, update, or_
+from extension import mail
+from api.models import db, CorreoPendiente
+from api.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._connection = None
+        self._last_used = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MAIL_QUEUE_SIZE", 1000)
+        app.config.setdefault("MAIL_MAX_RETRIES", 5)
+        app.config.setdefault("MAIL_RETRY_BASE_SECONDS", 5)
+        app.config.setdefault("MAIL_RETRY_MAX_SECONDS", 900)
+        app.config.setdefault("MAIL_IDLE_TIMEOUT", 30)
+        app.config.setdefault("MAIL_POLL_INTERVAL", 10)
+        app.config.setdefault("MAIL_CLAIM_SECONDS", 120)
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config["MAIL_QUEUE_SIZE"])
+        # Started lazily so the thread lives in the gunicorn worker, not the master
+        app.before_request(self._ensure_started)
+
+    def enqueue(self, subject, recipients, html):
+        """Persist a message and wake the worker, returns the CorreoPendiente row"""
+        correo = CorreoPendiente(
+            destinatarios=",".join(recipients),
+            asunto=subject,
+            html=html,
+            intentos=0,
+            siguiente_intento=datetime.utcnow(),
+            fallido=False,
+        )
+        db.session.add(correo)
+        db.session.commit()
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(correo.id)
+        except queue.Full:
+            # Already persisted: the worker's next poll will pick it up
+            logger.warning("Mail queue full, correo %s deferred to polling", correo.id)
+        return correo
+
+    def pending_count(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="mail-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            last_poll = 0.0
+            while True:
+                ids = []
+                try:
+                    ids.append(self._queue.get(timeout=1.0))
+                    while True:
+                        ids.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+                try:
+                    if time.monotonic() - last_poll >= self.app.config["MAIL_POLL_INTERVAL"]:
+                        last_poll = time.monotonic()
+                        ids.extend(i for i in self._due_ids() if i not in ids)
+                    for correo_id in ids:
+                        self._deliver(correo_id)
+                    self._close_if_idle()
+                except Exception:
+                    logger.exception("Mail dispatcher error")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def _due_ids(self):
+        now = datetime.utcnow()
+        return list(db.session.execute(
+            select(CorreoPendiente.id)
+            .where(CorreoPendiente.fallido.is_(False),
+                   CorreoPendiente.siguiente_intento <= now,
+                   or_(CorreoPendiente.reservado_hasta.is_(None),
+                       CorreoPendiente.reservado_hasta < now))
+            .order_by(CorreoPendiente.id)
+            .limit(100)
+        ).scalars())
+
+    def _claim(self, correo_id):
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(CorreoPendiente)
+            .where(CorreoPendiente.id == correo_id,
+                   CorreoPendiente.fallido.is_(False),
+                   CorreoPendiente.siguiente_intento <= now,
+                   or_(CorreoPendiente.reservado_hasta.is_(None),
+                       CorreoPendiente.reservado_hasta < now))
+            .values(reservado_hasta=now + timedelta(seconds=self.app.config["MAIL_CLAIM_SECONDS"]))
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _deliver(self, correo_id):
+        if not self._claim(correo_id):
+            return
+        correo = db.session.get(CorreoPendiente, correo_id)
+        msg = Message(correo.asunto, html=correo.html,
+                      recipients=correo.destinatarios.split(","))
+        try:
+            with timed("smtp"):
+                try:
+                    self._connect().send(msg)
+                except smtplib.SMTPServerDisconnected:
+                    # The server dropped the idle connection, reconnect once
+                    self._close()
+                    self._connect().send(msg)
+        except Exception as e:
+            self._close()
+            self._retry_later(correo, e)
+            return
+
+        self._last_used = time.monotonic()
+        db.session.delete(correo)
+        db.session.commit()
+
+    def _retry_later(self, correo, error):
+        config = self.app.config
+        correo.intentos += 1
+        correo.reservado_hasta = None
+        correo.ultimo_error = str(error)[:500]
+        if correo.intentos >= config["MAIL_MAX_RETRIES"]:
+            correo.fallido = True
+            logger.error("Correo %s descartado tras %s intentos: %s",
+                         correo.id, correo.intentos, error)
+        else:
+            delay = min(config["MAIL_RETRY_BASE_SECONDS"] * 2 ** (correo.intentos - 1),
+                        config["MAIL_RETRY_MAX_SECONDS"])
+            correo.siguiente_intento = datetime.utcnow() + timedelta(seconds=delay)
+            logger.warning("Correo %s falló (intento %s), reintento en %ss: %s",
+                           correo.id, correo.intentos, delay, error)
+        db.session.commit()
+
+    def _connect(self):
+        if self._connection is None:
+            connection = mail.connect()
+            if not connection.mail.suppress:
+                connection.host = connection.configure_host()
+            self._connection = connection
+        return self._connection
+
+    def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and connection.host is not None:
+            try:
+                connection.host.quit()
+            except smtplib.SMTPException:
+                connection.host.close()
+            except OSError:
+                pass
+
+    def _close_if_idle(self):
+        if (self._connection is not None and
+                time.monotonic() - self._last_used > self.app.config["MAIL_IDLE_TIMEOUT"]):
+            self._close()
+
+
+mail_queue = MailQueue()
@@ -0,0 +1,168 @@
+"""
+Request and SQL instrumentation exposed in Prometheus text format
+
+setup_metrics(app) times every request from before_request to
+after_request and hooks SQLAlchemy's before/after_cursor_execute to count
+queries and their time per endpoint. Queries slower than SLOW_QUERY_MS are
+logged with their statement. Other costly steps (bcrypt, SMTP, JSON
+encoding) are recorded with `with timed("bcrypt"): ...` and show up per
+endpoint too.
+
+Everything is kept in memory per process: with several gunicorn workers
+each one exposes its own numbers at /metrics, which answers only to
+"Authorization: Bearer <METRICS_TOKEN>" and is a 404 while that variable
+is unset. Recording a sample is a
+perf_counter() pair and a bisect under a lock, cheap enough to leave on.
+"""
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, request, has_request_context, Response, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SLOW_QUERY_MS = 200
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, ([*v[0]], v[1])) for k, v in self._series.items())
+        for label_values, (counts, total) in series:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Tiempo de respuesta por ruta",
+    ("route", "method", "status"))
+REQUEST_QUERIES = Histogram(
+    "http_request_sql_queries", "Consultas SQL por petición",
+    ("route", "method"), buckets=COUNT_BUCKETS)
+SQL_SECONDS = Histogram(
+    "sql_query_duration_seconds", "Tiempo de cada consulta SQL por ruta",
+    ("route",))
+PHASE_SECONDS = Histogram(
+    "app_phase_duration_seconds", "Tiempo en bcrypt, SMTP o codificación JSON por ruta",
+    ("phase", "route"))
+
+HISTOGRAMS = (REQUEST_SECONDS, REQUEST_QUERIES, SQL_SECONDS, PHASE_SECONDS)
+
+
+def _current_route():
+    """Route template of the request being served, "-" outside requests"""
+    if not has_request_context():
+        return "-"
+    rule = request.url_rule
+    return rule.rule if rule is not None else "sin_ruta"
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - start, phase, _current_route())
+
+
+def render_metrics():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+def setup_metrics(app):
+    slow_query_seconds = float(os.getenv("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)) / 1000
+    metrics_token = os.getenv("METRICS_TOKEN")
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None or request.endpoint == "metrics":
+            return response
+        route = _current_route()
+        REQUEST_SECONDS.observe(time.perf_counter() - start, route, request.method,
+                                str(response.status_code))
+        REQUEST_QUERIES.observe(g.pop("metrics_queries", 0), route, request.method)
+        return response
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        route = _current_route()
+        SQL_SECONDS.observe(elapsed, route)
+        if has_request_context() and "metrics_queries" in g:
+            g.metrics_queries += 1
+        if elapsed >= slow_query_seconds:
+            app.logger.warning("Consulta lenta (%.1f ms) en %s: %s",
+                               elapsed * 1000, route, " ".join(statement.split())[:1000])
+
+    @event.listens_for(Engine, "handle_error")
+    def discard_failed_query(context):
+        # after_cursor_execute doesn't run for a failed statement
+        if context.connection is not None:
+            starts = context.connection.info.get("metrics_query_start")
+            if starts:
+                starts.pop()
+
+    @app.route("/metrics", endpoint="metrics")
+    def metrics():
+        # Sin token configurado las métricas no se exponen
+        if not metrics_token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get("Authorization", "").encode(),
+                                   f"Bearer {metrics_token}".encode()):
+            abort(401)
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    return metrics
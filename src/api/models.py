@@ -1,8 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Float,Integer,ForeignKey
+from sqlalchemy import String, Boolean, Float,Integer,ForeignKey, Text, DateTime, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
+from datetime import datetime
+from api.geo import parse_coordenates
+from api.database import RoutingSession
+from api.images import derivative_urls
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 class User(db.Model):
     __tablename__ = "user"
@@ -14,15 +18,25 @@ class User(db.Model):
     coordenates: Mapped[str] = mapped_column(String(120), nullable=False)
     name: Mapped[str] = mapped_column(String(200), nullable=False)
     vehicle_consume_km: Mapped[float] = mapped_column(Float(50), nullable=True)
+    lat: Mapped[float] = mapped_column(Float(), nullable=True)
+    lng: Mapped[float] = mapped_column(Float(), nullable=True)
     
 
 
+    def get_lat_lng(self):
+        """(lat, lng) from the typed columns, parsing coordenates as a fallback"""
+        if self.lat is not None and self.lng is not None:
+            return self.lat, self.lng
+        return parse_coordenates(self.coordenates)
+
     def serialize(self):
         return {
             "id": self.id,
             "email": self.email,
             "name":self.name,
             "coordenates":self.coordenates,
+            "lat":self.lat,
+            "lng":self.lng,
             "vehicle":self.vehicle,
             "vehicle_consume_km":self.vehicle_consume_km
 
@@ -31,6 +45,21 @@ class User(db.Model):
     
 class Oferta(db.Model):
     __tablename__="oferta"
+    __table_args__ = (
+        # Ofertas de un vendedor / comprador, paginadas por id
+        Index("ix_oferta_vendedor_id", "id_vendedor", "id"),
+        Index("ix_oferta_comprador_id", "id_comprador", "id"),
+        # Ofertas abiertas ordenadas por id: índice parcial con el mismo
+        # predicado que genera Oferta.esta_realizada.is_(False)
+        Index("ix_oferta_abiertas_id", "id",
+              sqlite_where=text("esta_realizada IS 0"),
+              postgresql_where=text("esta_realizada IS false")),
+        # Sincronización incremental: filas cambiadas después de un cursor
+        Index("ix_oferta_cambio_id", "cambio", "id"),
+        # Filtros de GET /user/ofertas por unidad y rango de precio
+        Index("ix_oferta_ud_id", "ud", "id"),
+        Index("ix_oferta_precio_ud", "precio_ud"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     id_comprador: Mapped[int] = mapped_column(Integer(), ForeignKey("user.id"), nullable=True)
@@ -43,22 +72,88 @@ class Oferta(db.Model):
     precio_ud: Mapped[float] = mapped_column(Float(), nullable=True)
     ud: Mapped[str] = mapped_column(String(200), nullable=False)
     img_cosecha: Mapped[str] = mapped_column(String(), nullable=True)
+    geohash_vendedor: Mapped[str] = mapped_column(String(12), nullable=True, index=True)
+    lat_vendedor: Mapped[float] = mapped_column(Float(), nullable=True)
+    lng_vendedor: Mapped[float] = mapped_column(Float(), nullable=True)
+    lat_comprador: Mapped[float] = mapped_column(Float(), nullable=True)
+    lng_comprador: Mapped[float] = mapped_column(Float(), nullable=True)
+    # Catalogue version of the row's last write, see api/sync.py
+    cambio: Mapped[int] = mapped_column(Integer(), nullable=False, default=0, server_default="0")
+    # Tombstone: deleted offers keep their row until `flask compactar-ofertas`
+    borrada_en: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
 
-    
-
+    # Columns returned by serialize(), also used by the projected list queries
+    CAMPOS_SERIALIZADOS = (
+        "id", "id_comprador", "id_vendedor", "esta_realizada", "descripcion",
+        "titulo", "coordenates_vendedor", "coordenates_comprador",
+        "lat_vendedor", "lng_vendedor", "lat_comprador", "lng_comprador",
+        "precio_ud", "img_cosecha",
+    )
 
     def serialize(self):
-        return {
-            "id": self.id,
-            "id_comprador": self.id_comprador,
-            "id_vendedor":self.id_vendedor,
-            "esta_realizada":self.esta_realizada,
-            "descripcion":self.descripcion,
-            "titulo":self.titulo,
-            "coordenates_vendedor":self.coordenates_vendedor,
-            "coordenates_comprador":self.coordenates_comprador,
-            "precio_ud":self.precio_ud,
-            "img_cosecha":self.img_cosecha
+        serializada = {campo: getattr(self, campo) for campo in self.CAMPOS_SERIALIZADOS}
+        serializada["img_derivadas"] = derivative_urls(self.img_cosecha)
+        return serializada
 
-            # do not serialize the password, its a security breach
-        }
\ No newline at end of file
+
+class CatalogoVersion(db.Model):
+    """Single-row counter bumped by every write to the offers catalogue"""
+    __tablename__ = "catalogo_version"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(Integer(), nullable=False, default=1)
+    # Highest version of the tombstones already compacted, older sync
+    # cursors may have missed deletions
+    compactado_hasta: Mapped[int] = mapped_column(Integer(), nullable=False, default=0,
+                                                  server_default="0")
+
+
+class CorreoPendiente(db.Model):
+    """Outbound mail waiting for the background dispatcher in api/mailer.py"""
+    __tablename__ = "correo_pendiente"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    destinatarios: Mapped[str] = mapped_column(String(600), nullable=False)
+    asunto: Mapped[str] = mapped_column(String(200), nullable=False)
+    html: Mapped[str] = mapped_column(Text(), nullable=False)
+    intentos: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    siguiente_intento: Mapped[datetime] = mapped_column(DateTime(), nullable=False, index=True)
+    reservado_hasta: Mapped[datetime] = mapped_column(DateTime(), nullable=True)
+    fallido: Mapped[bool] = mapped_column(Boolean(), nullable=False, default=False)
+    ultimo_error: Mapped[str] = mapped_column(String(500), nullable=True)
+
+
+class Recomendacion(db.Model):
+    """Nearest open offers of a user, written by `flask generar-recomendaciones`"""
+    __tablename__ = "recomendacion"
+
+    id_usuario: Mapped[int] = mapped_column(Integer(), ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    posicion: Mapped[int] = mapped_column(Integer(), primary_key=True)
+    id_oferta: Mapped[int] = mapped_column(Integer(), ForeignKey("oferta.id", ondelete="CASCADE"), nullable=False, index=True)
+    distancia_km: Mapped[float] = mapped_column(Float(), nullable=False)
+    generada_en: Mapped[datetime] = mapped_column(DateTime(), nullable=False)
+
+
+class EstadisticasUsuario(db.Model):
+    """Seller and buyer counters of a user per unit (ud), kept up to date by api/stats.py"""
+    __tablename__ = "estadisticas_usuario"
+
+    id_usuario: Mapped[int] = mapped_column(Integer(), ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    ud: Mapped[str] = mapped_column(String(200), primary_key=True)
+    abiertas: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    vendidas: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    ingresos: Mapped[float] = mapped_column(Float(), nullable=False, default=0)
+    compradas: Mapped[int] = mapped_column(Integer(), nullable=False, default=0)
+    gastado: Mapped[float] = mapped_column(Float(), nullable=False, default=0)
+
+
+class EventoOferta(db.Model):
+    """Change feed of the offers catalogue, streamed by GET /api/ofertas/stream"""
+    __tablename__ = "evento_oferta"
+    # AUTOINCREMENT: SQLite would reuse ids once the purge empties the table
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tipo: Mapped[str] = mapped_column(String(20), nullable=False)
+    datos: Mapped[str] = mapped_column(Text(), nullable=False)
+    creado_en: Mapped[datetime] = mapped_column(DateTime(), nullable=False, index=True)
@@ -0,0 +1,131 @@
+"""
+Query-plan check for the statements behind the API routes
+
+route_queries() builds the statements the routes run, with the same
+functions in api/queries.py and api/search.py and sample values taken from
+the database, and sequential_scans() EXPLAINs one of them, returning the
+tables it reads with a full scan. Used by `flask verificar-planes` and tests/test_plans.py,
+which fail when any route query falls back to a sequential scan, on SQLite
+(EXPLAIN QUERY PLAN) and Postgres (EXPLAIN (FORMAT JSON)).
+"""
+import itertools
+import json
+import re
+from sqlalchemy import select, func, text
+from api.models import db, User, Oferta, Recomendacion
+from api.search import POSTGRES_INDEX, search_statement
+from api.sync import changes_query
+from api import queries
+
+LIMITE = 51
+
+# "SCAN oferta" is a full scan, "SCAN oferta USING INDEX ..." is not
+SQLITE_FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+
+def _sample():
+    """Rows taken from the data so every filter matches something"""
+    oferta = db.session.execute(
+        select(Oferta)
+        .where(Oferta.lat_vendedor.isnot(None), Oferta.precio_ud.isnot(None))
+        .order_by(Oferta.id)
+        .offset(db.session.execute(select(func.count(Oferta.id))).scalar() // 2)
+        .limit(1)).scalar()
+    if oferta is None:
+        raise ValueError("No hay ofertas con coordenadas: genera datos con --ofertas")
+    user = db.session.execute(select(User).limit(1)).scalar()
+    id_usuario = db.session.execute(select(Recomendacion.id_usuario).limit(1)).scalar()
+    return oferta, user, id_usuario or user.id
+
+
+def _listados(oferta):
+    """GET /user/ofertas with every combination of its filters"""
+    # argumento de ofertas_page: [(parámetro de la URL, valor)]
+    filtros = {
+        "esta_realizada": [(None, None), ("esta_realizada=false", False),
+                           ("esta_realizada=true", True)],
+        "id_vendedor": [(None, None), ("id_vendedor", oferta.id_vendedor)],
+        "precio_min": [(None, None), ("precio_min", oferta.precio_ud * 0.9)],
+        "precio_max": [(None, None), ("precio_max", oferta.precio_ud * 1.1)],
+        "ud": [(None, None), ("ud", oferta.ud)],
+        "ultimo_id": [(None, 0), ("cursor", oferta.id)],
+    }
+    for opciones in itertools.product(*filtros.values()):
+        params = "&".join(param for param, _ in opciones if param)
+        argumentos = {nombre: valor for nombre, (_, valor) in zip(filtros, opciones)}
+        yield ("GET /user/ofertas" + ("?" + params if params else ""),
+               queries.ofertas_page(LIMITE, **argumentos))
+
+
+def route_queries():
+    """[(name, statement)] for the queries issued by routes.py"""
+    oferta, user, id_usuario = _sample()
+    return list(_listados(oferta)) + [
+        ("GET /ofertas/cerca",
+         queries.ofertas_cerca(oferta.lat_vendedor, oferta.lng_vendedor, 25.0)),
+        ("GET /ofertas/buscar",
+         search_statement(oferta.titulo, LIMITE)),
+        ("GET /ofertas/buscar (ofertas), GET /ofertas/coste-entrega",
+         queries.ofertas_por_ids([oferta.id, oferta.id + 1, oferta.id + 2])),
+        ("GET /user/oferta/info/<id>, DELETE /user/oferta/vendedor/borrar/<id>",
+         queries.oferta_por_id(oferta.id)),
+        ("PUT /user/oferta/comprar/<id>",
+         queries.compra(oferta.id, user, (oferta.lat_vendedor, oferta.lng_vendedor))),
+        ("GET /ofertas/cambios?since",
+         changes_query(oferta.cambio, None, LIMITE)),
+        ("GET /ofertas/cambios?since (página)",
+         changes_query(oferta.cambio, oferta.id, LIMITE)),
+        ("GET /user/recomendaciones",
+         queries.recomendaciones(id_usuario, LIMITE)),
+        ("POST /user/login, POST /resetPassword",
+         queries.usuario_por_email(user.email)),
+    ]
+
+
+def analyze():
+    """Refresh the planner statistics after loading data"""
+    if db.session.get_bind().dialect.name == "postgresql":
+        # Right after a bulk load the GIN index still has its rows in the
+        # pending list, and the planner prices it above a sequential scan
+        # until autovacuum flushes it
+        db.session.execute(text("SELECT gin_clean_pending_list(:index)"),
+                           {"index": POSTGRES_INDEX})
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+
+def _compile(stmt, dialect):
+    return str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+
+def _postgres_seq_scans(node):
+    scans = []
+    if node.get("Node Type") == "Seq Scan":
+        scans.append(node.get("Relation Name"))
+    for child in node.get("Plans", ()):
+        scans.extend(_postgres_seq_scans(child))
+    return scans
+
+
+def explain(stmt):
+    """Plan of stmt as text lines"""
+    conn = db.session.connection()
+    sql = _compile(stmt, conn.dialect)
+    if conn.dialect.name == "sqlite":
+        return [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+    return [row[0] for row in conn.exec_driver_sql("EXPLAIN " + sql)]
+
+
+def sequential_scans(stmt):
+    """Tables read with a full scan by stmt"""
+    conn = db.session.connection()
+    sql = _compile(stmt, conn.dialect)
+    if conn.dialect.name == "sqlite":
+        plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+        return [m.group(1) for m in (SQLITE_FULL_SCAN.match(line) for line in plan) if m]
+    if conn.dialect.name == "postgresql":
+        plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return _postgres_seq_scans(plan[0]["Plan"])
+    raise ValueError(f"EXPLAIN no soportado para {conn.dialect.name}")
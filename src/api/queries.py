@@ -0,0 +1,106 @@
+"""
+Statements behind the API routes that look rows up by a filter
+
+routes.py runs these, and api/plans.py EXPLAINs the very same statements
+(`flask verificar-planes`, tests/test_plans.py), so the query-plan check
+always sees what the routes send to the database.
+"""
+from sqlalchemy import select, update, and_, or_
+from api.models import User, Oferta, Recomendacion
+from api.serialization import select_ofertas
+from api.geo import covering_prefixes, prefix_ranges, bounding_box
+
+
+def ofertas_page(limite, esta_realizada=None, id_vendedor=None, precio_min=None,
+                 precio_max=None, ud=None, ultimo_id=0):
+    """GET /user/ofertas: up to limite offers after ultimo_id in id order,
+    filters left as None don't apply. The first page starts at id 0, so
+    every page is the same range read on the primary key."""
+    query = select_ofertas()
+    if esta_realizada is not None:
+        query = query.filter(Oferta.esta_realizada.is_(esta_realizada))
+    if id_vendedor is not None:
+        query = query.filter(Oferta.id_vendedor == id_vendedor)
+    if precio_min is not None:
+        query = query.filter(Oferta.precio_ud >= precio_min)
+    if precio_max is not None:
+        query = query.filter(Oferta.precio_ud <= precio_max)
+    if ud:
+        query = query.filter(Oferta.ud == ud)
+    return query.filter(Oferta.id > ultimo_id).order_by(Oferta.id).limit(limite)
+
+
+def ofertas_cerca(lat, lng, radio_km):
+    """GET /ofertas/cerca: id, lat and lng of the open offers in the geohash
+    cells that cover the circle and inside its bounding box, the caller
+    filters and sorts them by distance and loads the nearest"""
+    rangos = []
+    for bajo, alto in prefix_ranges(covering_prefixes(lat, lng, radio_km)):
+        condicion = Oferta.geohash_vendedor >= bajo
+        if alto is not None:
+            condicion = and_(condicion, Oferta.geohash_vendedor < alto)
+        rangos.append(condicion)
+
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, radio_km)
+    query = select(Oferta.id, Oferta.lat_vendedor, Oferta.lng_vendedor).where(
+        Oferta.borrada_en.is_(None),
+        Oferta.esta_realizada.is_(False),
+        Oferta.geohash_vendedor.isnot(None),
+        Oferta.lat_vendedor.between(min_lat, max_lat),
+    )
+    # Across the antimeridian the box is two longitude ranges
+    if min_lng < -180:
+        query = query.filter(or_(Oferta.lng_vendedor >= min_lng + 360,
+                                 Oferta.lng_vendedor <= max_lng))
+    elif max_lng > 180:
+        query = query.filter(or_(Oferta.lng_vendedor >= min_lng,
+                                 Oferta.lng_vendedor <= max_lng - 360))
+    else:
+        query = query.filter(Oferta.lng_vendedor.between(min_lng, max_lng))
+    if rangos:
+        query = query.filter(or_(*rangos))
+    return query
+
+
+def ofertas_por_ids(ids):
+    """Offers of a search or delivery cost ranking, in any order"""
+    return select_ofertas().filter(Oferta.id.in_(ids))
+
+
+def oferta_por_id(oferta_id):
+    return select(Oferta).where(Oferta.id == oferta_id)
+
+
+def recomendaciones(id_usuario, limite):
+    """GET /user/recomendaciones: the user's open recommended offers in order"""
+    return (
+        select_ofertas().add_columns(Recomendacion.distancia_km, Recomendacion.generada_en)
+        .join(Recomendacion, Recomendacion.id_oferta == Oferta.id)
+        .where(Recomendacion.id_usuario == id_usuario,
+               # Las compradas desde el último cálculo se omiten
+               Oferta.esta_realizada.is_(False))
+        .order_by(Recomendacion.posicion)
+        .limit(limite)
+    )
+
+
+def compra(oferta_id, user, coords):
+    """PUT /user/oferta/comprar: a single conditional UPDATE, only the first
+    buyer matches the row"""
+    return (
+        update(Oferta)
+        .where(Oferta.id == oferta_id, Oferta.esta_realizada.is_(False),
+               Oferta.borrada_en.is_(None))
+        .values(
+            esta_realizada=True,
+            id_comprador=user.id,
+            coordenates_comprador=user.coordenates,
+            lat_comprador=coords[0],
+            lng_comprador=coords[1],
+        )
+    )
+
+
+def usuario_por_email(email):
+    """POST /user/login and /resetPassword"""
+    return select(User).where(User.email == email).limit(1)
@@ -0,0 +1,153 @@
+"""
+Nearest open offers per user, precomputed in batch
+
+compute_recommendations() loads the users and the open offers with
+coordinates into NumPy arrays, puts the offers in a KD-tree over points on
+the unit sphere (the straight-line distance there grows with the
+great-circle distance, so the nearest neighbours are the same) and queries
+it for chunks of users on a pool of processes. Each user gets the k
+nearest offers that aren't their own, written to the recomendacion table
+chunk by chunk: a chunk's old rows are deleted and the new ones inserted
+in the same transaction, so readers never see a user with half a list.
+Rows of users that weren't in this run (no coordinates any more, deleted)
+are removed at the end.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import select, delete
+from api.models import db, User, Oferta, Recomendacion
+from api.geo import EARTH_RADIUS_KM
+
+DEFAULT_K = 20
+DEFAULT_CHUNK_SIZE = 2000
+
+# Set in each worker by _init_worker
+_tree = None
+_vendedores = None
+_ofertas_por_vendedor = None
+
+
+def _unit_vectors(lat, lng):
+    phi = np.radians(lat)
+    lmb = np.radians(lng)
+    cos_phi = np.cos(phi)
+    return np.column_stack((cos_phi * np.cos(lmb), cos_phi * np.sin(lmb), np.sin(phi)))
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+
+
+def _init_worker(tree, vendedores, ofertas_por_vendedor):
+    global _tree, _vendedores, _ofertas_por_vendedor
+    _tree, _vendedores, _ofertas_por_vendedor = tree, vendedores, ofertas_por_vendedor
+
+
+def _query(points, k):
+    chords, indices = _tree.query(points, k=k)
+    return chords.reshape(len(points), k), indices.reshape(len(points), k)
+
+
+def _nearest(usuarios, points, k):
+    """(usuario, posicion, indice de oferta, distancia_km) arrays for a chunk of users"""
+    n = len(_vendedores)
+    # Twice k covers most users; sellers with many of their own offers
+    # around them are asked again below with k + their offer count
+    chords, indices = _query(points, min(2 * k, n))
+    ajenas = _vendedores[indices] != usuarios[:, None]
+    rangos = np.cumsum(ajenas, axis=1)
+    elegidas = ajenas & (rangos <= k)
+
+    propias = np.array([_ofertas_por_vendedor.get(u, 0) for u in usuarios.tolist()])
+    cortas = elegidas.sum(axis=1) < np.minimum(k, n - propias)
+    elegidas[cortas] = False
+
+    filas, columnas = np.nonzero(elegidas)
+    resultado = [(usuarios[filas], rangos[filas, columnas] - 1,
+                  indices[filas, columnas], chords[filas, columnas])]
+    for fila in np.nonzero(cortas)[0]:
+        chords_u, indices_u = _query(points[fila:fila + 1], min(k + propias[fila], n))
+        seleccion = np.nonzero(_vendedores[indices_u[0]] != usuarios[fila])[0][:k]
+        resultado.append((np.full(len(seleccion), usuarios[fila]), np.arange(len(seleccion)),
+                          indices_u[0][seleccion], chords_u[0][seleccion]))
+
+    usuario, posicion, indice, chord = (np.concatenate(col) for col in zip(*resultado))
+    return usuario, posicion, indice, _chord_to_km(chord)
+
+
+def _load_users():
+    rows = db.session.execute(
+        select(User.id, User.lat, User.lng)
+        .where(User.lat.isnot(None), User.lng.isnot(None))
+        .order_by(User.id)
+    ).all()
+    columns = list(zip(*rows)) or [(), (), ()]
+    return (np.asarray(columns[0], dtype=np.int64),
+            _unit_vectors(np.asarray(columns[1], dtype=np.float64),
+                          np.asarray(columns[2], dtype=np.float64)))
+
+
+def _load_offers():
+    rows = db.session.connection().execute(
+        select(Oferta.id, Oferta.id_vendedor, Oferta.lat_vendedor, Oferta.lng_vendedor)
+        .where(Oferta.esta_realizada.is_(False),
+               Oferta.borrada_en.is_(None),
+               Oferta.lat_vendedor.isnot(None),
+               Oferta.lng_vendedor.isnot(None))
+        .order_by(Oferta.id)
+    ).all()
+    columns = list(zip(*rows)) or [(), (), (), ()]
+    return (np.asarray(columns[0], dtype=np.int64),
+            np.asarray(columns[1], dtype=np.int64),
+            _unit_vectors(np.asarray(columns[2], dtype=np.float64),
+                          np.asarray(columns[3], dtype=np.float64)))
+
+
+def _write_chunk(usuarios, resultado, ids_ofertas, generada_en):
+    usuario, posicion, indice, distancia = resultado
+    db.session.execute(delete(Recomendacion).where(Recomendacion.id_usuario.in_(usuarios.tolist())))
+    if len(usuario):
+        db.session.connection().execute(Recomendacion.__table__.insert(), [
+            {"id_usuario": u, "posicion": p, "id_oferta": o, "distancia_km": round(d, 3),
+             "generada_en": generada_en}
+            for u, p, o, d in zip(usuario.tolist(), posicion.tolist(),
+                                  ids_ofertas[indice].tolist(), distancia.tolist())
+        ])
+    db.session.commit()
+
+
+def compute_recommendations(k=DEFAULT_K, chunk_size=DEFAULT_CHUNK_SIZE, procesos=None, log=print):
+    """Rewrite the recomendacion table, returns (usuarios, filas)"""
+    generada_en = datetime.utcnow()
+    usuarios, puntos_usuarios = _load_users()
+    ids_ofertas, vendedores, puntos_ofertas = _load_offers()
+    log(f"{len(usuarios)} usuarios y {len(ids_ofertas)} ofertas abiertas con coordenadas")
+
+    filas = 0
+    if len(ids_ofertas) and len(usuarios):
+        tree = cKDTree(puntos_ofertas)
+        vendedor_ids, cuentas = np.unique(vendedores, return_counts=True)
+        ofertas_por_vendedor = dict(zip(vendedor_ids.tolist(), cuentas.tolist()))
+        procesos = procesos or os.cpu_count() or 1
+        chunks = [(usuarios[i:i + chunk_size], puntos_usuarios[i:i + chunk_size])
+                  for i in range(0, len(usuarios), chunk_size)]
+
+        # fork hands the tree to the workers without pickling it
+        context = multiprocessing.get_context(
+            "fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(tree, vendedores, ofertas_por_vendedor)) as pool:
+            resultados = pool.map(_nearest, *zip(*chunks), [k] * len(chunks))
+            for (chunk_usuarios, _), resultado in zip(chunks, resultados):
+                _write_chunk(chunk_usuarios, resultado, ids_ofertas, generada_en)
+                filas += len(resultado[0])
+                log(f"{filas} recomendaciones escritas")
+
+    db.session.execute(delete(Recomendacion).where(Recomendacion.generada_en < generada_en))
+    db.session.commit()
+    return len(usuarios), filas
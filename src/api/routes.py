@@ -2,19 +2,36 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 
-from flask import Flask, request, jsonify, url_for, Blueprint
+from flask import Flask, request, jsonify, url_for, Blueprint, Response, stream_with_context
 from api.models import db, User, Oferta
-from api.utils import generate_sitemap, APIException
+from api.utils import (
+    generate_sitemap, APIException, encode_cursor, decode_cursor, parse_bool_arg
+)
+from api.cache import catalogo_cacheado, bump_catalogue_version
+from api.serialization import fetch_ofertas, rows_to_dicts
+from api import queries
+from api.export import export_chunks, FORMATOS
+from api.importer import parse_csv, validate_ofertas, insert_ofertas
+from api.search import index_oferta, unindex_oferta, search_ofertas
+from api.geo import parse_coordenates, encode_geohash, haversine_km
 from api.schemas import (
     UserRegistrationSchema, UserLoginSchema, OfertaCreationSchema,
     PasswordResetSchema, PasswordUpdateSchema
 )
 from flask_cors import CORS
-import bcrypt
 from flask_jwt_extended import create_access_token
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask_mail import Message
-from extension import mail
+from flask_jwt_extended import jwt_required, get_current_user
+from api.mailer import mail_queue
+from api.hashing import hasher, HashingBusy
+from api.identity import user_cache
+from api.limiter import limiter, login_limit, reset_password_limit
+from api.database import solo_lectura
+from api.stats import record_ofertas, user_stats
+from api.images import image_store, derivative_urls
+from api.delivery import offer_arrays, rank_by_cost, fuel_price
+from api.events import offer_events, publish_event
+from api.sync import changes_since, tombstone_oferta, CursorCaducado
+import heapq
 import os
 import re
 from flask_jwt_extended import decode_token
@@ -25,6 +42,18 @@ from marshmallow import ValidationError
 
 url_front = os.getenv('VITE_FRONT_URL')
 
+DEFAULT_LIMITE_OFERTAS = 50
+MAX_LIMITE_OFERTAS = 200
+MAX_FILAS_IMPORTACION = 50000
+MAX_LIMITE_BUSQUEDA = 50
+MAX_RADIO_CERCA_KM = 200.0
+RADIO_INICIAL_CERCA_KM = 1.0
+MAX_LIMITE_CERCA = 100
+MAX_LIMITE_COSTE = 100
+MAX_LIMITE_RECOMENDACIONES = 200
+DEFAULT_LIMITE_CAMBIOS = 500
+MAX_LIMITE_CAMBIOS = 5000
+
 
 
 
@@ -36,6 +65,12 @@ CORS(api)
 
 
 
+# GET contadores de las cachés en memoria de este proceso
+@api.route("/estado", methods=["GET"])
+def get_estado():
+    return jsonify({"cache_usuarios": user_cache.stats()}), 200
+
+
 @api.route('/', methods=['POST', 'GET'])
 def handle_hello():
 
@@ -62,16 +97,17 @@ def user_register():
         return jsonify({"error": "El email ya está registrado"}), 400
 
     # Hash de la contraseña
-    new_pass = bcrypt.hashpw(data["password"].encode(), bcrypt.gensalt())
+    new_pass = hasher.hash_password(data["password"])
 
     # Crear nuevo usuario
     new_user = User()
     new_user.name = data["name"]
     new_user.email = data["email"]
-    new_user.password = new_pass.decode()
+    new_user.password = new_pass
     new_user.vehicle = data.get("vehicle")
     new_user.vehicle_consume_km = data.get("vehicle_consume_km")
     new_user.coordenates = data["coordenates"]
+    new_user.lat, new_user.lng = parse_coordenates(data["coordenates"])
 
     db.session.add(new_user)
     db.session.commit()
@@ -84,6 +120,7 @@ def user_register():
 
 
 @api.route('/user/resetPassword', methods=['PUT'])
+@limiter.limit(reset_password_limit)
 def user_resetPassWord():
     body = request.get_json()
     token = body.get("token")
@@ -102,11 +139,12 @@ def user_resetPassWord():
             new_password = body.get("password")
         if not new_password:
             return jsonify({"error": "Nueva contraseña es requerida"}), 400
-        hashed_password = bcrypt.hashpw(
-            new_password.encode(), bcrypt.gensalt())
-        user.password = hashed_password.decode()
+        user.password = hasher.hash_password(new_password)
         db.session.commit()
+        user_cache.invalidate(user.id)
         return jsonify({"msg": "Contraseña actualizada exitosamente"})
+    except HashingBusy:
+        raise
     except Exception as e:
         db.session.rollback()
         print(f"error: {e}")
@@ -114,6 +152,7 @@ def user_resetPassWord():
 
 # Post para logear un usuario
 @api.route("/user/login", methods=["POST"])
+@limiter.limit(login_limit)
 def user_login():
     schema = UserLoginSchema()
 
@@ -123,12 +162,20 @@ def user_login():
     except ValidationError as err:
         return jsonify({"errors": err.messages}), 400
 
-    user = User.query.filter_by(email=data["email"]).first()
+    user = db.session.execute(queries.usuario_por_email(data["email"])).scalar()
 
     if user is None:
         return jsonify({"error": "Credenciales incorrectas"}), 401
 
-    if bcrypt.checkpw(data["password"].encode(), user.password.encode()):
+    if hasher.check_password(data["password"], user.password):
+        # Actualizar el hash si se creó con otro coste de bcrypt
+        if hasher.needs_rehash(user.password):
+            try:
+                user.password = hasher.hash_password(data["password"])
+                db.session.commit()
+                user_cache.invalidate(user.id)
+            except HashingBusy:
+                pass
         user_serialize = user.serialize()
         token = create_access_token(identity=str(user_serialize["id"]))
         return jsonify({"token": token, "user": user_serialize}), 200
@@ -137,44 +184,277 @@ def user_login():
 
 # GET pedir informacion sobre un usuario
 @api.route("/user", methods=["GET"])
+@solo_lectura
 @jwt_required()
 def get_user():
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if user is None:
-        return jsonify("Usuario no valido"),400
+    user = get_current_user()
     return jsonify({"user":user.serialize()})
 
 
-# GET pedir informacion sobre todas las ofertas disponibles de todos los usuarios
-@api.route("/user/ofertas", methods=["GET"])
+# GET estadísticas de vendedor y comprador del usuario, mantenidas en cada
+# escritura de ofertas (sin agregados sobre el histórico)
+@api.route("/user/estadisticas", methods=["GET"])
+@solo_lectura
+@jwt_required()
+def get_estadisticas():
+    user = get_current_user()
+    return jsonify({"estadisticas": user_stats(user.id)}), 200
 
+
+# GET listado paginado de ofertas, con filtros opcionales
+# Paginación por cursor (keyset) ordenada por id: cada página es una consulta
+# por rango sobre la clave primaria, sin OFFSET, y cuesta lo mismo en la
+# página 1 que en la 1000.
+@api.route("/user/ofertas", methods=["GET"])
+@solo_lectura
+@catalogo_cacheado
 def get_ofertas():
+    limite = request.args.get("limite", default=DEFAULT_LIMITE_OFERTAS, type=int)
+    limite = min(max(limite, 1), MAX_LIMITE_OFERTAS)
+
+    ultimo_id = 0
+    cursor = request.args.get("cursor")
+    if cursor:
+        ultimo_id = decode_cursor(cursor).get("id")
+        if not isinstance(ultimo_id, int):
+            raise APIException("Cursor inválido", status_code=400)
+
+    # Se pide una fila de más para saber si hay página siguiente
+    ofertas = fetch_ofertas(queries.ofertas_page(
+        limite + 1,
+        esta_realizada=parse_bool_arg(request.args.get("esta_realizada")),
+        id_vendedor=request.args.get("id_vendedor", type=int),
+        precio_min=request.args.get("precio_min", type=float),
+        precio_max=request.args.get("precio_max", type=float),
+        ud=request.args.get("ud"),
+        ultimo_id=ultimo_id,
+    ))
+    hay_mas = len(ofertas) > limite
+    ofertas = ofertas[:limite]
+
+    siguiente_cursor = None
+    if hay_mas:
+        siguiente_cursor = encode_cursor({"id": ofertas[-1]["id"]})
 
-    ofertas = Oferta.query.all()
-    iterar_ofertas = [oferta.serialize() for oferta in ofertas]
-    if ofertas is None:
-        return jsonify("No hay ofertas disponibles"),404
-    return jsonify({"ofertas": iterar_ofertas}),200
+    return jsonify({
+        "ofertas": ofertas,
+        "siguiente_cursor": siguiente_cursor
+    }), 200
+
+# GET exportación completa de ofertas en streaming (NDJSON o CSV)
+@api.route("/ofertas/export", methods=["GET"])
+@solo_lectura
+def exportar_ofertas():
+    formato = request.args.get("formato", "ndjson")
+    if formato not in FORMATOS:
+        return jsonify({"error": "Formato no soportado, usa: " + ", ".join(FORMATOS)}), 400
+
+    esta_realizada = parse_bool_arg(request.args.get("esta_realizada"))
+    usar_gzip = parse_bool_arg(request.args.get("gzip"))
+    if usar_gzip is None:
+        usar_gzip = "gzip" in request.accept_encodings
+
+    chunks = export_chunks(formato, gzip=usar_gzip, esta_realizada=esta_realizada)
+    response = Response(stream_with_context(chunks), mimetype=FORMATOS[formato])
+    response.headers["Content-Disposition"] = f"attachment; filename=ofertas.{formato}"
+    response.vary.add("Accept-Encoding")
+    if usar_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+# GET ofertas abiertas cercanas a un punto, ordenadas por distancia
+@api.route("/ofertas/cerca", methods=["GET"])
+@solo_lectura
+@catalogo_cacheado
+def get_ofertas_cerca():
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    if lat is None or lng is None or parse_coordenates([lat, lng]) is None:
+        return jsonify({"error": "Parámetros lat y lng requeridos y válidos"}), 400
+
+    radio_km = request.args.get("radio", default=25.0, type=float)
+    limite = request.args.get("limite", default=20, type=int)
+    radio_km = min(max(radio_km, 0.1), MAX_RADIO_CERCA_KM)
+    limite = min(max(limite, 1), MAX_LIMITE_CERCA)
+
+    # Solo se leen id y coordenadas de las celdas geohash que cubren el
+    # círculo. Se empieza por un radio pequeño y se amplía mientras haya
+    # menos de `limite` ofertas dentro: las más cercanas son las mismas que
+    # con el radio pedido y se leen muchas menos filas.
+    radio = min(RADIO_INICIAL_CERCA_KM, radio_km)
+    while True:
+        cercanas = []
+        for oferta_id, lat_oferta, lng_oferta in db.session.execute(
+                queries.ofertas_cerca(lat, lng, radio)):
+            distancia = haversine_km(lat, lng, lat_oferta, lng_oferta)
+            if distancia <= radio:
+                cercanas.append((distancia, oferta_id))
+        if len(cercanas) >= limite or radio >= radio_km:
+            break
+        radio = min(radio * 4, radio_km)
+
+    # Solo se cargan enteras las `limite` más cercanas
+    cercanas = heapq.nsmallest(limite, cercanas)
+    ofertas = {oferta["id"]: oferta for oferta in fetch_ofertas(
+        queries.ofertas_por_ids([oferta_id for _, oferta_id in cercanas]))}
+
+    resultado = []
+    for distancia, oferta_id in cercanas:
+        oferta = ofertas.get(oferta_id)
+        # Comprada o borrada entre las dos consultas
+        if oferta is None or oferta["esta_realizada"]:
+            continue
+        oferta["distancia_km"] = round(distancia, 3)
+        resultado.append(oferta)
+
+    return jsonify({"ofertas": resultado}), 200
+
+# GET ofertas abiertas ordenadas por coste total para el comprador: precio
+# más el combustible de ir (y volver) hasta el vendedor. Con sesión iniciada,
+# la ubicación y el consumo por defecto son los del usuario y se excluyen sus
+# propias ofertas. El consumo va en litros/100 km, como en el perfil.
+@api.route("/ofertas/coste-entrega", methods=["GET"])
+@solo_lectura
+@jwt_required(optional=True)
+def get_ofertas_coste_entrega():
+    user = get_current_user()
+    lat = request.args.get("lat", type=float)
+    lng = request.args.get("lng", type=float)
+    consumo = request.args.get("consumo", type=float)
+    if user is not None:
+        if lat is None and lng is None:
+            lat, lng = user.get_lat_lng() or (None, None)
+        if consumo is None and user.vehicle:
+            consumo = user.vehicle_consume_km
+    if lat is None or lng is None or parse_coordenates([lat, lng]) is None:
+        return jsonify({"error": "Parámetros lat y lng requeridos y válidos"}), 400
+    if consumo is None or consumo < 0:
+        return jsonify({"error": "Parámetro consumo (litros/100 km) requerido"}), 400
+
+    cantidad = request.args.get("cantidad", default=1.0, type=float)
+    precio_combustible = request.args.get("precio_combustible", default=fuel_price(), type=float)
+    ida_vuelta = request.args.get("ida_vuelta", default="true").lower() != "false"
+    limite = request.args.get("limite", default=20, type=int)
+    if cantidad <= 0 or precio_combustible < 0:
+        return jsonify({"error": "cantidad y precio_combustible deben ser positivos"}), 400
+    limite = min(max(limite, 1), MAX_LIMITE_COSTE)
+
+    ranking = rank_by_cost(offer_arrays.get(), lat, lng, consumo, precio_combustible,
+                           cantidad=cantidad, viajes=2 if ida_vuelta else 1, limite=limite,
+                           excluir_vendedor=user.id if user is not None else None)
+    ofertas = {oferta["id"]: oferta for oferta in fetch_ofertas(
+        queries.ofertas_por_ids([id for id, _, _, _ in ranking]))}
+
+    resultado = []
+    for id, distancia, coste_viaje, coste_total in ranking:
+        oferta = ofertas.get(id)
+        # Comprada o borrada después de cargar los arrays
+        if oferta is None or oferta["esta_realizada"]:
+            continue
+        oferta["distancia_km"] = round(distancia, 3)
+        oferta["coste_viaje"] = round(coste_viaje, 2)
+        oferta["coste_total"] = round(coste_total, 2)
+        resultado.append(oferta)
+
+    return jsonify({
+        "ofertas": resultado,
+        "consumo": consumo,
+        "precio_combustible": precio_combustible,
+    }), 200
+
+# GET stream de cambios en ofertas (Server-Sent Events): eventos creada,
+# comprada y borrada con las ofertas serializadas. Al reconectar, el
+# navegador manda Last-Event-ID y recibe lo que se perdió; si ya no está,
+# llega un evento reinicio y hay que recargar el listado.
+@api.route("/ofertas/stream", methods=["GET"])
+@limiter.exempt
+def get_ofertas_stream():
+    ultimo = request.headers.get("Last-Event-ID") or request.args.get("desde")
+    try:
+        ultimo = int(ultimo) if ultimo is not None else None
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID debe ser un número"}), 400
+    return offer_events.stream(ultimo)
+
+# GET sincronización incremental del catálogo. Sin since se descarga desde
+# el principio, página a página (hay_mas); con el cursor de la respuesta
+# anterior solo llegan las ofertas que han cambiado desde entonces y los ids
+# de las borradas. Un 410 indica que el cursor es anterior a la última
+# compactación de borradas: hay que descargar el catálogo de nuevo.
+@api.route("/ofertas/cambios", methods=["GET"])
+@solo_lectura
+def get_ofertas_cambios():
+    limite = request.args.get("limite", default=DEFAULT_LIMITE_CAMBIOS, type=int)
+    limite = min(max(limite, 1), MAX_LIMITE_CAMBIOS)
+    try:
+        cambios = changes_since(request.args.get("since"), limite)
+    except CursorCaducado:
+        return jsonify({"error": "Cursor caducado, descarga el catálogo de nuevo",
+                        "reinicio": True}), 410
+    return jsonify(cambios), 200
+
+# GET ofertas abiertas más cercanas al usuario, precalculadas por
+# `flask generar-recomendaciones`: una lectura por la clave primaria
+# (id_usuario, posicion) de la tabla recomendacion
+@api.route("/user/recomendaciones", methods=["GET"])
+@solo_lectura
+@jwt_required()
+def get_recomendaciones():
+    user = get_current_user()
+    limite = request.args.get("limite", default=20, type=int)
+    limite = min(max(limite, 1), MAX_LIMITE_RECOMENDACIONES)
+
+    filas = db.session.execute(queries.recomendaciones(user.id, limite)).all()
+
+    ofertas = rows_to_dicts(filas, Oferta.CAMPOS_SERIALIZADOS + ("distancia_km",))
+    generadas_en = filas[0].generada_en.isoformat() if filas else None
+    return jsonify({"ofertas": ofertas, "generadas_en": generadas_en}), 200
+
+# GET búsqueda de texto en ofertas abiertas, ordenada por relevancia
+@api.route("/ofertas/buscar", methods=["GET"])
+@solo_lectura
+@catalogo_cacheado
+def buscar_ofertas():
+    q = request.args.get("q", "").strip()
+    if not q:
+        return jsonify({"error": "El parámetro q es requerido"}), 400
+
+    pagina = max(request.args.get("pagina", default=1, type=int), 1)
+    limite = request.args.get("limite", default=20, type=int)
+    limite = min(max(limite, 1), MAX_LIMITE_BUSQUEDA)
+
+    # Se pide un resultado de más para saber si hay página siguiente
+    hits = search_ofertas(q, limite + 1, (pagina - 1) * limite)
+    hay_mas = len(hits) > limite
+    hits = hits[:limite]
+
+    ofertas = {}
+    if hits:
+        ids = [oferta_id for oferta_id, _ in hits]
+        ofertas = {o["id"]: o for o in fetch_ofertas(queries.ofertas_por_ids(ids))}
+
+    resultado = []
+    for oferta_id, score in hits:
+        oferta = ofertas.get(oferta_id)
+        if oferta is None:
+            continue
+        oferta["relevancia"] = round(score, 4)
+        resultado.append(oferta)
+
+    return jsonify({"ofertas": resultado, "pagina": pagina, "hay_mas": hay_mas}), 200
 
 # GET pedir informacion sobre una oferta
 
 @api.route("/user/oferta/info/<int:oferta_id>", methods=["GET"])
+@solo_lectura
 @jwt_required()
+@catalogo_cacheado
 def get_oferta(oferta_id):
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if user is None:
-        return jsonify("Usuario no valido"),400
-    
-    oferta = Oferta.query.get(oferta_id)
+    oferta = db.session.execute(queries.oferta_por_id(oferta_id)).scalar()
 
-    if oferta is None:
+    if oferta is None or oferta.borrada_en is not None:
         return jsonify("No existe esa oferta"),400
     oferta_serializada = oferta.serialize()
-    print(oferta_serializada)
-    print(oferta)
-    print(oferta_id)
 
     return jsonify(oferta_serializada)
 
@@ -191,11 +471,7 @@ def post_ofertas():
     except ValidationError as err:
         return jsonify({"errors": err.messages}), 400
 
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-
-    if user is None:
-        return jsonify({"error": "Usuario no válido"}), 400
+    user = get_current_user()
 
     # Crear nueva oferta
     nueva_oferta = Oferta()
@@ -206,11 +482,20 @@ def post_ofertas():
     nueva_oferta.descripcion = data.get("descripcion")
     nueva_oferta.titulo = data["titulo"]
     nueva_oferta.coordenates_vendedor = user.coordenates
+    coords = user.get_lat_lng()
+    if coords is not None:
+        nueva_oferta.lat_vendedor, nueva_oferta.lng_vendedor = coords
+        nueva_oferta.geohash_vendedor = encode_geohash(*coords)
     nueva_oferta.precio_ud = data["precio_ud"]
     nueva_oferta.ud = data["ud"]
     nueva_oferta.img_cosecha = data.get("img_cosecha")
 
     db.session.add(nueva_oferta)
+    db.session.flush()
+    index_oferta(nueva_oferta)
+    record_ofertas(nuevas=[nueva_oferta])
+    nueva_oferta.cambio = bump_catalogue_version()
+    publish_event("creada", [nueva_oferta.serialize()])
     db.session.commit()
 
     return jsonify({
@@ -219,54 +504,126 @@ def post_ofertas():
     }), 201
 
 
+# POST importar muchas ofertas de una vez (JSON o CSV)
+@api.route("/user/ofertas/import", methods=["POST"])
+@jwt_required()
+def importar_ofertas():
+    if request.mimetype == "text/csv":
+        filas = parse_csv(request.get_data(as_text=True))
+    else:
+        body = request.get_json(silent=True)
+        filas = body.get("ofertas") if isinstance(body, dict) else body
+    if not isinstance(filas, list) or not filas:
+        return jsonify({"error": "Se esperaba una lista de ofertas en JSON o un CSV"}), 400
+    if len(filas) > MAX_FILAS_IMPORTACION:
+        return jsonify({"error": f"Máximo {MAX_FILAS_IMPORTACION} ofertas por importación"}), 413
+
+    try:
+        validas, errores = validate_ofertas(filas)
+    except ValidationError as err:
+        return jsonify({"errors": err.messages}), 400
+
+    # Por defecto todo o nada; con parcial=1 se importan las filas válidas
+    parcial = parse_bool_arg(request.args.get("parcial")) or False
+    if errores and not parcial:
+        return jsonify({"errors": errores, "insertadas": 0}), 400
+
+    insertadas = insert_ofertas(get_current_user(), validas)
+    return jsonify({
+        "msg": "Importación completada",
+        "insertadas": insertadas,
+        "errors": errores
+    }), 201
+
+
+# POST subir una foto de cosecha (multipart, campo "imagen"): se guarda el
+# original y las versiones reducidas en WebP y JPEG se generan en segundo
+# plano. La URL devuelta es el valor para img_cosecha.
+@api.route("/user/imagenes", methods=["POST"])
+@jwt_required()
+def subir_imagen():
+    if request.content_length and request.content_length > image_store.max_upload_bytes + 1024:
+        return jsonify({"error": "La imagen es demasiado grande"}), 413
+    archivo = request.files.get("imagen")
+    if archivo is None:
+        return jsonify({"error": "Falta el fichero imagen"}), 400
+
+    try:
+        url = image_store.save(archivo.read())
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    return jsonify({"img_cosecha": url, "img_derivadas": derivative_urls(url)}), 201
+
+
+# GET imagen original o versión reducida (p.ej. /imagenes/<clave>/320.webp).
+# El contenido de una URL no cambia nunca: caché inmutable de un año.
+@api.route("/imagenes/<clave>", methods=["GET"])
+@limiter.exempt
+def get_imagen(clave):
+    return image_store.send(clave)
+
+
+@api.route("/imagenes/<clave>/<variante>", methods=["GET"])
+@limiter.exempt
+def get_imagen_derivada(clave, variante):
+    return image_store.send(clave, variante)
+
+
 # PUT comprar una oferta
 
 @api.route("/user/oferta/comprar/<int:oferta_id>", methods=["PUT"])
 @jwt_required()
 def comprar_oferta(oferta_id):
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if user is None:
-        return jsonify("Usuario no valido"),400
-    
-    oferta = Oferta.query.get(oferta_id)
-    oferta.id_comprador = user.id
-    oferta.coordenates_comprador = user.coordenates
-    oferta.esta_realizada = True
-    db.session.add(oferta)
-    db.session.commit()
+    user = get_current_user()
+    coords = user.get_lat_lng() or (None, None)
 
+    # Una sola sentencia UPDATE condicional: solo gana el primer comprador
+    compra = queries.compra(oferta_id, user, coords)
+    if db.session.get_bind().dialect.update_returning:
+        oferta = db.session.execute(compra.returning(Oferta)).scalar_one_or_none()
+    else:
+        resultado = db.session.execute(compra, execution_options={"synchronize_session": False})
+        oferta = db.session.get(Oferta, oferta_id) if resultado.rowcount == 1 else None
 
     if oferta is None:
-        return jsonify("No existe esa oferta"),400
-    oferta_serializada = oferta.serialize()
-    print(oferta_serializada)
-    print(oferta)
-    print(oferta_id)
+        db.session.rollback()
+        existente = db.session.get(Oferta, oferta_id)
+        if existente is None or existente.borrada_en is not None:
+            return jsonify("No existe esa oferta"),400
+        return jsonify({"error": "La oferta ya ha sido comprada"}), 409
+
+    unindex_oferta(oferta.id)
+    record_ofertas(nuevas=[oferta], retiradas=[{
+        "id_vendedor": oferta.id_vendedor, "id_comprador": None, "esta_realizada": False,
+        "ud": oferta.ud, "precio_ud": oferta.precio_ud,
+    }])
+    oferta.cambio = bump_catalogue_version()
+    publish_event("comprada", [oferta.serialize()])
+    db.session.commit()
 
-    return jsonify(oferta_serializada)
+    return jsonify(oferta.serialize())
 
 
 @api.route("/user/oferta/vendedor/borrar/<int:oferta_id>", methods=["DELETE"])
 @jwt_required()
 def BorrarOfertas(oferta_id):
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
-    if user is None:
-        return jsonify("Usuario no valido"),400
-    
-    oferta = Oferta.query.get(oferta_id)
-    if oferta is None:
+    user = get_current_user()
+
+    oferta = db.session.execute(queries.oferta_por_id(oferta_id)).scalar()
+    if oferta is None or oferta.borrada_en is not None:
         return jsonify({"mensaje": "Oferta no encontrada"}), 404
     if user.id != oferta.id_vendedor:
         return jsonify({"mensaje": "No tienes permiso para borrar esta oferta"}), 403
     
-    db.session.delete(oferta)
+    # Lápida para la sincronización incremental, ver api/sync.py
+    tombstone_oferta(oferta)
     db.session.commit()
     return jsonify({"mensaje":"Lo has borrado correctamente"}),200
 
 
 @api.route("/resetPassword", methods=['POST'])
+@limiter.limit(reset_password_limit)
 def resetPassword():
     schema = PasswordResetSchema()
 
@@ -277,7 +634,7 @@ def resetPassword():
         return jsonify({"errors": err.messages}), 400
 
     user_email = data["email"]
-    user = User.query.filter_by(email=user_email).first()
+    user = db.session.execute(queries.usuario_por_email(user_email)).scalar()
 
     if not user:
         # Por seguridad, no revelar si el usuario existe o no
@@ -288,15 +645,16 @@ def resetPassword():
     cadena_modificada = re.sub(r"\.", "_", token)
     reset_url_password = f"{url_front}resetPassword/{cadena_modificada}"
 
+    # El envío se hace en segundo plano, aquí solo se encola
     try:
-        msg = Message(
+        mail_queue.enqueue(
             "Recuperación de Contraseña - Mercado Español",
-            html=f"<p>Para restablecer tu contraseña, haz click <a href={reset_url_password}>aquí</a></p>",
-            recipients=[user_email],
+            [user_email],
+            f"<p>Para restablecer tu contraseña, haz click <a href={reset_url_password}>aquí</a></p>",
         )
-        mail.send(msg)
     except Exception as e:
-        print(f"Error enviando email: {e}")
+        db.session.rollback()
+        print(f"Error encolando email: {e}")
         return jsonify({"error": "Error al enviar el email"}), 500
 
     return jsonify({"msg": "Email de recuperación enviado exitosamente"}), 200
\ No newline at end of file
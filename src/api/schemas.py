@@ -3,6 +3,13 @@ Validation schemas using Marshmallow
 """
 from marshmallow import Schema, fields, validate, ValidationError
 import re
+from api.geo import parse_coordenates
+
+
+def validate_coordenates(value):
+    """Reject coordinates that can't be parsed into a valid lat/lng pair"""
+    if parse_coordenates(value) is None:
+        raise ValidationError("Coordenadas inválidas")
 
 
 class UserRegistrationSchema(Schema):
@@ -28,14 +35,16 @@ class UserRegistrationSchema(Schema):
             "required": "El nombre es requerido"
         }
     )
-    vehicle = fields.Str(
-        validate=validate.Length(max=100)
+    vehicle = fields.Boolean(
+        load_default=False
     )
     vehicle_consume_km = fields.Float(
+        allow_none=True,
         validate=validate.Range(min=0, min_inclusive=True)
     )
     coordenates = fields.Str(
         required=True,
+        validate=validate_coordenates,
         error_messages={
             "required": "Las coordenadas son requeridas"
         }
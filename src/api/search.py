@@ -0,0 +1,188 @@
+"""
+Full-text search over Oferta.titulo / Oferta.descripcion
+
+The index is an FTS5 virtual table on SQLite and a tsvector table with a
+GIN index on Postgres (see migration 3f2a9c7d1e40). It only holds open
+offers: routes add them on creation and remove them when bought or deleted.
+Text is lowercased and stripped of accents before indexing and querying.
+Postgres stems with its 'spanish' configuration, SQLite with the light
+stemmer below. Other databases have no index: the search falls back to
+LIKE over the open offers, without stemming or accent folding.
+"""
+import re
+import unicodedata
+from sqlalchemy import text, select, and_, or_, case, literal
+from api.models import db, Oferta
+
+SQLITE_TABLE = "oferta_fts"
+POSTGRES_TABLE = "oferta_busqueda"
+POSTGRES_INDEX = "ix_oferta_busqueda_documento"
+
+# Relative weight of the title against the description when ranking
+PESO_TITULO = 4.0
+PESO_DESCRIPCION = 1.0
+
+_STOPWORDS = frozenset((
+    "a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los",
+    "o", "para", "por", "se", "su", "un", "una", "unos", "unas", "y",
+))
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def exclude_search_tables(obj, name, type_, reflected, compare_to):
+    """Alembic include_object hook keeping the search tables out of autogenerate"""
+    if type_ == "table" and (name.startswith(SQLITE_TABLE) or name == POSTGRES_TABLE):
+        return False
+    return True
+
+
+def normalize_text(value):
+    """Lowercase and strip diacritics"""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def stem(word):
+    """Light Spanish stemmer, in the spirit of Lucene's SpanishLightStemmer"""
+    if len(word) < 5:
+        return word
+    last = word[-1]
+    if last in "aoe":
+        return word[:-1]
+    if last == "s":
+        if word.endswith("eses"):
+            return word[:-2]
+        if word.endswith("ces"):
+            return word[:-3] + "z"
+        if word[-2] in "aoe":
+            return word[:-2]
+    return word
+
+
+def tokenize(value, stemmed=True):
+    words = [w for w in _WORD_RE.findall(normalize_text(value)) if w not in _STOPWORDS]
+    if stemmed:
+        words = [stem(w) for w in words]
+    return words
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def index_oferta(oferta):
+    """Add or refresh an offer in the search index (needs oferta.id, so flush first)"""
+    unindex_oferta(oferta.id)
+    index_ofertas([{"id": oferta.id, "titulo": oferta.titulo,
+                    "descripcion": oferta.descripcion}])
+
+
+def index_ofertas(ofertas):
+    """Index new offers in one executemany, ofertas are dicts with id/titulo/descripcion"""
+    if not ofertas:
+        return
+    dialect = _dialect()
+    if dialect == "sqlite":
+        db.session.execute(
+            text(f"INSERT INTO {SQLITE_TABLE} (rowid, titulo, descripcion) "
+                 "VALUES (:id, :titulo, :descripcion)"),
+            [{"id": o["id"],
+              "titulo": " ".join(tokenize(o["titulo"])),
+              "descripcion": " ".join(tokenize(o["descripcion"]))} for o in ofertas])
+    elif dialect == "postgresql":
+        db.session.execute(
+            text(f"INSERT INTO {POSTGRES_TABLE} (id_oferta, documento) VALUES ("
+                 ":id, setweight(to_tsvector('spanish', :titulo), 'A') || "
+                 "setweight(to_tsvector('spanish', :descripcion), 'B')) "
+                 "ON CONFLICT (id_oferta) DO UPDATE SET documento = EXCLUDED.documento"),
+            [{"id": o["id"],
+              "titulo": normalize_text(o["titulo"]),
+              "descripcion": normalize_text(o["descripcion"])} for o in ofertas])
+
+
+def unindex_oferta(oferta_id):
+    """Remove an offer from the search index"""
+    dialect = _dialect()
+    if dialect == "sqlite":
+        db.session.execute(text(f"DELETE FROM {SQLITE_TABLE} WHERE rowid = :id"),
+                           {"id": oferta_id})
+    elif dialect == "postgresql":
+        db.session.execute(text(f"DELETE FROM {POSTGRES_TABLE} WHERE id_oferta = :id"),
+                           {"id": oferta_id})
+
+
+def clear_index():
+    dialect = _dialect()
+    if dialect == "sqlite":
+        db.session.execute(text(f"DELETE FROM {SQLITE_TABLE}"))
+    elif dialect == "postgresql":
+        db.session.execute(text(f"DELETE FROM {POSTGRES_TABLE}"))
+
+
+def search_ofertas(query, limit, offset=0):
+    """Ranked [(oferta_id, score)] for the query, best match first.
+
+    Every word must match; on SQLite the last word also matches as a prefix
+    so results show up while the user is still typing.
+    """
+    stmt = search_statement(query, limit, offset)
+    if stmt is None:
+        return []
+    rows = db.session.execute(stmt)
+    if _dialect() == "sqlite":
+        # bm25 is lower-is-better, expose it as higher-is-better
+        return [(row[0], -row[1]) for row in rows]
+    return [(row[0], row[1]) for row in rows]
+
+
+def search_statement(query, limit, offset=0):
+    """Statement of (oferta_id, score) rows behind search_ofertas(), None
+    when the query has no words to search for"""
+    dialect = _dialect()
+    if dialect == "sqlite":
+        words = tokenize(query)
+        if not words:
+            return None
+        terms = ['"' + w + '"' for w in words]
+        terms[-1] += "*"
+        return text(
+            f"SELECT rowid, bm25({SQLITE_TABLE}, :peso_titulo, :peso_descripcion) AS score "
+            f"FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH :match "
+            "ORDER BY score, rowid LIMIT :limit OFFSET :offset"
+        ).bindparams(match=" ".join(terms), limit=limit, offset=offset,
+                     peso_titulo=PESO_TITULO, peso_descripcion=PESO_DESCRIPCION)
+
+    if dialect == "postgresql":
+        normalized = " ".join(tokenize(query, stemmed=False))
+        if not normalized:
+            return None
+        return text(
+            "SELECT id_oferta, ts_rank_cd(CAST(:pesos AS real[]), documento, q) AS score "
+            f"FROM {POSTGRES_TABLE}, plainto_tsquery('spanish', :q) AS q "
+            "WHERE documento @@ q "
+            "ORDER BY score DESC, id_oferta LIMIT :limit OFFSET :offset"
+        ).bindparams(q=normalized, limit=limit, offset=offset,
+                     pesos="{0.1, 0.2, %s, %s}" % (PESO_DESCRIPCION / PESO_TITULO, 1.0))
+
+    return _like_statement(query, limit, offset)
+
+
+def _like_statement(query, limit, offset):
+    """Every word in titulo or descripcion, case-insensitive, title matches first"""
+    words = [w for w in _WORD_RE.findall(query.lower()) if w not in _STOPWORDS]
+    if not words:
+        return None
+    # \w also matches "_", a LIKE wildcard
+    patrones = ["%" + w.replace("_", "\\_") + "%" for w in words]
+    en_titulo = [Oferta.titulo.ilike(p, escape="\\") for p in patrones]
+    en_descripcion = [Oferta.descripcion.ilike(p, escape="\\") for p in patrones]
+    score = sum((case((c, PESO_TITULO), else_=0.0) for c in en_titulo), literal(0.0)) + \
+        sum((case((c, PESO_DESCRIPCION), else_=0.0) for c in en_descripcion), literal(0.0))
+    return (
+        select(Oferta.id, score.label("score"))
+        .where(Oferta.esta_realizada.is_(False), Oferta.borrada_en.is_(None),
+               and_(*(or_(t, d) for t, d in zip(en_titulo, en_descripcion))))
+        .order_by(score.desc(), Oferta.id)
+        .limit(limit).offset(offset)
+    )
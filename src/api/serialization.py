@@ -0,0 +1,64 @@
+"""
+Fast serialization for list responses
+
+List endpoints select only the serialized columns as plain tuples instead of
+loading ORM entities, and responses are encoded with orjson when it's
+installed (falling back to Flask's stdlib encoder otherwise).
+"""
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
+from api.models import db, Oferta
+from api.metrics import timed
+from api.images import derivative_urls
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding with orjson (keys keep insertion order)"""
+
+    # Like the stdlib encoder, accept non-string keys (e.g. row indexes)
+    options = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with timed("json"):
+            body = orjson.dumps(obj, default=self.default,
+                                option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def setup_json(app):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+
+
+def oferta_columns():
+    return [getattr(Oferta, campo) for campo in Oferta.CAMPOS_SERIALIZADOS]
+
+
+def select_ofertas():
+    """SELECT of exactly the columns Oferta.serialize() returns, deleted
+    offers (tombstones kept for api/sync.py) left out"""
+    return select(*oferta_columns()).where(Oferta.borrada_en.is_(None))
+
+
+def rows_to_dicts(rows, campos=Oferta.CAMPOS_SERIALIZADOS):
+    ofertas = [dict(zip(campos, row)) for row in rows]
+    # Same keys as Oferta.serialize()
+    if "img_cosecha" in campos:
+        for oferta in ofertas:
+            oferta["img_derivadas"] = derivative_urls(oferta["img_cosecha"])
+    return ofertas
+
+
+def fetch_ofertas(stmt, session=None):
+    """Run a select_ofertas() statement and return serialized dicts"""
+    session = session or db.session
+    return rows_to_dicts(session.execute(stmt))
@@ -0,0 +1,143 @@
+"""
+Static delivery of the built SPA in dist/
+
+A manifest of dist/ is built once at startup, so serving a file is a dict
+lookup instead of a stat per request. Vite's content-hashed bundles
+(assets/index-3f9a1c2b.js) get a one year `immutable` Cache-Control, while
+index.html and unhashed files are revalidated on every visit with their
+ETag. When a .br or .gz sibling was produced at build time
+(`flask comprimir-estaticos`) and the client accepts it, that file is sent
+instead. Files go out through send_file, which streams them and answers
+If-None-Match and Range requests without reading them into memory.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from flask import request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Vite writes bundles to assets/<name>-<8 char hash>.<ext>; files copied from
+# public/ keep their name and land in the root of dist/
+HASHED_ASSET = re.compile(r"^assets/.+-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".txt", ".map",
+                ".xml", ".ico", ".wasm", ".ttf", ".otf", ".eot"}
+MIN_COMPRESS_SIZE = 1024
+
+
+def _file_etag(path, chunk_size=64 * 1024):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+
+def build_manifest(root):
+    """{url path: entry} for every file under root, with its precompressed
+    variants; the .br/.gz files themselves aren't served directly"""
+    manifest = {}
+    if not os.path.isdir(root):
+        return manifest
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith((".br", ".gz")):
+                continue
+            full_path = os.path.join(dirpath, filename)
+            url_path = os.path.relpath(full_path, root).replace(os.sep, "/")
+            variants = {}
+            for encoding, suffix in ENCODINGS:
+                if os.path.isfile(full_path + suffix):
+                    variants[encoding] = (full_path + suffix, _file_etag(full_path + suffix))
+            manifest[url_path] = {
+                "path": full_path,
+                "mimetype": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+                "etag": _file_etag(full_path),
+                "immutable": bool(HASHED_ASSET.match(url_path)),
+                "variants": variants,
+            }
+    return manifest
+
+
+def _accepted_encodings():
+    accepted = request.accept_encodings
+    return [encoding for encoding, _ in ENCODINGS if accepted[encoding] > 0]
+
+
+class StaticAssets:
+    def __init__(self, root=None):
+        self.root = root
+        self.manifest = {}
+
+    def init_app(self, app, root):
+        self.root = root
+        self.manifest = build_manifest(root)
+        app.logger.info("Static manifest: %d files in %s", len(self.manifest), root)
+
+    def send(self, url_path):
+        """Response for url_path, index.html for client-side routes"""
+        entry = self.manifest.get(url_path)
+        if entry is None:
+            # A bundle from an older build must 404, not load as HTML
+            if url_path.startswith("assets/"):
+                return "Not found", 404
+            entry = self.manifest.get("index.html")
+        if entry is None:
+            return "Not found", 404
+
+        path, etag, encoding = entry["path"], entry["etag"], None
+        for candidate in _accepted_encodings():
+            if candidate in entry["variants"]:
+                path, etag = entry["variants"][candidate]
+                encoding = candidate
+                break
+
+        # Without max_age send_file marks the response no-cache (revalidate)
+        max_age = IMMUTABLE_MAX_AGE if entry["immutable"] else None
+        response = send_file(path, mimetype=entry["mimetype"], etag=etag,
+                             conditional=True, max_age=max_age)
+        if entry["immutable"]:
+            response.cache_control.immutable = True
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if entry["variants"]:
+            response.vary.add("Accept-Encoding")
+        return response
+
+
+def precompress(root, log=print):
+    """Write .br (when brotli is installed) and .gz next to every compressible
+    file of root, keeping a variant only if it's smaller than the original"""
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            extension = os.path.splitext(filename)[1].lower()
+            if extension not in COMPRESSIBLE:
+                continue
+            full_path = os.path.join(dirpath, filename)
+            with open(full_path, "rb") as f:
+                content = f.read()
+            if len(content) < MIN_COMPRESS_SIZE:
+                continue
+            variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(content, quality=11)
+            for suffix, compressed in variants.items():
+                if len(compressed) >= len(content):
+                    continue
+                with open(full_path + suffix, "wb") as f:
+                    f.write(compressed)
+                written += 1
+                log(f"{os.path.relpath(full_path + suffix, root)}: "
+                    f"{len(content)} -> {len(compressed)} bytes")
+    return written
+
+
+static_assets = StaticAssets()
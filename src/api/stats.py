@@ -0,0 +1,166 @@
+"""
+Per-user seller and buyer statistics maintained on write
+
+estadisticas_usuario keeps, per user and unit (ud), the offers the user has
+open and sold, the revenue of the sold ones and the offers bought and spent
+on, prices taken from precio_ud. Those numbers are a sum over offers, so
+every write to oferta removes the old contribution of the offers it touches
+and adds the new one with record_ofertas(), in the same transaction as the
+write. The deltas go out as one upsert with the keys sorted, so two
+purchases touching the same users lock their rows in the same order.
+
+Reading a user's dashboard is then a primary key lookup instead of an
+aggregate over their whole history. `flask reconstruir-estadisticas`
+recomputes the table from oferta and reports any drift.
+"""
+import math
+from collections import defaultdict
+from sqlalchemy import select, delete, func, case, literal, union_all, text
+from sqlalchemy.dialects import postgresql, sqlite
+from api.models import db, Oferta, EstadisticasUsuario
+
+CONTADORES = ("abiertas", "vendidas", "ingresos", "compradas", "gastado")
+
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def _campo(oferta, campo):
+    return oferta[campo] if isinstance(oferta, dict) else getattr(oferta, campo)
+
+
+def _add_contribution(deltas, oferta, sign):
+    ud = _campo(oferta, "ud")
+    precio = _campo(oferta, "precio_ud") or 0
+    vendedor = deltas[(_campo(oferta, "id_vendedor"), ud)]
+    if _campo(oferta, "esta_realizada"):
+        vendedor[1] += sign
+        vendedor[2] += sign * precio
+    else:
+        vendedor[0] += sign
+    id_comprador = _campo(oferta, "id_comprador")
+    if id_comprador is not None:
+        comprador = deltas[(id_comprador, ud)]
+        comprador[3] += sign
+        comprador[4] += sign * precio
+
+
+def record_ofertas(nuevas=(), retiradas=()):
+    """Apply the stats of offers (Oferta objects or dicts with id_vendedor,
+    id_comprador, esta_realizada, ud and precio_ud) as they are after the
+    write (nuevas) and as they were before it (retiradas). Commit is up to
+    the caller."""
+    deltas = defaultdict(lambda: [0, 0, 0.0, 0, 0.0])
+    for oferta in nuevas:
+        _add_contribution(deltas, oferta, 1)
+    for oferta in retiradas:
+        _add_contribution(deltas, oferta, -1)
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    """Add {(id_usuario, ud): [abiertas, vendidas, ingresos, compradas, gastado]}"""
+    rows = [{"id_usuario": id_usuario, "ud": ud, **dict(zip(CONTADORES, valores))}
+            for (id_usuario, ud), valores in sorted(deltas.items()) if any(valores)]
+    if not rows:
+        return
+    table = EstadisticasUsuario.__table__
+    conn = db.session.connection()
+    insert = _UPSERT_INSERTS.get(conn.dialect.name)
+    if insert is not None:
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.id_usuario, table.c.ud],
+            set_={campo: table.c[campo] + stmt.excluded[campo] for campo in CONTADORES})
+        conn.execute(stmt, rows)
+        return
+    for row in rows:
+        result = conn.execute(
+            table.update()
+            .where(table.c.id_usuario == row["id_usuario"], table.c.ud == row["ud"])
+            .values({campo: table.c[campo] + row[campo] for campo in CONTADORES}))
+        if result.rowcount == 0:
+            conn.execute(table.insert(), row)
+
+
+def _expected_select():
+    """SELECT of the table's rows computed from scratch from oferta"""
+    vendida = Oferta.esta_realizada.is_(True)
+    precio = func.coalesce(Oferta.precio_ud, 0.0)
+    # Deleted offers were already taken out with record_ofertas(retiradas=...)
+    vigente = Oferta.borrada_en.is_(None)
+    como_vendedor = select(
+        Oferta.id_vendedor.label("id_usuario"), Oferta.ud.label("ud"),
+        case((vendida, 0), else_=1).label("abiertas"),
+        case((vendida, 1), else_=0).label("vendidas"),
+        case((vendida, precio), else_=0.0).label("ingresos"),
+        literal(0).label("compradas"), literal(0.0).label("gastado")
+    ).where(vigente)
+    como_comprador = select(
+        Oferta.id_comprador, Oferta.ud, literal(0), literal(0), literal(0.0),
+        literal(1), precio
+    ).where(Oferta.id_comprador.isnot(None), vigente)
+    filas = union_all(como_vendedor, como_comprador).subquery()
+    return (select(filas.c.id_usuario, filas.c.ud,
+                   *[func.sum(filas.c[campo]).label(campo) for campo in CONTADORES])
+            .group_by(filas.c.id_usuario, filas.c.ud))
+
+
+def _by_key(rows):
+    return {(row.id_usuario, row.ud): tuple(getattr(row, campo) for campo in CONTADORES)
+            for row in rows if any(getattr(row, campo) for campo in CONTADORES)}
+
+
+def find_drift():
+    """[(id_usuario, ud, esperado, actual)] for every row that doesn't match oferta"""
+    esperado = _by_key(db.session.execute(_expected_select()))
+    actual = _by_key(db.session.execute(select(EstadisticasUsuario)).scalars())
+    vacio = (0,) * len(CONTADORES)
+    drift = []
+    for clave in sorted(esperado.keys() | actual.keys()):
+        e, a = esperado.get(clave, vacio), actual.get(clave, vacio)
+        if not all(math.isclose(x, y, abs_tol=1e-6) for x, y in zip(e, a)):
+            drift.append((*clave, e, a))
+    return drift
+
+
+def rebuild_stats():
+    """Recompute the whole table from oferta in one transaction, returns the row count"""
+    conn = db.session.connection()
+    if conn.dialect.name == "postgresql":
+        # Writers block on their upsert until the rebuild commits, and then
+        # apply their delta on top of counters that don't include it yet
+        conn.execute(text("LOCK TABLE estadisticas_usuario IN EXCLUSIVE MODE"))
+    # On SQLite the DELETE takes the write lock before oferta is read
+    conn.execute(delete(EstadisticasUsuario))
+    conn.execute(EstadisticasUsuario.__table__.insert().from_select(
+        ["id_usuario", "ud", *CONTADORES], _expected_select()))
+    filas = conn.execute(select(func.count()).select_from(EstadisticasUsuario)).scalar()
+    db.session.commit()
+    return filas
+
+
+def user_stats(id_usuario):
+    """Totals and per-unit breakdown of a user's stats"""
+    rows = db.session.execute(
+        select(EstadisticasUsuario).where(EstadisticasUsuario.id_usuario == id_usuario)
+    ).scalars().all()
+    totales = dict.fromkeys(CONTADORES, 0)
+    por_ud = {}
+    for row in rows:
+        valores = {campo: getattr(row, campo) for campo in CONTADORES}
+        if not any(valores.values()):
+            continue
+        for campo, valor in valores.items():
+            totales[campo] += valor
+        valores["ingresos"] = round(valores["ingresos"], 2)
+        valores["gastado"] = round(valores["gastado"], 2)
+        por_ud[row.ud] = valores
+    return {
+        "ofertas_publicadas": totales["abiertas"] + totales["vendidas"],
+        "ofertas_abiertas": totales["abiertas"],
+        "ofertas_vendidas": totales["vendidas"],
+        "ingresos": round(totales["ingresos"], 2),
+        "compras": totales["compradas"],
+        "gastado": round(totales["gastado"], 2),
+        "por_ud": por_ud,
+    }
@@ -0,0 +1,153 @@
+"""
+Delta sync of the offers catalogue
+
+Every write to an offer stamps Oferta.cambio with the catalogue version it
+bumped (api/cache.py). The version row stays locked until the write
+commits, so versions commit in order: once a client has read every row
+with cambio <= V, no other row with cambio <= V can show up later.
+changes_since() returns the rows after a cursor in (cambio, id) order,
+straight from the ix_oferta_cambio_id index, so a sync reads what changed
+and not the whole catalogue.
+
+A cursor (api/utils.encode_cursor) holds a version V, meaning every row up
+to V was sent, plus an id when a page ended in the middle of version V
+after that id. Deleting an offer leaves a
+tombstone: borrada_en is set and the row is stamped like any other write,
+so the next sync returns its id among the deleted ones. Every delete, from
+the API or the admin, goes through tombstone_oferta().
+compact_tombstones(), run on a schedule by `flask compactar-ofertas`,
+deletes the tombstones older than OFERTAS_TOMBSTONE_DAYS and records the
+highest version it removed in CatalogoVersion.compactado_hasta. A cursor
+from before that may have missed deletions and is rejected with
+CursorCaducado: the client has to download the catalogue again.
+"""
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func, tuple_
+from api.models import db, Oferta, CatalogoVersion, Recomendacion
+from api.serialization import oferta_columns, rows_to_dicts
+from api.utils import APIException, encode_cursor, decode_cursor
+from api.cache import bump_catalogue_version
+from api.search import unindex_oferta
+from api.stats import record_ofertas
+from api.events import publish_event
+
+DEFAULT_TOMBSTONE_DAYS = 30
+DEFAULT_LIMITE = 500
+
+
+class CursorCaducado(Exception):
+    pass
+
+
+def parse_cursor(cursor):
+    """(version, id or None) of a cursor, (0, 0) for None (from the start).
+    Raises APIException for malformed cursors."""
+    if not cursor:
+        return 0, 0
+    values = decode_cursor(cursor)
+    version, oferta_id = values.get("cambio"), values.get("id")
+    if not isinstance(version, int) or not isinstance(oferta_id, (int, type(None))):
+        raise APIException("Cursor inválido", status_code=400)
+    return version, oferta_id
+
+
+def format_cursor(version, oferta_id=None):
+    values = {"cambio": version}
+    if oferta_id is not None:
+        values["id"] = oferta_id
+    return encode_cursor(values)
+
+
+def tombstone_oferta(oferta):
+    """Delete an offer: take it out of the search index and the stats, set
+    borrada_en, stamp it and tell the streams. Commit is up to the caller."""
+    unindex_oferta(oferta.id)
+    record_ofertas(retiradas=[oferta])
+    oferta.borrada_en = datetime.utcnow()
+    oferta.cambio = bump_catalogue_version()
+    publish_event("borrada", [{"id": oferta.id}])
+
+
+def changes_query(version, ultimo_id, limite):
+    """SELECT of the rows after (version, ultimo_id) in cursor order"""
+    if ultimo_id is None:
+        despues = Oferta.cambio > version
+    else:
+        despues = tuple_(Oferta.cambio, Oferta.id) > tuple_(version, ultimo_id)
+    return (select(*oferta_columns(), Oferta.cambio, Oferta.borrada_en)
+            .where(despues)
+            .order_by(Oferta.cambio, Oferta.id)
+            .limit(limite))
+
+
+def changes_since(cursor, limite=DEFAULT_LIMITE):
+    """{"ofertas", "borradas", "cursor", "hay_mas"} with the offers changed
+    after cursor, serialized as Oferta.serialize() plus "cambio", and the ids
+    of the deleted ones. Raises CursorCaducado if the cursor is older than
+    the last compaction."""
+    version, ultimo_id = parse_cursor(cursor)
+    # Read before the rows: every version up to this one is already committed
+    estado = db.session.execute(
+        select(CatalogoVersion.version, CatalogoVersion.compactado_hasta)
+        .where(CatalogoVersion.id == 1)
+    ).first()
+    actual, compactado = estado if estado is not None else (0, 0)
+    # A page cut inside the horizon's version may have missed some of its tombstones
+    caducado = version < compactado or (ultimo_id is not None and version == compactado > 0)
+    if cursor and caducado:
+        raise CursorCaducado()
+    if version > actual:
+        # Cursor from the primary or a replica ahead of this one
+        return {"ofertas": [], "borradas": [], "cursor": cursor, "hay_mas": False}
+
+    campos = Oferta.CAMPOS_SERIALIZADOS + ("cambio", "borrada_en")
+    filas = db.session.execute(changes_query(version, ultimo_id, limite + 1)).all()
+
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    ofertas, borradas = [], []
+    for oferta in rows_to_dicts(filas, campos):
+        if oferta.pop("borrada_en") is not None:
+            borradas.append(oferta["id"])
+        else:
+            ofertas.append(oferta)
+
+    if hay_mas:
+        nuevo_cursor = format_cursor(filas[-1].cambio, filas[-1].id)
+    else:
+        # Rows committed after reading the version come with a higher cambio
+        nuevo_cursor = format_cursor(max(actual, filas[-1].cambio if filas else 0))
+    return {"ofertas": ofertas, "borradas": borradas, "cursor": nuevo_cursor, "hay_mas": hay_mas}
+
+
+def tombstone_days():
+    return float(os.getenv("OFERTAS_TOMBSTONE_DAYS", DEFAULT_TOMBSTONE_DAYS))
+
+
+def compact_tombstones(dias=None):
+    """Delete the tombstones older than dias (OFERTAS_TOMBSTONE_DAYS by
+    default) and move the compaction horizon, returns the rows deleted"""
+    dias = tombstone_days() if dias is None else dias
+    limite = datetime.utcnow() - timedelta(days=dias)
+    hasta = db.session.execute(
+        select(func.max(Oferta.cambio))
+        .where(Oferta.borrada_en.isnot(None), Oferta.borrada_en < limite)
+    ).scalar()
+    if hasta is None:
+        return 0
+
+    # Every tombstone up to the horizon goes, so the horizon is exact
+    lapidas = select(Oferta.id).where(Oferta.borrada_en.isnot(None), Oferta.cambio <= hasta)
+    # SQLite doesn't enforce the ON DELETE CASCADE
+    db.session.execute(delete(Recomendacion).where(Recomendacion.id_oferta.in_(lapidas)))
+    borradas = db.session.execute(
+        delete(Oferta).where(Oferta.borrada_en.isnot(None), Oferta.cambio <= hasta)
+    ).rowcount
+    db.session.execute(
+        update(CatalogoVersion)
+        .where(CatalogoVersion.id == 1, CatalogoVersion.compactado_hasta < hasta)
+        .values(compactado_hasta=hasta)
+    )
+    db.session.commit()
+    return borradas
@@ -1,3 +1,5 @@
+import base64
+import json
 from flask import jsonify, url_for
 
 class APIException(Exception):
@@ -15,6 +17,33 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def encode_cursor(values):
+    """Opaque pagination cursor for a dict of keyset values"""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor, raises APIException for malformed cursors"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise APIException("Cursor inválido", status_code=400)
+    if not isinstance(values, dict):
+        raise APIException("Cursor inválido", status_code=400)
+    return values
+
+def parse_bool_arg(value):
+    """Parse a boolean query string argument, None when it's not given"""
+    if value is None:
+        return None
+    lowered = value.strip().lower()
+    if lowered in ("1", "true", "si", "sí", "yes"):
+        return True
+    if lowered in ("0", "false", "no"):
+        return False
+    raise APIException("Valor booleano inválido: " + value, status_code=400)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -4,20 +4,29 @@ This module takes care of starting the API Server, Loading the DB and Adding the
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify, url_for, send_from_directory
+from flask import Flask, request, jsonify, url_for
 from flask_migrate import Migrate
 from flask_swagger import swagger
 from flask_cors import CORS
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from api.utils import APIException, generate_sitemap
 from api.models import db
 from api.routes import api
 from api.admin import setup_admin
 from api.commands import setup_commands
+from api.search import exclude_search_tables
 from flask_jwt_extended import JWTManager
 from flask_mail import Mail
 from extension import mail
+from api.mailer import mail_queue
+from api.hashing import hasher
+from api.images import image_store
+from api.events import offer_events
+from api.identity import setup_identity
+from api.serialization import setup_json
+from api.metrics import setup_metrics
+from api.limiter import setup_limiter
+from api.static import static_assets
+from api.database import configure_database
 
 
 ENV = "development" if os.getenv("FLASK_DEBUG") == "1" else "production"
@@ -25,6 +34,8 @@ static_file_dir = os.path.join(os.path.dirname(
     os.path.realpath(__file__)), '../dist/')
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+setup_json(app)
+metrics_view = setup_metrics(app)
 
 # CORS Configuration
 if ENV == "development":
@@ -38,21 +49,13 @@ else:
         app.logger.warning("ALLOWED_ORIGINS not configured for production")
         CORS(app)
 
-# Rate Limiting Configuration
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
-)
-
-# database condiguration
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace(
-        "postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+# Rate Limiting Configuration (storage shared by all workers, see api/limiter.py)
+limiter = setup_limiter(app)
+# Prometheus scrapes far more often than the default limits allow
+limiter.exempt(metrics_view)
+
+# database condiguration (primary, optional read replica and pool, see api/database.py)
+configure_database(app)
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
@@ -62,10 +65,16 @@ if not jwt_secret:
     raise ValueError("JWT_SECRET_KEY must be set in environment variables")
 app.config["JWT_SECRET_KEY"] = jwt_secret
 
-MIGRATE = Migrate(app, db, compare_type=True)
+MIGRATE = Migrate(app, db, compare_type=True,
+                  include_object=exclude_search_tables)
 db.init_app(app)
 
 jwt = JWTManager(app)
+setup_identity(app, jwt)
+
+hasher.init_app(app)
+image_store.init_app(app)
+offer_events.init_app(app)
 
 # add the admin
 setup_admin(app)
@@ -85,15 +94,17 @@ mail_password = os.getenv('MAIL_PASSWORD')
 if not mail_username or not mail_password:
     raise ValueError("MAIL_USERNAME and MAIL_PASSWORD must be set in environment variables")
 
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', '1') == '1'
 app.config['MAIL_USERNAME'] = mail_username
 app.config['MAIL_PASSWORD'] = mail_password
 app.config['MAIL_DEFAULT_SENDER'] = mail_username
 
 # Inicializar extensiones
 mail.init_app(app)
+mail_queue.init_app(app)
+static_assets.init_app(app, static_file_dir)
 
 # Logging Configuration
 if not app.debug:
@@ -121,16 +132,13 @@ def handle_invalid_usage(error):
 def sitemap():
     if ENV == "development":
         return generate_sitemap(app)
-    return send_from_directory(static_file_dir, 'index.html')
+    return static_assets.send('index.html')
 
-# any other endpoint will try to serve it like a static file
+# any other endpoint will try to serve it like a static file from dist/
+# (hashed bundles cached forever, index.html and the rest revalidated)
 @app.route('/<path:path>', methods=['GET'])
 def serve_any_other_file(path):
-    if not os.path.isfile(os.path.join(static_file_dir, path)):
-        path = 'index.html'
-    response = send_from_directory(static_file_dir, path)
-    response.cache_control.max_age = 0  # avoid cache memory
-    return response
+    return static_assets.send(path)
 
 
 # this only runs if `$ python src/main.py` is executed
@@ -0,0 +1,293 @@
+"""
+HTTP benchmark of the API routes against a seeded throwaway SQLite database
+
+    $ python src/benchmark.py --clientes 8 --peticiones 500 --salida antes.json
+    $ python src/benchmark.py --clientes 8 --peticiones 500 --comparar antes.json
+
+The app is imported with DATABASE_URL pointing at a temporary SQLite file,
+migrated and filled with api.dataset (same seed, same data), then served by
+werkzeug's threaded WSGI server on a free local port. Each route is driven
+by --clientes keep-alive connections and reported as throughput plus
+p50/p95/p99 latency in JSON, so the output of two runs can be diffed.
+
+Responses are counted by status code. 429s on register/login are the
+password hasher shedding load (HASH_POOL_SIZE/HASH_QUEUE_SIZE), not the
+rate limiter, which is disabled here along with mail delivery.
+"""
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import click
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../migrations")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    estados = {}
+    for status in statuses:
+        estados[str(status)] = estados.get(str(status), 0) + 1
+    return {
+        "peticiones": len(latencies),
+        "errores": sum(n for status, n in estados.items() if not status.startswith("2")),
+        "estados": dict(sorted(estados.items())),
+        "duracion_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "media_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+def drive(port, plan, clientes):
+    """Send every (method, path, body, headers) of plan over `clientes`
+    persistent connections, returns (latencies, statuses, elapsed)"""
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    next_index = iter(range(len(plan)))
+    barrier = threading.Barrier(clientes + 1)
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        barrier.wait()
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                break
+            method, path, body, headers = plan[i]
+            payload = json.dumps(body).encode() if body is not None else None
+            headers = dict(headers, **{"Content-Type": "application/json"}) if payload else headers
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                status = "conexion"
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clientes)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def build_plans(app, rng, peticiones):
+    """Request list per route, built up front from the seeded database so
+    every run sends the same requests"""
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import select
+    from api.models import db, User, Oferta
+
+    with app.app_context():
+        users = db.session.execute(select(User.id, User.email)).all()
+        abiertas = db.session.execute(
+            select(Oferta.id, Oferta.id_vendedor)
+            .where(Oferta.esta_realizada.is_(False), Oferta.borrada_en.is_(None))
+            .order_by(Oferta.id)).all()
+        if len(abiertas) < 2 * peticiones:
+            raise click.ClickException(
+                f"Hacen falta {2 * peticiones} ofertas abiertas y hay {len(abiertas)}: "
+                "sube --ofertas o baja --peticiones")
+        todas = db.session.execute(
+            select(Oferta.id).where(Oferta.borrada_en.is_(None))).scalars().all()
+
+        rng.shuffle(abiertas)
+        para_comprar = abiertas[:peticiones]
+        para_borrar = abiertas[peticiones:2 * peticiones]
+
+        tokens = {}
+
+        def auth(user_id):
+            if user_id not in tokens:
+                tokens[user_id] = create_access_token(identity=str(user_id))
+            return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+        def any_user():
+            return rng.choice(users)
+
+        plans = {}
+        plans["register"] = [
+            ("POST", "/api/user/register", {
+                "email": f"bench_{n}@test.com",
+                "password": "123456",
+                "name": "Benchmark",
+                "vehicle": n % 2 == 0,
+                "vehicle_consume_km": 7.0 if n % 2 == 0 else None,
+                # coordenates is unique: a grid that the dataset never hits
+                "coordenates": f"{28 + n // 1000 * 0.001:.3f},{-17 + n % 1000 * 0.001:.3f}",
+            }, {})
+            for n in range(peticiones)]
+        plans["login"] = [
+            ("POST", "/api/user/login",
+             {"email": any_user().email, "password": "123456"}, {})
+            for _ in range(peticiones)]
+        plans["ofertas"] = [
+            ("GET", f"/api/user/ofertas?limite=50&cursor={_cursor(rng.choice(todas))}", None, {})
+            for _ in range(peticiones)]
+        plans["oferta_detalle"] = [
+            ("GET", f"/api/user/oferta/info/{rng.choice(todas)}", None, auth(any_user().id))
+            for _ in range(peticiones)]
+        compradores = [any_user().id for _ in range(peticiones)]
+        plans["comprar"] = [
+            ("PUT", f"/api/user/oferta/comprar/{oferta.id}", None,
+             auth(comprador if comprador != oferta.id_vendedor else users[0].id))
+            for oferta, comprador in zip(para_comprar, compradores)]
+        plans["borrar"] = [
+            ("DELETE", f"/api/user/oferta/vendedor/borrar/{oferta.id}", None, auth(oferta.id_vendedor))
+            for oferta in para_borrar]
+        plans["reset_password"] = [
+            ("POST", "/api/resetPassword", {"email": any_user().email}, {})
+            for _ in range(peticiones)]
+    return plans
+
+
+def _cursor(oferta_id):
+    from api.utils import encode_cursor
+    return encode_cursor({"id": oferta_id})
+
+
+def compare(actual, base):
+    """Print rps/p50/p95 deltas of this run against a previous JSON report"""
+    print(f"{'ruta':<16}{'rps':>22}{'p50_ms':>22}{'p95_ms':>22}", file=sys.stderr)
+    for ruta, datos in actual["rutas"].items():
+        previo = base.get("rutas", {}).get(ruta)
+        if previo is None:
+            continue
+        columnas = []
+        for campo in ("rps", "p50_ms", "p95_ms"):
+            antes, ahora = previo.get(campo), datos.get(campo)
+            if not antes or ahora is None:
+                columnas.append(f"{'-':>22}")
+                continue
+            cambio = (ahora - antes) / antes * 100
+            columnas.append(f"{antes:>8} → {ahora:<8}{cambio:+5.0f}%")
+        print(f"{ruta:<16}" + "".join(columnas), file=sys.stderr)
+
+
+RUTAS = ("register", "login", "ofertas", "oferta_detalle", "comprar", "borrar", "reset_password")
+
+
+@click.command()
+@click.option("--clientes", default=8, help="Conexiones concurrentes por ruta")
+@click.option("--peticiones", default=500, help="Peticiones por ruta")
+@click.option("--usuarios", default=1000, help="Usuarios del conjunto de datos")
+@click.option("--ofertas", default=20000, help="Ofertas del conjunto de datos")
+@click.option("--semilla", default=42, help="Semilla de los datos y de las peticiones")
+@click.option("--rutas", default=",".join(RUTAS), help="Rutas a medir separadas por comas")
+@click.option("--calentamiento", default=50, help="Peticiones GET /api/user/ofertas previas sin medir")
+@click.option("--salida", type=click.File("w"), default="-", help="Fichero JSON (por defecto stdout)")
+@click.option("--comparar", type=click.File("r"), default=None, help="Informe JSON previo con el que comparar")
+def main(clientes, peticiones, usuarios, ofertas, semilla, rutas, calentamiento, salida, comparar):
+    rutas = [r.strip() for r in rutas.split(",") if r.strip()]
+    desconocidas = set(rutas) - set(RUTAS)
+    if desconocidas:
+        raise click.BadParameter(f"rutas desconocidas: {', '.join(sorted(desconocidas))}")
+
+    workdir = tempfile.mkdtemp(prefix="benchmark-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    # Reads must hit the seeded file too, not a configured replica
+    os.environ.pop("DATABASE_REPLICA_URL", None)
+    os.environ["IMAGES_DIR"] = os.path.join(workdir, "imagenes")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    os.environ.setdefault("MAIL_USERNAME", "benchmark@test.com")
+    os.environ.setdefault("MAIL_PASSWORD", "benchmark")
+
+    from flask_migrate import upgrade
+    from werkzeug.serving import make_server
+    # Outside debug the app opens logs/ under the current directory on import,
+    # keep it in the workdir instead of the checkout
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        from app import app
+    finally:
+        os.chdir(cwd)
+    from api.dataset import generate, TEST_PASSWORD
+    from api.hashing import hasher
+
+    # Measure the handlers, not the limiter or the SMTP server
+    for limiter in app.extensions.get("limiter", ()):
+        limiter.enabled = False
+    app.extensions["mail"].suppress = True
+
+    try:
+        with app.app_context():
+            upgrade(directory=MIGRATIONS_DIR)
+            generate(usuarios, ofertas, semilla=semilla,
+                     password_hash=hasher.hash_password(TEST_PASSWORD),
+                     log=lambda msg: print(msg, file=sys.stderr))
+
+        plans = build_plans(app, random.Random(semilla), peticiones)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+
+        if calentamiento:
+            drive(port, plans["ofertas"][:calentamiento], clientes)
+
+        informe = {
+            "meta": {
+                "clientes": clientes,
+                "peticiones": peticiones,
+                "usuarios": usuarios,
+                "ofertas": ofertas,
+                "semilla": semilla,
+                "python": platform.python_version(),
+                "plataforma": platform.platform(),
+                "bcrypt_rounds": hasher.rounds,
+                "hash_pool": hasher.pool_size,
+                "hash_queue": hasher.queue_size,
+            },
+            "rutas": {},
+        }
+        for ruta in rutas:
+            print(f"Midiendo {ruta}...", file=sys.stderr)
+            latencies, statuses, elapsed = drive(port, plans[ruta], clientes)
+            informe["rutas"][ruta] = summarize(latencies, statuses, elapsed)
+
+        server.shutdown()
+        hasher.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    json.dump(informe, salida, indent=2, sort_keys=False)
+    salida.write("\n")
+    if comparar is not None:
+        compare(informe, json.load(comparar))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+// Listado completo de /api/user/ofertas: la API lo sirve paginado, así que
+// se piden páginas del tamaño máximo siguiendo siguiente_cursor hasta el final.
+// Los filtros (p.ej. { esta_realizada: false }) se aplican en el servidor.
+const LIMITE_PAGINA = 200;
+
+export const fetchAllOffers = async (backendUrl, filtros = {}) => {
+  const ofertas = [];
+  let cursor = null;
+  do {
+    const params = new URLSearchParams({ ...filtros, limite: LIMITE_PAGINA });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(`${backendUrl}api/user/ofertas?${params}`);
+    if (!res.ok) {
+      throw new Error(`HTTP error! status: ${res.status}`);
+    }
+    const data = await res.json();
+    ofertas.push(...(data.ofertas || []));
+    cursor = data.siguiente_cursor;
+  } while (cursor);
+  return ofertas;
+};
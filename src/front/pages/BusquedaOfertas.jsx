@@ -4,6 +4,7 @@ import useGlobalReducer from '../hooks/useGlobalReducer';
 import { APIProvider, useMap, Map } from '@vis.gl/react-google-maps';
 import {AdvancedMarker} from '@vis.gl/react-google-maps';
 import { beautifulStyles } from "../styles/beautifulStyles";
+import { fetchAllOffers } from "../ofertasApi";
 
 export const BusquedaOfertas = () => {
   const { store, dispatch } = useGlobalReducer();
@@ -54,15 +55,10 @@ export const BusquedaOfertas = () => {
           throw new Error("VITE_BACKEND_URL is not defined");
         }
         
-        const res = await fetch(`${backendUrl}api/user/ofertas`);
-        
-        if (!res.ok) {
-          throw new Error(`HTTP error! status: ${res.status}`);
-        }
-        
-        const data = await res.json();
-        console.log('Ofertas response:', data); // ← MEJORADO: más descriptivo
-        setOffers(data.ofertas || []);
+        // Solo las disponibles, todas las páginas
+        const ofertas = await fetchAllOffers(backendUrl, { esta_realizada: false });
+        console.log('Ofertas response:', ofertas.length);
+        setOffers(ofertas);
         // ← ELIMINADO: console.log(offers) que mostraba valor anterior
       } catch (err) {
         console.error('Error fetching offers:', err);
@@ -4,6 +4,7 @@ import useGlobalReducer from '../hooks/useGlobalReducer';
 import { APIProvider, useMap, Map } from '@vis.gl/react-google-maps';
 import { AdvancedMarker } from '@vis.gl/react-google-maps';
 import { beautifulStyles } from "../styles/beautifulStyles";
+import { fetchAllOffers } from "../ofertasApi";
 
 
 
@@ -27,21 +28,15 @@ export const Home = () => {
 
   useEffect(() => {
     const fetchOffers = async () => {
+      setError(null);
       try {
         const backendUrl = import.meta.env.VITE_BACKEND_URL;
         if (!backendUrl) {
           throw new Error("VITE_BACKEND_URL is not defined");
         }
 
-        // Use the environment variable instead of hardcoded URL
-        const res = await fetch(`${backendUrl}api/user/ofertas`);
-
-        if (!res.ok) {
-          throw new Error(`HTTP error! status: ${res.status}`);
-        }
-
-        const data = await res.json();
-        setOffers(data.ofertas || []);
+        // Solo las disponibles, todas las páginas
+        setOffers(await fetchAllOffers(backendUrl, { esta_realizada: false }));
       } catch (err) {
         console.error('Error fetching offers:', err);
         setError(err.message);
@@ -51,6 +46,33 @@ export const Home = () => {
     };
 
     fetchOffers();
+
+    // Cambios en vivo: ofertas creadas, compradas o borradas por otros usuarios
+    const backendUrl = import.meta.env.VITE_BACKEND_URL;
+    if (!backendUrl || typeof EventSource === "undefined") return;
+    const stream = new EventSource(`${backendUrl}api/ofertas/stream`);
+    const ofertasDe = (event) => JSON.parse(event.data).ofertas || [];
+
+    stream.addEventListener("creada", (event) => {
+      const nuevas = ofertasDe(event);
+      setOffers(prev => {
+        const ids = new Set(prev.map(oferta => oferta.id));
+        return [...prev, ...nuevas.filter(oferta => !ids.has(oferta.id))];
+      });
+    });
+    // El listado solo tiene ofertas disponibles: las compradas salen de él
+    stream.addEventListener("comprada", (event) => {
+      const compradas = new Set(ofertasDe(event).map(oferta => oferta.id));
+      setOffers(prev => prev.filter(oferta => !compradas.has(oferta.id)));
+    });
+    stream.addEventListener("borrada", (event) => {
+      const borradas = new Set(ofertasDe(event).map(oferta => oferta.id));
+      setOffers(prev => prev.filter(oferta => !borradas.has(oferta.id)));
+    });
+    // Nos perdimos eventos: recargar el listado entero
+    stream.addEventListener("reinicio", fetchOffers);
+
+    return () => stream.close();
   }, []);
 
   const handleChange = (e) => {
@@ -100,10 +122,10 @@ export const Home = () => {
         esta_realizada: false
       });
 
-      // Refresh offers list
-      const updatedOffers = await fetch(`${backendUrl}api/user/ofertas`);
-      const updatedData = await updatedOffers.json();
-      setOffers(updatedData.ofertas || []);
+      // Añadirla ya; el evento "creada" del stream no la duplica
+      setOffers(prev => prev.some(oferta => oferta.id === data.oferta.id)
+        ? prev
+        : [...prev, data.oferta]);
 
     } catch (err) {
       console.error('Error submitting offer:', err);
@@ -6,6 +6,9 @@ import { APIProvider, Map, AdvancedMarker } from '@vis.gl/react-google-maps';
 import { beautifulStyles } from "../styles/beautifulStyles";
 import {BorrarOfertasBoton} from "../components/BorrarOfertasBoton"
 
+// Las imágenes subidas a la API vienen como rutas /api/imagenes/...
+const imagenUrl = (url) => url.startsWith("/") ? `${import.meta.env.VITE_BACKEND_URL}${url.slice(1)}` : url;
+
 export const OfertaId = () => {
   const { store } = useGlobalReducer();
   const { id } = useParams();
@@ -256,8 +259,12 @@ export const OfertaId = () => {
                             boxShadow: '0 8px 25px rgba(0,0,0,0.1)',
                             border: '2px solid rgba(244, 208, 63, 0.2)'
                           }}>
+                            <picture>
+                            {oferta.img_derivadas && (
+                              <source type="image/webp" srcSet={imagenUrl(oferta.img_derivadas.media.webp)} />
+                            )}
                             <img 
-                              src={oferta.img_cosecha} 
+                              src={imagenUrl(oferta.img_derivadas ? oferta.img_derivadas.media.jpg : oferta.img_cosecha)} 
                               alt={oferta.titulo}
                               style={{ 
                                 width: '100%', 
@@ -269,6 +276,7 @@ export const OfertaId = () => {
                                 e.target.style.display = 'none';
                               }}
                             />
+                            </picture>
                           </div>
                         </div>
                       )}
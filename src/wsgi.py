@@ -1,6 +1,14 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
+from gevent import monkey
+
+# With gunicorn's gevent worker (see Procfile) psycopg2 has to yield to the
+# other greenlets while it waits for Postgres instead of blocking the worker
+if monkey.is_module_patched("socket"):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
 from app import app as application
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""
+Shared fixtures. src/app.py reads its settings from the environment when
+it's imported, so they are set here first: every test session gets its own
+SQLite database, migrated once, plus rate limiter and image directories in
+a temporary directory. Passwords hash inline at the lowest bcrypt cost.
+
+Tests that take the base_de_datos fixture run a second time on Postgres
+when TEST_POSTGRES_URL points at a scratch database, and skip that run
+otherwise.
+"""
+import itertools
+import os
+import sys
+import tempfile
+import uuid
+from collections import OrderedDict
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix="mercadoespanol-tests-")
+
+os.environ.update({
+    "DATABASE_URL": "sqlite:///" + os.path.join(TMP, "test.db"),
+    "RATELIMIT_STORAGE_URI": "sqlite:///" + os.path.join(TMP, "ratelimit.db"),
+    "IMAGES_DIR": os.path.join(TMP, "imagenes"),
+    "JWT_SECRET_KEY": "clave-de-pruebas-con-longitud-suficiente-para-hs256",
+    "MAIL_USERNAME": "pruebas@mercadoespanol.test",
+    "MAIL_PASSWORD": "pruebas",
+    "FLASK_DEBUG": "1",
+    "BCRYPT_ROUNDS": "4",
+    "HASH_POOL_SIZE": "0",
+    "IMAGE_POOL_SIZE": "0",
+})
+os.environ.pop("DATABASE_REPLICA_URL", None)
+POSTGRES_URL = os.environ.pop("TEST_POSTGRES_URL", None)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+
+@pytest.fixture(scope="session")
+def app():
+    import flask_migrate
+    from app import app as flask_app
+    from api.limiter import limiter
+
+    flask_app.config["TESTING"] = True
+    limiter.enabled = False
+    with flask_app.app_context():
+        flask_migrate.upgrade(directory=os.path.join(ROOT, "migrations"))
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope="session")
+def motor_postgres(app):
+    """Engine of TEST_POSTGRES_URL with its public schema recreated and
+    migrated, once per session"""
+    if not POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL no definida")
+    import flask_migrate
+    from sqlalchemy import create_engine, text
+    from api.database import engine_options
+
+    url = POSTGRES_URL.replace("postgres://", "postgresql://", 1)
+    engine = create_engine(url, **engine_options(url))
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        _usar_motor(app, engine, monkeypatch)
+        with app.app_context():
+            flask_migrate.upgrade(directory=os.path.join(ROOT, "migrations"))
+    yield engine
+    engine.dispose()
+
+
+def _usar_motor(app, engine, monkeypatch):
+    """Point the app's default engine at engine, with the in-process caches
+    of the other database emptied"""
+    from api import cache
+    from api.delivery import offer_arrays
+    from api.identity import user_cache
+    from api.models import db
+
+    monkeypatch.setitem(db._app_engines[app], None, engine)
+    monkeypatch.setattr(cache, "_entries", OrderedDict())
+    monkeypatch.setattr(cache, "_entries_version", None)
+    user_cache.clear()
+    offer_arrays.clear()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def base_de_datos(request, app, monkeypatch):
+    """Runs the test on the session's SQLite and on TEST_POSTGRES_URL,
+    returns the dialect name"""
+    if request.param == "postgresql":
+        _usar_motor(app, request.getfixturevalue("motor_postgres"), monkeypatch)
+    yield request.param
+    if request.param == "postgresql":
+        from api.delivery import offer_arrays
+        from api.identity import user_cache
+        user_cache.clear()
+        offer_arrays.clear()
+
+
+_usuarios = itertools.count()
+
+
+@pytest.fixture
+def crear_usuario(app):
+    """Factory of users with a unique email and coordinates (both are
+    unique), returns (id, Authorization headers)"""
+    from flask_jwt_extended import create_access_token
+    from api.hashing import hasher
+    from api.models import db, User
+
+    def crear(coordenates=None, **campos):
+        if coordenates is None:
+            n = next(_usuarios)
+            coordenates = f"{40 + n // 1000 * 0.001:.3f},{-3.7 + n % 1000 * 0.001:.3f}"
+        with app.app_context():
+            user = User(email=f"{uuid.uuid4().hex[:12]}@pruebas.test",
+                        password=hasher.hash_password("123456"), name="Pruebas",
+                        coordenates=coordenates, vehicle=False, **campos)
+            db.session.add(user)
+            db.session.commit()
+            return user.id, {"Authorization": "Bearer " + create_access_token(identity=str(user.id))}
+
+    return crear
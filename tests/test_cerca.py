@@ -0,0 +1,61 @@
+"""GET /api/ofertas/cerca against a brute-force nearest search"""
+import random
+from math import radians, degrees, sin, cos, asin, atan2
+import pytest
+from api.cache import bump_catalogue_version
+from api.geo import covering_prefixes, encode_geohash, haversine_km
+from api.models import db, User, Oferta
+from api.stats import record_ofertas
+
+# Lejos de las demás ofertas de las pruebas
+CENTRO = (10.0, 10.0)
+
+
+@pytest.fixture(scope="module")
+def ofertas(app):
+    rnd = random.Random(7)
+    puntos = [(CENTRO[0] + rnd.gauss(0, 0.5), CENTRO[1] + rnd.gauss(0, 0.5)) for _ in range(2000)]
+    with app.app_context():
+        vendedor = User(email="cerca@pruebas.test", password="x", name="Pruebas",
+                        coordenates="cerca", vehicle=False)
+        db.session.add(vendedor)
+        db.session.flush()
+        filas = [Oferta(id_vendedor=vendedor.id, esta_realizada=i % 5 == 0, titulo="Naranjas",
+                        descripcion="", coordenates_vendedor=f"{lat},{lng}", ud="kg",
+                        precio_ud=1.0, lat_vendedor=lat, lng_vendedor=lng,
+                        geohash_vendedor=encode_geohash(lat, lng))
+                 for i, (lat, lng) in enumerate(puntos)]
+        db.session.add_all(filas)
+        record_ofertas(nuevas=filas)
+        bump_catalogue_version()
+        db.session.commit()
+        return [(o.id, o.lat_vendedor, o.lng_vendedor) for o in filas if not o.esta_realizada]
+
+
+@pytest.mark.parametrize("radio,limite", [(0.5, 20), (5, 1), (5, 100), (25, 20), (200, 50)])
+def test_devuelve_las_mas_cercanas(client, ofertas, radio, limite):
+    rnd = random.Random(radio)
+    for _ in range(5):
+        lat, lng = CENTRO[0] + rnd.uniform(-1, 1), CENTRO[1] + rnd.uniform(-1, 1)
+        esperado = sorted((haversine_km(lat, lng, o_lat, o_lng), o_id) for o_id, o_lat, o_lng in ofertas)
+        esperado = [o_id for distancia, o_id in esperado if distancia <= radio][:limite]
+        respuesta = client.get(f"/api/ofertas/cerca?lat={lat}&lng={lng}&radio={radio}&limite={limite}")
+        assert respuesta.status_code == 200
+        assert [o["id"] for o in respuesta.json["ofertas"]] == esperado
+
+
+@pytest.mark.parametrize("lat,lng", [(40.4, -3.7), (0.0, 179.99), (-33.9, 151.2), (89.9, 0.0)])
+@pytest.mark.parametrize("radio", [0.1, 1, 5, 25, 200])
+def test_las_celdas_cubren_el_circulo(lat, lng, radio):
+    prefijos = covering_prefixes(lat, lng, radio)
+    assert 0 < len(prefijos) <= 16
+    rnd = random.Random(1)
+    for _ in range(500):
+        # Punto al azar dentro del círculo: distancia y rumbo
+        d, rumbo = radio * rnd.random() ** 0.5 / 6371.0, radians(rnd.uniform(0, 360))
+        p_lat = asin(sin(radians(lat)) * cos(d) + cos(radians(lat)) * sin(d) * cos(rumbo))
+        p_lng = radians(lng) + atan2(sin(rumbo) * sin(d) * cos(radians(lat)),
+                                     cos(d) - sin(radians(lat)) * sin(p_lat))
+        p_lng = (degrees(p_lng) + 180) % 360 - 180
+        geohash = encode_geohash(degrees(p_lat), p_lng)
+        assert any(geohash.startswith(prefijo) for prefijo in prefijos)
@@ -0,0 +1,71 @@
+"""Concurrent purchases (PUT /api/user/oferta/comprar/<id>), on SQLite and,
+with TEST_POSTGRES_URL, on Postgres"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from api.models import db, Oferta, EventoOferta
+from api.stats import find_drift
+
+COMPRADORES = 12
+OFERTAS_RENDIMIENTO = 200
+
+
+def _publicar(client, vendedor, n):
+    ids = []
+    for _ in range(n):
+        respuesta = client.post("/api/user/ofertas", headers=vendedor, json={
+            "titulo": "Naranjas", "descripcion": "De Valencia", "precio_ud": 1.5, "ud": "kg"})
+        assert respuesta.status_code == 201
+        ids.append(respuesta.json["oferta"]["id"])
+    return ids
+
+
+def _comprar(app, oferta_id, headers, barrera=None):
+    client = app.test_client()
+    if barrera is not None:
+        barrera.wait()
+    return client.put(f"/api/user/oferta/comprar/{oferta_id}", headers=headers).status_code
+
+
+def test_solo_una_compra_simultanea_gana(app, client, crear_usuario, base_de_datos):
+    _, vendedor = crear_usuario()
+    oferta_id, = _publicar(client, vendedor, 1)
+    compradores = [crear_usuario() for _ in range(COMPRADORES)]
+    barrera = threading.Barrier(COMPRADORES)
+
+    with ThreadPoolExecutor(max_workers=COMPRADORES) as pool:
+        estados = list(pool.map(lambda headers: _comprar(app, oferta_id, headers, barrera),
+                                [headers for _, headers in compradores]))
+
+    assert sorted(estados) == [200] + [409] * (COMPRADORES - 1)
+    ganador = compradores[estados.index(200)][0]
+    with app.app_context():
+        oferta = db.session.get(Oferta, oferta_id)
+        assert oferta.esta_realizada and oferta.id_comprador == ganador
+        # One purchase in the stats and in the change feed
+        assert find_drift() == []
+        compradas = db.session.execute(
+            select(EventoOferta.datos).where(EventoOferta.tipo == "comprada")).scalars()
+        assert sum(oferta_id in [o["id"] for o in json.loads(datos)["ofertas"]]
+                   for datos in compradas) == 1
+
+
+def test_rendimiento_de_compras(app, client, crear_usuario, base_de_datos):
+    _, vendedor = crear_usuario()
+    ofertas = _publicar(client, vendedor, OFERTAS_RENDIMIENTO)
+    compradores = [headers for _, headers in (crear_usuario() for _ in range(COMPRADORES))]
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=COMPRADORES) as pool:
+        estados = list(pool.map(
+            lambda i: _comprar(app, ofertas[i], compradores[i % COMPRADORES]),
+            range(OFERTAS_RENDIMIENTO)))
+    segundos = time.perf_counter() - inicio
+
+    assert estados == [200] * OFERTAS_RENDIMIENTO
+    print(f"\n{base_de_datos}: {OFERTAS_RENDIMIENTO / segundos:.1f} compras/s "
+          f"({COMPRADORES} compradores en paralelo)")
+    with app.app_context():
+        assert find_drift() == []
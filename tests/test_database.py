@@ -0,0 +1,97 @@
+"""Read-replica routing (api/database.py) with two local SQLite files"""
+import pytest
+from flask import Flask, jsonify
+from sqlalchemy import insert, select, update
+from api.database import configure_database, solo_lectura, REPLICA_BIND
+from api.models import db, User
+
+
+def _usuario(email):
+    return {"email": email, "password": "x", "name": "Pruebas", "vehicle": False,
+            "coordenates": email}
+
+
+def _emails(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(User.email).order_by(User.id)).scalars().all()
+
+
+def _crear_app(monkeypatch, tmp_path, replica):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'primaria.db'}")
+    if replica:
+        monkeypatch.setenv("DATABASE_REPLICA_URL", f"sqlite:///{tmp_path / 'replica.db'}")
+    else:
+        monkeypatch.delenv("DATABASE_REPLICA_URL", raising=False)
+    app = Flask(__name__)
+    configure_database(app)
+    db.init_app(app)
+
+    @app.route("/leer")
+    @solo_lectura
+    def leer():
+        return jsonify(db.session.execute(select(User.email).order_by(User.id)).scalars().all())
+
+    @app.route("/escribir", methods=["POST"])
+    def escribir():
+        db.session.add(User(**_usuario("nuevo@pruebas.test")))
+        db.session.commit()
+        return jsonify("ok")
+
+    @app.route("/escribir-y-leer", methods=["POST"])
+    @solo_lectura
+    def escribir_y_leer():
+        db.session.add(User(**_usuario("propio@pruebas.test")))
+        db.session.flush()
+        return jsonify(db.session.execute(select(User.email).order_by(User.id)).scalars().all())
+
+    @app.route("/actualizar-y-leer", methods=["POST"])
+    @solo_lectura
+    def actualizar_y_leer():
+        db.session.execute(update(User).values(name="Actualizado"))
+        nombres = db.session.execute(select(User.name)).scalars().all()
+        db.session.commit()
+        return jsonify(nombres)
+
+    # Same schema in both files and one row that tells them apart
+    with app.app_context():
+        db.create_all(bind_key=None)
+        with db.engine.begin() as conn:
+            conn.execute(insert(User), [_usuario("primaria@pruebas.test")])
+        if replica:
+            db.metadata.create_all(db.engines[REPLICA_BIND])
+            with db.engines[REPLICA_BIND].begin() as conn:
+                conn.execute(insert(User), [_usuario("replica@pruebas.test")])
+    return app
+
+
+@pytest.fixture
+def con_replica(monkeypatch, tmp_path):
+    return _crear_app(monkeypatch, tmp_path, replica=True)
+
+
+def test_lecturas_van_a_la_replica(con_replica):
+    assert con_replica.test_client().get("/leer").json == ["replica@pruebas.test"]
+
+
+def test_escrituras_van_a_la_primaria(con_replica):
+    assert con_replica.test_client().post("/escribir").status_code == 200
+    with con_replica.app_context():
+        assert _emails(db.engine) == ["primaria@pruebas.test", "nuevo@pruebas.test"]
+        assert _emails(db.engines[REPLICA_BIND]) == ["replica@pruebas.test"]
+
+
+def test_leer_despues_de_escribir_va_a_la_primaria(con_replica):
+    client = con_replica.test_client()
+    assert client.post("/escribir-y-leer").json == ["primaria@pruebas.test", "propio@pruebas.test"]
+    assert client.post("/actualizar-y-leer").json == ["Actualizado"]
+    with con_replica.app_context():
+        assert _emails(db.engines[REPLICA_BIND]) == ["replica@pruebas.test"]
+    # The next request starts on the replica again
+    assert client.get("/leer").json == ["replica@pruebas.test"]
+
+
+def test_sin_replica_todo_va_a_la_primaria(monkeypatch, tmp_path):
+    app = _crear_app(monkeypatch, tmp_path, replica=False)
+    client = app.test_client()
+    assert client.get("/leer").json == ["primaria@pruebas.test"]
+    assert client.post("/escribir-y-leer").json == ["primaria@pruebas.test", "propio@pruebas.test"]
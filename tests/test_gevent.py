@@ -0,0 +1,151 @@
+"""
+The app under gunicorn's gevent worker, as in the Procfile
+
+bcrypt (api/hashing.py) and Pillow (api/images.py) run on process pools
+whose futures are waited on from a greenlet, and the rate limiter keeps
+SQLite connections per process (api/limiter.py). With one worker, other
+requests have to keep being served while the pools work, and the limiter
+must not open a connection per greenlet.
+"""
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+import pytest
+from PIL import Image
+from conftest import ROOT, TMP
+from api.models import db, User
+
+pytest.importorskip("gevent")
+
+LOGINS = 4
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _peticion(url, metodo="GET", cuerpo=None, headers=None, tipo="application/json"):
+    headers = dict(headers or {})
+    if cuerpo is not None:
+        headers["Content-Type"] = tipo
+    req = urllib.request.Request(url, data=cuerpo, method=metodo, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=30) as respuesta:
+            return respuesta.status, respuesta.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.read()
+
+
+@pytest.fixture(scope="module")
+def servidor(app):
+    puerto = _puerto_libre()
+    env = dict(os.environ, FLASK_DEBUG="0", HASH_POOL_SIZE="2", IMAGE_POOL_SIZE="1",
+               RATELIMIT_STORAGE_URI="sqlite:///" + os.path.join(TMP, "ratelimit-gevent.db"),
+               LOGIN_RATE_LIMIT="1000 per minute")
+    # Run from the temporary directory: outside debug the app logs to ./logs
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "wsgi", "--pythonpath", os.path.join(ROOT, "src"),
+         "--worker-class", "gevent", "--workers", "1", "--bind", f"127.0.0.1:{puerto}"],
+        cwd=TMP, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{puerto}"
+    try:
+        for _ in range(150):
+            try:
+                _peticion(base + "/api/imagenes/" + "0" * 32)
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            pytest.fail("gunicorn no arrancó")
+        yield base, proceso
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+
+
+def _ping(base, parar, latencias):
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        _peticion(base + "/api/imagenes/" + "0" * 32)
+        latencias.append(time.perf_counter() - inicio)
+        time.sleep(0.01)
+
+
+def _mientras_hace_ping(base, trabajos):
+    """Results of the trabajos run in parallel, and the latencies of a cheap
+    request sent meanwhile"""
+    parar, latencias = threading.Event(), []
+    ping = threading.Thread(target=_ping, args=(base, parar, latencias))
+    ping.start()
+    try:
+        with ThreadPoolExecutor(max_workers=len(trabajos)) as pool:
+            resultados = list(pool.map(lambda trabajo: trabajo(), trabajos))
+    finally:
+        parar.set()
+        ping.join()
+    return resultados, sorted(latencias)
+
+
+def test_bcrypt_e_imagenes_no_bloquean_el_worker(app, servidor):
+    base, _ = servidor
+    # Full cost, so each check takes long enough to show a blocked worker
+    hashed = bcrypt.hashpw(b"123456", bcrypt.gensalt(12)).decode()
+    emails = [f"{uuid.uuid4().hex[:12]}@pruebas.test" for _ in range(LOGINS)]
+    with app.app_context():
+        for email in emails:
+            db.session.add(User(email=email, password=hashed, name="Pruebas", vehicle=False,
+                                coordenates=f"gevent-{email}"))
+        db.session.commit()
+
+    def login(email):
+        cuerpo = json.dumps({"email": email, "password": "123456"}).encode()
+        return _peticion(base + "/api/user/login", "POST", cuerpo)
+
+    respuestas, latencias = _mientras_hace_ping(base, [lambda e=e: login(e) for e in emails])
+    assert [estado for estado, _ in respuestas] == [200] * LOGINS
+    assert latencias[len(latencias) // 2] < 0.1
+    token = json.loads(respuestas[0][1])["token"]
+
+    def subir():
+        imagen = io.BytesIO()
+        Image.effect_noise((2000, 1500), 60).convert("RGB").save(imagen, "JPEG", quality=95)
+        limite = uuid.uuid4().hex
+        cuerpo = (f"--{limite}\r\nContent-Disposition: form-data; name=\"imagen\"; "
+                  "filename=\"cosecha.jpg\"\r\nContent-Type: image/jpeg\r\n\r\n").encode() \
+            + imagen.getvalue() + f"\r\n--{limite}--\r\n".encode()
+        estado, respuesta = _peticion(base + "/api/user/imagenes", "POST", cuerpo,
+                                      {"Authorization": "Bearer " + token},
+                                      "multipart/form-data; boundary=" + limite)
+        assert estado == 201
+        url = json.loads(respuesta)["img_cosecha"]
+        return _peticion(base + url + "/960.webp")[0]
+
+    estados, latencias = _mientras_hace_ping(base, [subir, subir])
+    assert estados == [200, 200]
+    assert latencias[len(latencias) // 2] < 0.1
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_limiter_no_abre_una_conexion_por_greenlet(servidor):
+    base, proceso = servidor
+    with ThreadPoolExecutor(max_workers=50) as pool:
+        estados = list(pool.map(lambda _: _peticion(base + "/api/ofertas?limite=1")[0], range(200)))
+    assert set(estados) <= {200, 429}
+
+    worker = subprocess.check_output(["pgrep", "-P", str(proceso.pid)]).split()[0].decode()
+    ficheros = [os.readlink(os.path.join(f"/proc/{worker}/fd", fd))
+                for fd in os.listdir(f"/proc/{worker}/fd")]
+    conexiones = sum(f.endswith("ratelimit-gevent.db") for f in ficheros)
+    assert 1 <= conexiones <= 2
@@ -0,0 +1,45 @@
+"""GET /api/imagenes/<clave>/<variante> when rendering fails (api/images.py)"""
+import io
+import os
+import uuid
+from PIL import Image
+from api.images import image_store
+
+
+def _guardar_original(contenido):
+    clave = uuid.uuid4().hex
+    path = image_store._original_path(clave, "jpg")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(contenido)
+    return clave, path
+
+
+def test_genera_la_version_reducida(client):
+    imagen = io.BytesIO()
+    Image.new("RGB", (800, 600), (200, 120, 40)).save(imagen, "JPEG")
+    clave, _ = _guardar_original(imagen.getvalue())
+    respuesta = client.get(f"/api/imagenes/{clave}/320.webp")
+    assert respuesta.status_code == 200
+    assert Image.open(io.BytesIO(respuesta.data)).width == 320
+
+
+def test_original_corrupto_da_500_y_queda_en_el_log(client, caplog):
+    clave, _ = _guardar_original(b"no es una imagen")
+    assert client.get(f"/api/imagenes/{clave}/320.webp").status_code == 500
+    assert clave in caplog.text
+
+
+def test_original_borrado_durante_la_generacion_da_404(client, monkeypatch):
+    clave, path = _guardar_original(b"")
+    encontrar = image_store._find_original
+
+    def borrado_despues(clave):
+        encontrado = encontrar(clave)
+        os.remove(path)
+        return encontrado
+
+    monkeypatch.setattr(image_store, "_find_original", borrado_despues)
+    assert client.get(f"/api/imagenes/{clave}/320.webp").status_code == 404
+    open(path, "wb").close()
+    assert client.get(f"/api/imagenes/{clave}").status_code == 404
@@ -0,0 +1,29 @@
+"""Rate limits per client behind the proxy (api/limiter.py)"""
+import pytest
+from api.limiter import limiter
+
+PROXY = "10.0.0.1"
+
+
+@pytest.fixture
+def limite_de_login(app, monkeypatch):
+    monkeypatch.setitem(app.config, "LOGIN_RATE_LIMIT", "2 per minute")
+    monkeypatch.setattr(limiter, "enabled", True)
+
+
+def _login(client, ip):
+    return client.post("/api/user/login", json={"email": "nadie@pruebas.test", "password": "123456"},
+                       headers={"X-Forwarded-For": ip},
+                       environ_base={"REMOTE_ADDR": PROXY}).status_code
+
+
+def test_cada_cliente_tras_el_proxy_tiene_su_limite(client, limite_de_login):
+    assert [_login(client, "198.51.100.1") for _ in range(3)][-1] == 429
+    # Mismo proxy, otro cliente: no comparte el límite del primero
+    assert _login(client, "198.51.100.2") != 429
+
+
+def test_solo_cuenta_la_ip_que_añade_el_proxy(client, limite_de_login):
+    # El cliente puede inventarse entradas anteriores de X-Forwarded-For
+    estados = [_login(client, f"203.0.113.{n}, 198.51.100.3") for n in range(3)]
+    assert estados[-1] == 429
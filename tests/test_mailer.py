@@ -0,0 +1,163 @@
+"""Mail dispatcher (api/mailer.py) against an aiosmtpd stand-in for the SMTP server"""
+import queue
+import socket
+from datetime import datetime, timedelta
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import delete
+from api.mailer import MailQueue
+from api.models import db, CorreoPendiente
+
+
+class Buzon:
+    """aiosmtpd handler keeping the messages it accepts; fallos makes the
+    next that many deliveries fail with a 451"""
+
+    def __init__(self):
+        self.recibidos = []
+        self.fallos = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.fallos:
+            self.fallos -= 1
+            return "451 Inténtalo más tarde"
+        self.recibidos.append(envelope)
+        return "250 OK"
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def buzon(app, monkeypatch):
+    handler = Buzon()
+    controller = Controller(handler, hostname="127.0.0.1", port=_puerto_libre())
+    controller.start()
+    estado = app.extensions["mail"]
+    for campo, valor in (("server", "127.0.0.1"), ("port", controller.port), ("use_tls", False),
+                         ("use_ssl", False), ("username", None), ("password", None),
+                         ("suppress", False)):
+        monkeypatch.setattr(estado, campo, valor)
+    yield handler
+    controller.stop()
+
+
+def _cola(app):
+    """MailQueue driven by the test instead of its worker thread"""
+    cola = MailQueue()
+    cola.app = app
+    cola._queue = queue.Queue()
+    cola._ensure_started = lambda: None
+    return cola
+
+
+@pytest.fixture
+def cola(app, buzon):
+    cola = _cola(app)
+    with app.app_context():
+        yield cola
+        cola._close()
+        db.session.rollback()
+        db.session.execute(delete(CorreoPendiente))
+        db.session.commit()
+
+
+def _encolar(cola, asunto="Hola"):
+    return cola.enqueue(asunto, ["comprador@pruebas.test"], "<p>Hola</p>").id
+
+
+def _vencer(correo_id):
+    """Move the next attempt to the past instead of waiting for the backoff"""
+    correo = db.session.get(CorreoPendiente, correo_id)
+    correo.siguiente_intento = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_entrega_y_borra_el_correo(cola, buzon):
+    correo_id = _encolar(cola)
+    assert cola._queue.get_nowait() == correo_id
+    cola._deliver(correo_id)
+
+    assert [e.rcpt_tos for e in buzon.recibidos] == [["comprador@pruebas.test"]]
+    assert db.session.get(CorreoPendiente, correo_id) is None
+
+
+def test_reutiliza_la_conexion(app, cola, buzon, monkeypatch):
+    primero = _encolar(cola)
+    cola._deliver(primero)
+    conexion = cola._connection
+    cola._deliver(_encolar(cola))
+    assert cola._connection is conexion and len(buzon.recibidos) == 2
+
+    monkeypatch.setitem(app.config, "MAIL_IDLE_TIMEOUT", -1)
+    cola._close_if_idle()
+    assert cola._connection is None
+
+
+def test_solo_un_worker_reserva_el_correo(app, cola, buzon):
+    correo_id = _encolar(cola)
+    otra = _cola(app)
+
+    assert cola._claim(correo_id)
+    assert not otra._claim(correo_id)
+    otra._deliver(correo_id)
+    assert buzon.recibidos == []
+    assert correo_id not in otra._due_ids()
+
+    # A reservation that expired (the worker died mid delivery) can be taken again
+    correo = db.session.get(CorreoPendiente, correo_id)
+    correo.reservado_hasta = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert correo_id in otra._due_ids()
+    otra._deliver(correo_id)
+    cola._deliver(correo_id)
+    assert len(buzon.recibidos) == 1
+    otra._close()
+
+
+def test_reintenta_con_backoff_exponencial(app, cola, buzon, monkeypatch):
+    monkeypatch.setitem(app.config, "MAIL_RETRY_BASE_SECONDS", 5)
+    monkeypatch.setitem(app.config, "MAIL_RETRY_MAX_SECONDS", 15)
+    monkeypatch.setitem(app.config, "MAIL_MAX_RETRIES", 5)
+    buzon.fallos = 3
+    correo_id = _encolar(cola)
+
+    for intentos, espera in ((1, 5), (2, 10), (3, 15)):
+        antes = datetime.utcnow()
+        cola._deliver(correo_id)
+        correo = db.session.get(CorreoPendiente, correo_id)
+        assert correo.intentos == intentos
+        assert not correo.fallido and correo.reservado_hasta is None
+        assert "451" in correo.ultimo_error
+        retraso = (correo.siguiente_intento - antes).total_seconds()
+        assert espera - 1 < retraso < espera + 1
+        # Not due until the backoff passes
+        assert correo_id not in cola._due_ids()
+        cola._deliver(correo_id)
+        assert db.session.get(CorreoPendiente, correo_id).intentos == intentos
+        _vencer(correo_id)
+
+    assert correo_id in cola._due_ids()
+    cola._deliver(correo_id)
+    assert len(buzon.recibidos) == 1
+    assert db.session.get(CorreoPendiente, correo_id) is None
+
+
+def test_se_rinde_tras_el_maximo_de_intentos(app, cola, buzon, monkeypatch):
+    monkeypatch.setitem(app.config, "MAIL_MAX_RETRIES", 3)
+    buzon.fallos = 10
+    correo_id = _encolar(cola)
+
+    for _ in range(3):
+        cola._deliver(correo_id)
+        _vencer(correo_id)
+
+    correo = db.session.get(CorreoPendiente, correo_id)
+    assert correo.fallido and correo.intentos == 3
+    assert correo_id not in cola._due_ids()
+    assert not cola._claim(correo_id)
+    assert buzon.recibidos == []
+    assert buzon.fallos == 7
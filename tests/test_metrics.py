@@ -0,0 +1,6 @@
+"""/metrics (api/metrics.py)"""
+
+
+def test_metrics_no_se_expone_sin_token(client):
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 404
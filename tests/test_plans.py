@@ -0,0 +1,72 @@
+"""Query plans of the route statements (api/plans.py) on generated data,
+on SQLite and, with TEST_POSTGRES_URL, on Postgres"""
+import itertools
+import pytest
+from sqlalchemy import select, func
+from api import queries
+from api.dataset import generate
+from api.models import db, Oferta
+from api.plans import LIMITE, analyze, route_queries, sequential_scans, explain
+from api.recommendations import compute_recommendations
+from api.serialization import select_ofertas
+
+OFERTAS = 10000
+
+# Recorrido de la clave primaria en el plan de cada base de datos
+CLAVE_PRIMARIA = {"sqlite": "PRIMARY KEY", "postgresql": "oferta_pkey"}
+
+_con_datos = set()
+
+
+@pytest.fixture
+def datos(app, base_de_datos):
+    """Generates the data once per database, returns the dialect name"""
+    if base_de_datos not in _con_datos:
+        with app.app_context():
+            generate(OFERTAS // 20, OFERTAS, password_hash="x", log=lambda _: None)
+            # Sin filas en recomendacion cualquier plan sirve
+            compute_recommendations(k=5, procesos=1, log=lambda _: None)
+            analyze()
+        _con_datos.add(base_de_datos)
+    return base_de_datos
+
+
+def test_ninguna_consulta_de_las_rutas_recorre_una_tabla(app, datos):
+    with app.app_context():
+        consultas = route_queries()
+        # Todas las combinaciones de filtros de GET /user/ofertas
+        assert sum(nombre.startswith("GET /user/ofertas") for nombre, _ in consultas) == 3 * 2 ** 5
+        fallos = {nombre: explain(stmt) for nombre, stmt in consultas if sequential_scans(stmt)}
+        assert fallos == {}
+
+
+def test_los_filtros_selectivos_no_recorren_la_clave_primaria(app, datos):
+    # Con cursor o sin él (id > 0) el listado es un rango sobre la clave
+    # primaria, que con una ud poco frecuente o un precio entre dos valores
+    # cercanos leería casi toda la tabla para llenar una página
+    with app.app_context():
+        ud = db.session.execute(
+            select(Oferta.ud).group_by(Oferta.ud).order_by(func.count(), Oferta.ud).limit(1)).scalar()
+        mitad = db.session.execute(select(func.max(Oferta.id))).scalar() // 2
+        # Un precio de los datos generados, no de las ofertas de otros tests
+        precio = db.session.execute(
+            select(Oferta.precio_ud).where(Oferta.id >= mitad, Oferta.precio_ud.isnot(None))
+            .order_by(Oferta.id).limit(1)).scalar()
+        for filtros in ({"ud": ud}, {"precio_min": precio * 0.99, "precio_max": precio * 1.01},
+                        {"ud": ud, "precio_min": precio * 0.99, "precio_max": precio * 1.01}):
+            for esta_realizada, ultimo_id in itertools.product((None, False, True), (0, mitad)):
+                stmt = queries.ofertas_page(LIMITE, esta_realizada=esta_realizada,
+                                            ultimo_id=ultimo_id, **filtros)
+                plan = explain(stmt)
+                assert not any(CLAVE_PRIMARIA[datos] in linea for linea in plan), (filtros, plan)
+
+
+def test_detecta_un_recorrido_secuencial(app, datos):
+    with app.app_context():
+        assert sequential_scans(select_ofertas().filter(Oferta.titulo == "Patatas")) == ["oferta"]
+
+
+def test_comando_verificar_planes(app, datos):
+    resultado = app.test_cli_runner().invoke(args=["verificar-planes"])
+    assert resultado.exit_code == 0, resultado.output
+    assert "usan índices" in resultado.output